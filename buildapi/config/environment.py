@@ -12,6 +12,7 @@ import buildapi.lib.helpers
 from buildapi.config.routing import make_map
 from buildapi.model import init_scheduler_model, init_status_model,\
     init_buildapi_model
+from buildapi.model import shards, statements
 from buildapi.lib.mq import LoggingJobRequestPublisher, \
     LoggingJobRequestDoneConsumer
 
@@ -26,6 +27,8 @@ def setup_engine(engine):
             raise sqlalchemy.exc.DisconnectionError()
     if engine.dialect.name == 'mysql':
         sqlalchemy.event.listen(engine.pool, 'checkout', checkout_listener)
+    # let the reports stream their rows from server side cursors
+    statements.enableStreaming(engine)
 
 def load_environment(global_conf, app_conf):
     """Configure the Pylons environment via the ``pylons.config``
@@ -51,6 +54,7 @@ def load_environment(global_conf, app_conf):
     # Setup cache object as early as possible
     import pylons
     pylons.cache._push_object(config['pylons.app_globals'].cache)
+    shards.cache = config['pylons.app_globals'].report_shards
 
     # Create the Mako TemplateLookup, with the default auto-escaping
     config['pylons.app_globals'].mako_lookup = TemplateLookup(
@@ -61,6 +65,9 @@ def load_environment(global_conf, app_conf):
         imports=['from webhelpers.html import escape'])
 
     # Setup the SQLAlchemy database engine
+    if 'buildapi.stream_batch_size' in config:
+        statements.stream_batch_size = int(
+                config['buildapi.stream_batch_size'])
     scheduler_engine = engine_from_config(config, 'sqlalchemy.scheduler_db.')
     setup_engine(scheduler_engine)
     init_scheduler_model(scheduler_engine)
@@ -73,6 +80,9 @@ def load_environment(global_conf, app_conf):
     setup_engine(buildapi_engine)
     init_buildapi_model(buildapi_engine)
 
+    # forked before any other thread is started
+    shards.startProcesses(int(config.get('buildapi.shard_processes', 1)))
+
     # CONFIGURATION OPTIONS HERE (note: all config options will override
     # any Pylons config options)
 
@@ -84,7 +94,8 @@ def load_environment(global_conf, app_conf):
         # And our consumer
         config['pylons.app_globals'].mq_consumer = LoggingJobRequestDoneConsumer(
                 buildapi_engine,
-                config)
+                config,
+                buildapi_cache=config['pylons.app_globals'].buildapi_cache)
         thread.start_new_thread(config['pylons.app_globals'].mq_consumer.run, ())
     else:
         config['pylons.app_globals'].mq = None
@@ -82,6 +82,8 @@ def make_map(config):
     map.connect('job_status', '/self-serve/jobs/{job_id}', controller='selfserve', action='job_status')
     # History of requsts
     map.connect('jobs', '/self-serve/jobs', controller='selfserve', action='jobs')
+    # Cache statistics
+    map.connect('cache_stats', '/self-serve/cache_stats', controller='selfserve', action='cache_stats')
 
     # Read-only
     map.connect('selfserve_home', '/self-serve', controller='selfserve', action='index')
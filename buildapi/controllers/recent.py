@@ -7,6 +7,7 @@ from pylons.controllers.util import abort
 from buildapi.lib.base import BaseController, render
 from buildapi.model.query import GetHistoricBuilds
 from buildapi.lib import times
+from buildapi.lib.paging import encode_cursor, decode_cursor
 
 log = logging.getLogger(__name__)
 
@@ -30,7 +31,16 @@ class RecentController(BaseController):
         if 'slave' in request.GET:
             slave = request.GET.getall('slave')
 
-        builds = GetHistoricBuilds(slave=slave, count=count)
+        before = None
+        if 'cursor' in request.GET:
+            try:
+                before, = decode_cursor(request.GET.getone('cursor'), 1)
+            except ValueError, e:
+                abort(400, detail=str(e))
+
+        builds = GetHistoricBuilds(slave=slave, count=count, before=before)
+        if builds and len(builds) == count:
+            self.set_next_page(encode_cursor(builds[-1]['id']))
 
         # Return a rendered template
         # or, return a json blob
@@ -3,13 +3,13 @@ import urllib
 
 from pylons import request, response, session, tmpl_context as c, url
 from pylons.controllers.util import abort, redirect
-from pylons.decorators.cache import beaker_cache
 
 from buildapi.controllers.validators import PushesSchema, WaittimesSchema, \
 EndtoendSchema, EndtoendRevisionSchema, BuildersSchema, BuilderDetailsSchema, \
 IdleJobsSchema, SlaveDetailsSchema, SlavesSchema, TestRunSchema, \
 StatusBuildersSchema, StatusBuilderDetailsSchema
 from buildapi.lib import helpers as h
+from buildapi.lib.cache import report_cache
 from buildapi.lib.base import BaseController, render
 from buildapi.lib.visualization import gviz_pushes, gviz_pushes_intervals, \
 gviz_pushes_daily_intervals, gviz_waittimes, gviz_builders, \
@@ -49,9 +49,9 @@ class ReportsController(BaseController):
                 ('starttime', 'endtime', 'branch_name',
                 'platform', 'build_type', 'job_type', 'detail_level')])
 
-        @beaker_cache(expire=600, cache_response=False)
+        @report_cache('builders', expire=600, cache_response=False)
         def builders_get_report(**params):
-            return GetBuildersReport(**params)
+            return GetBuildersReport(sharded=True, **params)
         c.report = builders_get_report(**report_params)
 
         if format == 'json':
@@ -72,7 +72,7 @@ class ReportsController(BaseController):
         report_params = dict([(k, params[k]) for k in 
             ('starttime', 'endtime', 'buildername')])
 
-        @beaker_cache(expire=600, cache_response=False)
+        @report_cache('builder_details', expire=600, cache_response=False)
         def builder_details_get_report(**params):
             return GetBuilderTypeReport(**params)
         c.report = builder_details_get_report(**report_params)
@@ -92,9 +92,9 @@ class ReportsController(BaseController):
         report_params = dict([(k, params[k]) for k in 
             ('starttime', 'endtime', 'branch_name')])
 
-        @beaker_cache(expire=600, cache_response=False)
+        @report_cache('endtoend', expire=600, cache_response=False)
         def endtoend_get_report(**params):
-            return GetEndtoEndTimes(**params)
+            return GetEndtoEndTimes(sharded=True, **params)
         c.report = endtoend_get_report(**report_params)
 
         if format == 'json':
@@ -115,7 +115,7 @@ class ReportsController(BaseController):
         report_params = dict([(k, params[k]) for k in 
             ('branch_name', 'revision')])
 
-        @beaker_cache(expire=600, cache_response=False)
+        @report_cache('endtoend_revision', expire=600, cache_response=False)
         def endtoend_revision_get_report(**params):
             return GetBuildRun(**params)
         c.report = endtoend_revision_get_report(**report_params)
@@ -129,7 +129,7 @@ class ReportsController(BaseController):
         else:
             return render('/reports/buildrun.mako')
 
-    @beaker_cache(query_args=True)
+    @report_cache('idlejobs', query_args=True)
     def idlejobs(self):
         """Idle Jobs Report Controller."""
         req_params = dict(request.params)
@@ -158,9 +158,9 @@ class ReportsController(BaseController):
         report_params = dict([(k, params[k]) for k in 
             ('starttime', 'endtime', 'int_size', 'branches')])
 
-        @beaker_cache(expire=600, cache_response=False)
+        @report_cache('pushes', expire=600, cache_response=False)
         def pushes_get_report(**params):
-            return GetPushes(**params)
+            return GetPushes(sharded=True, **params)
         c.report = pushes_get_report(**report_params)
 
         if format == 'json':
@@ -185,9 +185,9 @@ class ReportsController(BaseController):
         report_params = dict([(k, params[k]) for k in 
             ('starttime', 'endtime', 'int_size', 'last_int_size')])
 
-        @beaker_cache(expire=600, cache_response=False)
+        @report_cache('slaves', expire=600, cache_response=False)
         def slaves_get_report(**params):
-            return GetSlavesReport(**params)
+            return GetSlavesReport(sharded=True, **params)
         c.report = slaves_get_report(**report_params)
 
         if format == 'json':
@@ -212,7 +212,7 @@ class ReportsController(BaseController):
         report_params = dict([(k, params[k]) for k in 
             ('slave_id', 'starttime', 'endtime', 'int_size', 'last_int_size')])
 
-        @beaker_cache(expire=600, cache_response=False)
+        @report_cache('slave_details', expire=600, cache_response=False)
         def slave_details_get_report(**params):
             return GetSlaveDetailsReport(**params)
         c.report = slave_details_get_report(**report_params)
@@ -237,7 +237,7 @@ class ReportsController(BaseController):
         report_params = dict([(k, params[k]) for k in 
             ('starttime', 'endtime')])
 
-        @beaker_cache(expire=600, cache_response=False)
+        @report_cache('status_builders', expire=600, cache_response=False)
         def status_builders_get_report(**params):
             return GetStatusBuildersReport(**params)
         c.report = status_builders_get_report(**report_params)
@@ -257,7 +257,7 @@ class ReportsController(BaseController):
         report_params = dict([(k, params[k]) for k in 
             ('builder_name', 'starttime', 'endtime')])
 
-        @beaker_cache(expire=600, cache_response=False)
+        @report_cache('status_builder_details', expire=600, cache_response=False)
         def status_builder_details_get_report(**params):
             return GetBuilderDetailsReport(**params)
         c.report = status_builder_details_get_report(**report_params)
@@ -277,8 +277,9 @@ class ReportsController(BaseController):
         report_params = dict([(k, params[k]) for k in 
             ('pool', 'mpb', 'starttime', 'endtime', 'int_size', 'maxb')])
 
+        @report_cache('waittimes', expire=600, cache_response=False)
         def waittimes_get_report(**params):
-            return GetWaitTimes(**params)
+            return GetWaitTimes(sharded=True, **params)
         c.report = waittimes_get_report(**report_params)
 
         num = params['num']
@@ -291,7 +292,7 @@ class ReportsController(BaseController):
             c.jscode_data = gviz_waittimes(c.report, num, resp_type='JSCode')
             return render('/reports/waittimes.mako')
 
-    @beaker_cache(query_args=True)
+    @report_cache('testruns', query_args=True)
     def testruns(self):
         """Test Runs Controller."""
         req_params = dict(request.params)
@@ -318,9 +319,9 @@ class ReportsController(BaseController):
         report_params = dict([(k, params[k]) for k in 
             ('starttime', 'endtime', 'branch_name')])
 
-        @beaker_cache(expire=600, cache_response=False)
+        @report_cache('trychooser', expire=600, cache_response=False)
         def trychooser_get_report(**params):
-            return TryChooserGetEndtoEndTimes(**params)
+            return TryChooserGetEndtoEndTimes(sharded=True, **params)
         c.report = trychooser_get_report(**report_params)
 
         if format == 'json':
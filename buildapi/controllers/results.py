@@ -6,7 +6,7 @@ from pylons.controllers.util import abort, redirect
 from pylons.decorators import jsonify
 
 from buildapi.lib.base import BaseController, render
-from buildapi.model.query import GetBuilds
+from buildapi.model.query import GetBuilds, IterBuilds
 
 log = logging.getLogger(__name__)
 
@@ -40,6 +40,16 @@ class ResultsController(BaseController):
         elif 'rev' in request.GET:
             rev = request.GET.getone('rev')
 
+        if format == 'json' and not self.revision:
+            # pending and running builds across all branches can be too
+            # many to hold in memory, so write them out as they're read
+            results = {}
+            if self.pending:
+                results['pending'] = IterBuilds(branch=branch, type='pending')
+            if self.running:
+                results['running'] = IterBuilds(branch=branch, type='running')
+            return self.jsonify_stream(results)
+
         if self.pending:
             c.pending_builds = GetBuilds(branch=branch, type='pending')
         if self.running:
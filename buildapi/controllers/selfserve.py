@@ -3,6 +3,7 @@ import logging
 from datetime import datetime
 
 from webhelpers.util import html_escape as e
+from sqlalchemy import and_, or_
 from sqlalchemy.orm.session import Session
 
 from pylons import request, response, tmpl_context as c, config, \
@@ -19,6 +20,7 @@ from buildapi.model.buildapidb import JobRequest
 from buildapi.lib.helpers import get_builders, url, get_branches, \
     get_completeness
 from buildapi.lib import json, times
+from buildapi.lib.paging import encode_cursor, decode_cursor
 
 log = logging.getLogger(__name__)
 access_log = logging.getLogger("buildapi.access")
@@ -65,17 +67,19 @@ class SelfserveController(BaseController):
     def _htmlify(self, obj):
         return "<pre>%s</pre>" % e(json.dumps(obj, indent=2))
 
-    def _format(self, obj):
+    def _format(self, obj, stream=False):
         if self._fmt == 'json':
+            if stream:
+                return self.jsonify_stream(obj)
             return self.jsonify(obj)
         else:
             return self._htmlify(obj)
 
-    def _ok(self, obj, status=200):
+    def _ok(self, obj, status=200, stream=False):
         response.status = status
         #obj['status'] = "OK"
         c.raw_data = obj
-        retval = self._format(obj)
+        retval = self._format(obj, stream)
         if self._fmt == 'json':
             # Disable redirecting to the Error middleware
             request.environ['pylons.status_code_redirect'] = True
@@ -181,7 +185,7 @@ class SelfserveController(BaseController):
             c.date = date
             c.today = today
             builds = g.buildapi_cache.get_builds_for_day(date, branch)
-            return self._ok(builds)
+            return self._ok(builds, stream=True)
 
     def build(self, branch, build_id):
         """Return information about a build"""
@@ -249,17 +253,29 @@ class SelfserveController(BaseController):
 
         return self._format(retval)
 
-    @beaker_cache(query_args=True, expire=60)
+    @beaker_cache(query_args=True, expire=60,
+            cache_headers=('content-type', 'content-length', 'link'))
     def user(self, branch, user):
-        """Return a list of builds for this user"""
+        """Return a list of builds for this user.  Older completed builds
+        are on the pages linked by the Link header."""
         if branch not in self._branches_cache:
             return self._failed("Branch %s not found" % branch, 404)
         else:
-            builds = getBuildsForUser(branch, user, limit=200)
+            before = None
+            if 'cursor' in request.GET:
+                try:
+                    before, = decode_cursor(request.GET['cursor'], 1)
+                except ValueError, e:
+                    return self._failed(str(e), 400)
+            builds = getBuildsForUser(branch, user, limit=200, before=before)
+            next = builds.pop('next')
+            if next is not None:
+                self.set_next_page(encode_cursor(next))
             return self._ok(builds)
 
     def jobs(self):
-        """Return a list of past self-serve requests"""
+        """Return a list of past self-serve requests, newest first.  Older
+        requests are on the pages linked by the Link header."""
         s = Session()
         try:
             num_jobs = IntValidator.to_python(request.GET.get('num', '100'))
@@ -267,7 +283,22 @@ class SelfserveController(BaseController):
         except formencode.Invalid:
             num_jobs = 100
             offset = 0
-        jobs = s.query(JobRequest).order_by(JobRequest.when.desc()).limit(num_jobs).offset(offset)
+        jobs = s.query(JobRequest).order_by(JobRequest.when.desc(),
+                JobRequest.id.desc())
+        if 'cursor' in request.GET:
+            try:
+                when, id = decode_cursor(request.GET['cursor'], 2)
+            except ValueError, e:
+                return self._failed(str(e), 400)
+            jobs = jobs.filter(or_(JobRequest.when < when,
+                and_(JobRequest.when == when, JobRequest.id < id)))
+        elif offset:
+            jobs = jobs.offset(offset)
+        # one more than asked for tells whether there's a next page
+        jobs = jobs.limit(num_jobs + 1).all()
+        if len(jobs) > num_jobs:
+            jobs = jobs[:num_jobs]
+            self.set_next_page(encode_cursor(jobs[-1].when, jobs[-1].id))
 
         return self._ok([j.asDict() for j in jobs])
 
@@ -283,6 +314,16 @@ class SelfserveController(BaseController):
 
         return self._ok(retval)
 
+    def cache_stats(self):
+        """Return hit ratios, and latency and payload size histograms, of the
+        builds and reports caches by key family"""
+        retval = {'families': g.cache_stats.to_dict()}
+        cacher = g.buildapi_cache.cache
+        if hasattr(cacher, 'stats'):
+            # hits and misses of the in-process and backend tiers
+            retval['tiers'] = cacher.stats()
+        return self._ok(retval)
+
     def reprioritize(self, branch, request_id):
         """
         Reprioritize the given request.
@@ -323,7 +364,6 @@ class SelfserveController(BaseController):
             return self._format_mq_response(g.mq.reprioritizeRequest(who,
                 request_id, priority))
 
-        # TODO: invalidate cache for branch
         return self._format(retval)
 
     def cancel_request(self, branch, request_id):
@@ -343,7 +383,6 @@ class SelfserveController(BaseController):
             return self._failed("Request %s not found on branch %s" %
                     (request_id, branch), 404)
 
-        # TODO: invalidate cache for branch
         access_log.info("%s cancel_request %s %s", who, branch, request_id)
         return self._format_mq_response(g.mq.cancelRequest(who, request_id))
 
@@ -366,7 +405,6 @@ class SelfserveController(BaseController):
 
         access_log.info("%s cancel_build %s %s", who, branch, build_id)
         retval = g.mq.cancelBuild(who, build_id)
-        # TODO: invalidate cache for branch
         return self._format_mq_response(retval)
 
     def rebuild_build(self, branch):
@@ -401,7 +439,6 @@ class SelfserveController(BaseController):
 
         access_log.info("%s rebuild_build %s %s %s %s", who, branch, build_id, priority, count)
         retval = g.mq.rebuildBuild(who, build_id, priority, count)
-        # TODO: invalidate cache for branch
         return self._format_mq_response(retval)
 
     def rebuild_request(self, branch):
@@ -437,7 +474,6 @@ class SelfserveController(BaseController):
 
         access_log.info("%s rebuild_request %s %s %s %s", who, branch, request_id, priority, count)
         retval = g.mq.rebuildRequest(who, request_id, priority, count)
-        # TODO: invalidate cache for branch
         return self._format_mq_response(retval)
 
     def cancel_revision(self, branch, revision):
@@ -452,7 +488,6 @@ class SelfserveController(BaseController):
 
         access_log.info("%s cancel_revision %s %s", who, branch, revision)
         retval = g.mq.cancelRevision(who, branch, revision)
-        # TODO: invalidate cache for branch
         return self._format_mq_response(retval)
 
     def new_build_at_rev(self, branch, revision):
@@ -465,7 +500,6 @@ class SelfserveController(BaseController):
         access_log.info("%s new_build of %s %s", who, branch, revision)
         retval = g.mq.newBuildAtRevision(who, branch, revision)
         response.status = 202
-        # TODO: invalidate cache for branch
         return self._format(retval)
 
     def new_pgobuild_at_rev(self, branch, revision):
@@ -485,7 +519,6 @@ class SelfserveController(BaseController):
         access_log.info("%s new_pgobuild of %s %s", who, branch, revision)
         retval = g.mq.newPGOBuildAtRevision(who, branch, revision, priority)
         response.status = 202
-        # TODO: invalidate cache for branch
         return self._format(retval)
 
     def new_nightly_at_rev(self, branch, revision):
@@ -505,7 +538,6 @@ class SelfserveController(BaseController):
         access_log.info("%s new_nightly of %s %s", who, branch, revision)
         retval = g.mq.newNightlyAtRevision(who, branch, revision, priority)
         response.status = 202
-        # TODO: invalidate cache for branch
         return self._format(retval)
 
     def new_build_for_builder(self, branch, builder_name, revision):
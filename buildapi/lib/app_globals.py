@@ -7,6 +7,69 @@ import pytz
 
 from buildapi.lib import cacher, cache
 
+CODEC_FORMATS = {
+    'json': cacher.FORMAT_JSON,
+    'marshal': cacher.FORMAT_MARSHAL,
+}
+
+def make_codec(config):
+    """Returns the cacher.Codec described by the buildapi.cache.format and
+    buildapi.cache.compress_threshold options"""
+    format = config.get('buildapi.cache.format', 'json')
+    if format not in CODEC_FORMATS:
+        raise RuntimeError("invalid cache format %r" % (format,))
+    threshold = config.get('buildapi.cache.compress_threshold', '16384')
+    if threshold in ('', 'none'):
+        threshold = None
+    else:
+        threshold = int(threshold)
+    return cacher.Codec(CODEC_FORMATS[format], compress_threshold=threshold)
+
+def make_cacher(cache_spec, codec=None):
+    """Returns a cacher for `cache_spec`, which is one of
+
+        redis:HOSTNAME:PORT
+        memcached:HOSTNAME:PORT,HOSTNAME:PORT,..
+        local:MAX_ENTRIES:MAX_BYTES
+        disk:PATH
+
+    optionally prefixed by an in-process cache tier:
+
+        l1:MAX_ENTRIES:MAX_BYTES:TTL+<spec>
+    """
+    if cache_spec.startswith('l1:') and '+' in cache_spec:
+        l1_spec, backend_spec = cache_spec.split('+', 1)
+        bits = l1_spec.split(':')
+        kwargs = {}
+        for name, value in zip(('max_entries', 'max_bytes', 'ttl'), bits[1:]):
+            if value:
+                kwargs[name] = int(value)
+        return cacher.TieredCache(make_cacher(backend_spec, codec), **kwargs)
+    elif hasattr(cacher, 'RedisCache') and cache_spec.startswith('redis:'):
+        # TODO: handle other hosts/ports
+        bits = cache_spec.split(':')
+        kwargs = {}
+        if len(bits) >= 2:
+            kwargs['host'] = bits[1]
+
+        if len(bits) == 3:
+            kwargs['port'] = int(bits[2])
+        return cacher.RedisCache(codec=codec, **kwargs)
+    elif hasattr(cacher, 'MemcacheCache') and cache_spec.startswith('memcached:'):
+        hosts = cache_spec[10:].split(',')
+        return cacher.MemcacheCache(hosts, codec=codec)
+    elif cache_spec.startswith('local:'):
+        bits = cache_spec.split(':')
+        kwargs = {}
+        for name, value in zip(('max_entries', 'max_bytes'), bits[1:]):
+            if value:
+                kwargs[name] = int(value)
+        return cacher.LocalCache(codec=codec, **kwargs)
+    elif cache_spec.startswith('disk:') and len(cache_spec) > 5:
+        return cacher.DiskCache(cache_spec[5:], codec=codec)
+    else:
+        raise RuntimeError("invalid cache spec %r" % (cache_spec,))
+
 class Globals(object):
     """Globals acts as a container for objects available throughout the
     life of the application
@@ -29,20 +92,11 @@ class Globals(object):
         self.masters_url = config['masters_url']
         self.branches_url = config['branches_url']
 
-        if hasattr(cacher, 'RedisCache') and cache_spec.startswith('redis:'):
-            # TODO: handle other hosts/ports
-            bits = cache_spec.split(':')
-            kwargs = {}
-            if len(bits) >= 2:
-                kwargs['host'] = bits[1]
-
-            if len(bits) == 3:
-                kwargs['port'] = int(bits[2])
-            buildapi_cacher = cacher.RedisCache(**kwargs)
-        elif hasattr(cacher, 'MemcacheCache') and cache_spec.startswith('memcached:'):
-            hosts = cache_spec[10:].split(',')
-            buildapi_cacher = cacher.MemcacheCache(hosts)
-        else:
-            raise RuntimeError("invalid cache spec %r" % (cache_spec,))
+        buildapi_cacher = make_cacher(cache_spec, make_codec(config))
+        # records operations of buildapi_cacher and of the report caches
+        self.cache_stats = cacher.CacheStats(cache.BuildapiCache.key_family)
+        buildapi_cacher.cache_stats = self.cache_stats
 
         self.buildapi_cache = cache.BuildapiCache(buildapi_cacher, tz)
+        # the reports' shards of settled days (see buildapi.model.shards)
+        self.report_shards = cache.ShardCache(buildapi_cacher)
@@ -6,9 +6,9 @@ import time
 
 from pylons.controllers import WSGIController
 from pylons.templating import render_mako as render
-from pylons import request, response, tmpl_context as c
+from pylons import request, response, tmpl_context as c, url
 
-from buildapi.lib import json
+from buildapi.lib import json, jsonstream
 
 class BaseController(WSGIController):
 
@@ -23,6 +23,22 @@ class BaseController(WSGIController):
         response.headers['Content-Type'] = 'application/json'
         return json.dumps(data)
 
+    def jsonify_stream(self, data):
+        """Like jsonify, but returns the document as an iterable of chunks,
+        consuming data's IterDicts and iterators as they're written out"""
+        response.headers['Content-Type'] = 'application/json'
+        return jsonstream.iterencode(data)
+
+    def set_next_page(self, cursor):
+        """Points clients at the next page of results: the current url with
+        its `cursor` parameter set to `cursor`, sent as a Link header and
+        set as c.next_url for templates"""
+        params = dict(request.GET.items())
+        params['cursor'] = cursor
+        c.next_url = url.current(**params)
+        response.headers['Link'] = '<%s>; rel="next"' % \
+                url.current(qualified=True, **params)
+
     def __before__(self):
         """Set self._fmt depending on query parameters or the Accept
         header"""
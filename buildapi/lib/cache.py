@@ -1,7 +1,16 @@
+import random
+import re
+import threading
 import time
 
-from buildapi.model.builds import getBuildsQuery, requestFromRow, buildFromRow, \
-        getRevision, getPendingQuery
+from decorator import decorator
+from pylons import app_globals as g
+from pylons.decorators.cache import beaker_cache
+
+from buildapi.model.builds import getBuildsStatement, getRevision, \
+        getPendingStatement, getSourceStamp, getChangedBuildsStatement, \
+        executeQueries, recordsFromRows
+from buildapi.model import shards
 from buildapi.lib.times import dt2ts, ts2dt, oneday, now
 
 import logging
@@ -10,34 +19,93 @@ log = logging.getLogger(__name__)
 def getBuilds(branch, starttime, endtime):
     log.info("Getting builds on %s between %s and %s", branch, starttime,
             endtime)
-    build_q = getBuildsQuery(branch, starttime, endtime)
-
-    # Elements with the same claimed_by_name, claimed_by_incarnation,
-    # claimed_at, buildername, and number are actually the same build and
-    # should only be represented once
-    builds = {}
-    retval = []
-    for build in build_q.execute():
-        key = (build.claimed_by_name, build.claimed_by_incarnation,
-                build.claimed_at, build.buildername, build.number)
-        if key in builds:
-            request = requestFromRow(build)
-            builds[key]['requests'].append(request)
-        else:
-            builds[key] = buildFromRow(build)
-            retval.append(builds[key])
+    builds, pending = executeQueries([
+        getBuildsStatement(True, True),
+        getPendingStatement(True, True),
+        ], dict(branch=branch, starttime=starttime, endtime=endtime))
+    return recordsFromRows(builds) + recordsFromRows(pending)
+
+# Requests claimed or completed this many seconds before the newest ones
+# already seen are fetched again, in case the masters' clocks disagree
+watermark_slop = 300
+
+def _buildKey(build):
+    # getBuilds also groups by claimed_by_incarnation, which the build
+    # dictionaries don't carry; claimed_at is distinct enough without it
+    return (build['claimed_by_name'], build['requests'][0]['claimed_at'],
+            build['buildername'], build['buildnumber'])
+
+def updateBuilds(branch, starttime, endtime, cached):
+    """Returns what getBuilds(branch, starttime, endtime) would, given its
+    previous result `cached`.  Only the builds created, claimed or completed
+    since then are fetched and merged in; pending requests are all fetched
+    again."""
+    builds = [b for b in cached if 'build_id' in b]
+    if not builds:
+        return getBuilds(branch, starttime, endtime)
+
+    requests = [r for b in builds for r in b['requests']]
+    build_id = max(b['build_id'] for b in builds)
+    claimed_at = max(r['claimed_at'] for r in requests) - watermark_slop
+    complete_at = (max(r['complete_at'] for r in requests) or 0) - \
+            watermark_slop
+    log.info("Updating builds on %s between %s and %s since build %s",
+            branch, starttime, endtime, build_id)
 
-    q = getPendingQuery(branch, starttime, endtime)
-    for req in q.execute():
-        retval.append(requestFromRow(req))
+    changed_rows, pending = executeQueries([
+        getChangedBuildsStatement(True, True),
+        getPendingStatement(True, True),
+        ], dict(branch=branch, starttime=starttime, endtime=endtime,
+            build_id=build_id, claimed_at=claimed_at, complete_at=complete_at))
+    changed = dict((_buildKey(b), b) for b in recordsFromRows(changed_rows))
 
-    return retval
+    # cached values may be shared, so merge into new dictionaries
+    by_key = dict((_buildKey(b), b) for b in builds)
+    for key, build in changed.iteritems():
+        old = by_key.get(key)
+        if old:
+            seen = set(r['request_id'] for r in build['requests'])
+            build['requests'].extend(r for r in old['requests']
+                    if r['request_id'] not in seen)
+            build['build_id'] = max(build['build_id'], old['build_id'])
+        by_key[key] = build
+
+    retval = sorted(by_key.values(), key=lambda b: b['build_id'],
+            reverse=True)
+    return retval + recordsFromRows(pending)
 
 class BuildapiCache:
+    # Recent days' builds go stale after a minute, but are served stale for
+    # this many more seconds while they're refreshed in the background
+    day_stale_for = 600
+
+    # Stale days are refreshed by fetching only what changed since they were
+    # cached, and fully once every this many refreshes on average, to pick up
+    # changes the incremental refresh can't see (like reprioritized running
+    # builds).  Set to 1 to always refresh fully.
+    day_full_refresh_every = 10
+
+    # How long a revision's builds are cached for.  Self-serve jobs evict
+    # them when they complete, but builds also progress on their own.
+    revision_expire = 120
+
     def __init__(self, cache, timezone):
         self.cache = cache
         self.timezone = timezone
 
+    @staticmethod
+    def key_family(key):
+        """Returns the family of a cache key, for CacheStats"""
+        parts = key.split(':')
+        if parts[0] == 'builds' and len(parts) == 3:
+            if re.match(r'\d{4}-\d{2}-\d{2}$', parts[2]):
+                return 'builds:day'
+            return 'builds:rev'
+        if parts[0] == 'shards' and len(parts) > 1:
+            # by report function
+            return 'shards:%s' % parts[1].split('.')[-1]
+        return parts[0]
+
     def build_key_for_day(self, date, branch):
         assert date.tzinfo
         return "builds:%s:%s" % (branch, date.strftime('%Y-%m-%d'))
@@ -49,7 +117,7 @@ class BuildapiCache:
         revision = revision[:12]
         key = self.build_key_for_rev(branch, revision)
         return self.cache.get(key, getRevision, (branch, revision),
-                expire=time.time()+120)
+                expire=time.time()+self.revision_expire)
 
     def get_builds_for_day(self, date, branch):
         """
@@ -60,17 +128,84 @@ class BuildapiCache:
         starttime = dt2ts(date)
         endtime = dt2ts(date + oneday)
 
-        if date - now(self.timezone) < 3*oneday:
+        return self.cache.get(key, getBuilds, (branch, starttime, endtime),
+                expire=self.expire_for_day(date),
+                stale_for=self.day_stale_for,
+                on_stale=lambda builds:
+                    self._refresh_day(key, date, branch, builds))
+
+    def _refresh_day(self, key, date, branch, builds):
+        """Regenerates the stale `builds` cached for `date` in the
+        background, incrementally when possible"""
+        args = (branch, dt2ts(date), dt2ts(date + oneday))
+        if random.random() < 1.0 / self.day_full_refresh_every:
+            func = getBuilds
+        else:
+            func = updateBuilds
+            args += (builds,)
+        self.cache.refresh(key, func, args,
+                expire=self.expire_for_day(date),
+                stale_for=self.day_stale_for)
+
+    def invalidate_revision(self, branch, revision):
+        """Drops the cached builds for `revision` on `branch`"""
+        self.cache.delete(self.build_key_for_rev(branch, revision[:12]))
+
+    def refresh_day(self, date, branch):
+        """Regenerates the cached builds for the day of `date` in the
+        background, if they're cached at all"""
+        date = date.replace(hour=0, minute=0, second=0, microsecond=0)
+        key = self.build_key_for_day(date, branch)
+        if not self.cache.has_key(key):
+            return False
+        return self.cache.refresh(key, getBuilds,
+                (branch, dt2ts(date), dt2ts(date + oneday)),
+                expire=self.expire_for_day(date),
+                stale_for=self.day_stale_for)
+
+    def job_finished(self, action, what):
+        """Evicts or refreshes the cached builds affected by a completed
+        self-serve job.  `what` holds the job's arguments, as recorded in
+        its JobRequest."""
+        affected = []
+        if what.get('branch') and what.get('revision'):
+            branch = what['branch']
+            # new_build_for_builder submits to ${branch}-selfserve
+            if branch.endswith('-selfserve'):
+                branch = branch[:-len('-selfserve')]
+            affected.append((branch, what['revision'], None))
+        elif 'brid' in what or 'bid' in what:
+            ss = getSourceStamp(what.get('brid'), what.get('bid'))
+            if ss is None:
+                log.warn("Couldn't find the request for %s %s", action, what)
+                return
+            # the branch in the url can be either the full sourcestamp
+            # branch, or its last component
+            for branch in set([ss.branch, ss.branch.split('/')[-1]]):
+                affected.append((branch, ss.revision, ss.submitted_at))
+
+        today = now(self.timezone)
+        for branch, revision, submitted_at in affected:
+            log.info("Invalidating cached builds for %s %s after %s",
+                    branch, revision, action)
+            if revision:
+                self.invalidate_revision(branch, revision)
+            # new requests show up today, and existing ones usually on the
+            # day they were submitted
+            self.refresh_day(today, branch)
+            if submitted_at:
+                self.refresh_day(ts2dt(submitted_at, self.timezone), branch)
+
+    def expire_for_day(self, date):
+        """Returns when the cached builds for `date` should expire"""
+        if now(self.timezone) - date < 3*oneday:
             # Expire soon
-            expire = time.time() + 60
+            return time.time() + 60
         else:
             # Don't expire
-            expire = 0
-
-        return self.cache.get(key, getBuilds, (branch, starttime, endtime),
-                expire=expire)
+            return 0
 
-    def get_builds_for_date_range(self, starttime, endtime, branch, method=0):
+    def get_builds_for_date_range(self, starttime, endtime, branch, method=2):
         """
         Returns a list of builds for the given date range. starttime and
         endtime should be datetime.datetime instances.
@@ -128,7 +263,120 @@ class BuildapiCache:
                     # Expire in half an hour
                     expire = time.time() + 1800
                 key = self.build_key_for_day(date, branch)
-                self.cache.put(key, builds, expire=expire)
+                self.cache.put(key, builds, expire=expire,
+                        stale_for=self.day_stale_for)
 
             return retval
 
+        # Fetch every day in one round trip, and only query the db for the
+        # contiguous runs of days that aren't cached
+        if method == 2:
+            days = []
+            d = starttime
+            while d < endtime:
+                days.append((d, self.build_key_for_day(d, branch)))
+                d += oneday
+
+            entries = self.cache.get_multi_entries([key for (d, key) in days])
+            cached = {}
+
+            gaps = []
+            for i, (d, key) in enumerate(days):
+                if key in entries:
+                    cached[key], stale_at = entries[key]
+                    if stale_at and stale_at <= time.time():
+                        self._refresh_day(key, d, branch, cached[key])
+                    continue
+                if gaps and gaps[-1][1] == i:
+                    gaps[-1][1] = i + 1
+                else:
+                    gaps.append([i, i + 1])
+
+            for first, last in gaps:
+                gap_days = days[first:last]
+                found = dict((key, []) for (d, key) in gap_days)
+                builds = getBuilds(branch, dt2ts(gap_days[0][0]),
+                        dt2ts(gap_days[-1][0] + oneday))
+                for b in builds:
+                    # pending requests don't have a starttime; getBuilds
+                    # selects them by submittime instead
+                    ts = b.get('starttime') or b.get('submittime')
+                    date = ts2dt(ts, self.timezone)
+                    key = self.build_key_for_day(date, branch)
+                    if key in found:
+                        found[key].append(b)
+
+                for d, key in gap_days:
+                    self.cache.put(key, found[key],
+                            expire=self.expire_for_day(d),
+                            stale_for=self.day_stale_for)
+                cached.update(found)
+
+            retval = []
+            for d, key in days:
+                retval.extend(cached[key])
+            return retval
+
+class ShardCache:
+    """Keeps the shards of reports (see buildapi.model.shards) in a cacher.
+
+    Only the shards of days that have settled are put in it, and those don't
+    change anymore, so they never expire.  Shards are kept as plain data
+    (see shards.dumpShard), which any of the cacher's codecs can hold, and
+    which only ever loads back as report objects.
+    """
+
+    def __init__(self, cache):
+        self.cache = cache
+
+    def get_multi(self, keys):
+        """Returns a dictionary of the shards for those of `keys` that are in
+        the cache, fetched in one round trip"""
+        retval = {}
+        for key, data in self.cache.get_multi(keys).iteritems():
+            try:
+                retval[key] = shards.loadShard(data)
+            except Exception:
+                # e.g. dumped by an older version of the report classes
+                log.exception("Couldn't load the shard %s", key)
+        return retval
+
+    def put(self, key, shard):
+        """Puts `shard` in the cache; failing to doesn't fail the report,
+        whose shard is just computed again next time"""
+        try:
+            self.cache.put(key, shards.dumpShard(shard))
+        except Exception:
+            log.exception("Couldn't put the shard %s", key)
+
+def report_cache(name, **b_kwargs):
+    """beaker_cache, recording lookups of report `name`, whether they were
+    hits or misses, and the time spent generating it in the cache stats"""
+    family = 'reports:%s' % name
+    # whether beaker called fill during the current lookup of this thread
+    filled = threading.local()
+
+    def get(func, *args, **kwargs):
+        filled.value = False
+        start = time.time()
+        try:
+            value = func(*args, **kwargs)
+        finally:
+            g.cache_stats.record(family, 'get', time.time() - start)
+        if not filled.value:
+            g.cache_stats.record(family, 'hit')
+        return value
+
+    def fill(func, *args, **kwargs):
+        # beaker only calls this on a miss
+        filled.value = True
+        g.cache_stats.record(family, 'miss')
+        start = time.time()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            g.cache_stats.record(family, 'fill', time.time() - start)
+
+    def decorate(func):
+        return decorator(get)(beaker_cache(**b_kwargs)(decorator(fill)(func)))
+    return decorate
@@ -1,5 +1,14 @@
+import Queue
+import anydbm
+import bisect
+import marshal
+import os
+import random
+import struct
 import threading
 import time
+import zlib
+from collections import OrderedDict
 try:
     import simplejson as json
 except ImportError:
@@ -8,92 +17,863 @@ except ImportError:
 import logging
 log = logging.getLogger(__name__)
 
+# Serialized values start with a header byte made of a format id, plus
+# FLAG_ZLIB if the rest of the value is compressed, and FLAG_STALE_AT if the
+# header is followed by the time at which the value goes stale.  Values
+# written before the header existed are plain JSON (or zlib'd JSON, from
+# reporter.py), neither of which can start with one of these bytes.
+FORMAT_JSON = 1
+FORMAT_MARSHAL = 2
+FLAG_STALE_AT = 0x40
+FLAG_ZLIB = 0x80
+
+class Codec(object):
+    """Serializes cached values.
+
+    `format` is one of FORMAT_JSON, or FORMAT_MARSHAL which is more compact
+    and much faster to decode, but must only be used with a trusted cache
+    once every worker reading it can decode it.  Marshal also keeps what JSON
+    doesn't: tuples, str vs unicode and non-string dictionary keys come back
+    as they were put.
+    Values of at least `compress_threshold` bytes are zlib compressed; set it
+    to None to never compress.
+
+    Any value written by a Codec can be read back by any other Codec,
+    whatever their settings, as can legacy header-less values.
+    """
+    dumpers = {
+        FORMAT_JSON: json.dumps,
+        FORMAT_MARSHAL: lambda val: marshal.dumps(val, 2),
+    }
+    loaders = {
+        FORMAT_JSON: json.loads,
+        FORMAT_MARSHAL: marshal.loads,
+    }
+
+    def __init__(self, format=FORMAT_JSON, compress_threshold=16384,
+            compress_level=6):
+        assert format in self.dumpers
+        self.format = format
+        self.compress_threshold = compress_threshold
+        self.compress_level = compress_level
+
+    def dumps(self, val, stale_at=None):
+        data = self.dumpers[self.format](val)
+        header = self.format
+        if self.compress_threshold is not None and \
+                len(data) >= self.compress_threshold:
+            data = zlib.compress(data, self.compress_level)
+            header |= FLAG_ZLIB
+        if stale_at:
+            header |= FLAG_STALE_AT
+            data = struct.pack('>I', int(stale_at)) + data
+        return chr(header) + data
+
+    def loads_entry(self, data):
+        """Returns (value, stale_at) for serialized `data`.  stale_at is 0 for
+        values that don't go stale."""
+        header = ord(data[0]) if data else 0
+        loader = self.loaders.get(header & ~(FLAG_ZLIB | FLAG_STALE_AT))
+        if loader is None:
+            return self._loads_legacy(data), 0
+        data = data[1:]
+        stale_at = 0
+        if header & FLAG_STALE_AT:
+            stale_at = struct.unpack('>I', data[:4])[0]
+            data = data[4:]
+        if header & FLAG_ZLIB:
+            data = zlib.decompress(data)
+        return loader(data), stale_at
+
+    def loads(self, data):
+        return self.loads_entry(data)[0]
+
+    def _loads_legacy(self, data):
+        # zlib streams start with 'x', which can't start a JSON document
+        if data[:1] == 'x':
+            data = zlib.decompress(data)
+        return json.loads(data)
+
+class Histogram(object):
+    """Counts values into buckets bounded by the sorted `bounds`, plus an
+    overflow bucket"""
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def add(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+
+    def to_dict(self):
+        return {
+            'count': self.count,
+            'sum': self.total,
+            'max': self.max,
+            # the last bucket has no upper bound
+            'buckets': zip(list(self.bounds) + [None], self.counts),
+        }
+
+class CacheStats(object):
+    """Counters, latency histograms and payload size histograms for cache
+    operations, by key family.
+
+    Operations recorded by the caches are 'get' (a lookup, including any
+    waiting and filling), 'hit', 'miss' and 'stale' (what a lookup found),
+    'fill' (calling the function generating the value) and 'put' (storing
+    a value).  `key_family` maps a key to its family name.
+
+    The hit ratio of a family is that of the lookups whose outcome was
+    recorded, which get_multi makes without counting a 'get' for them.
+    """
+    # seconds
+    latency_bounds = (.001, .002, .005, .01, .02, .05, .1, .2, .5, 1, 2, 5,
+            10, 30, 60, 120)
+    # bytes
+    size_bounds = tuple(256 * 4**i for i in range(10))
+
+    def __init__(self, key_family=None):
+        if key_family is not None:
+            self.key_family = key_family
+        self.lock = threading.Lock()
+        # family -> op -> count / Histogram
+        self.counters = {}
+        self.latencies = {}
+        self.sizes = {}
+
+    def key_family(self, key):
+        return key.split(':', 1)[0]
+
+    def record(self, family, op, elapsed=None, size=None):
+        with self.lock:
+            counters = self.counters.setdefault(family, {})
+            counters[op] = counters.get(op, 0) + 1
+            if elapsed is not None:
+                hists = self.latencies.setdefault(family, {})
+                if op not in hists:
+                    hists[op] = Histogram(self.latency_bounds)
+                hists[op].add(elapsed)
+            if size is not None:
+                hists = self.sizes.setdefault(family, {})
+                if op not in hists:
+                    hists[op] = Histogram(self.size_bounds)
+                hists[op].add(size)
+
+    def record_key(self, key, op, elapsed=None, size=None):
+        self.record(self.key_family(key), op, elapsed, size)
+
+    def to_dict(self):
+        retval = {}
+        with self.lock:
+            for family, counters in self.counters.iteritems():
+                family_stats = retval[family] = {
+                    'counters': dict(counters),
+                    'latency': dict((op, h.to_dict()) for (op, h) in
+                        self.latencies.get(family, {}).iteritems()),
+                    'size': dict((op, h.to_dict()) for (op, h) in
+                        self.sizes.get(family, {}).iteritems()),
+                }
+                lookups = sum(counters.get(op, 0)
+                        for op in ('hit', 'stale', 'miss'))
+                if lookups:
+                    family_stats['hit_ratio'] = \
+                        float(counters.get('hit', 0)) / lookups
+        return retval
+
+    def reset(self):
+        with self.lock:
+            self.counters.clear()
+            self.latencies.clear()
+            self.sizes.clear()
+
+class Refresher(object):
+    """Regenerates stale cache entries in a pool of background threads.  Each
+    key is refreshed by at most one thread of this process, and by at most one
+    worker overall while it holds the cache's lock for the key."""
+
+    def __init__(self, cache, num_threads=2):
+        self.cache = cache
+        self.queue = Queue.Queue()
+        self.pending = set()
+        self.lock = threading.Lock()
+        for i in range(num_threads):
+            t = threading.Thread(target=self._run,
+                    name="cache-refresher-%i" % i)
+            t.daemon = True
+            t.start()
+
+    def refresh(self, key, func, args, kwargs, expire, lock_time, stale_for):
+        """Queues a refresh of `key`.  Returns False if one is already
+        queued."""
+        with self.lock:
+            if key in self.pending:
+                return False
+            self.pending.add(key)
+        self.queue.put((key, func, args, kwargs, expire, lock_time,
+            stale_for))
+        return True
+
+    def _run(self):
+        while True:
+            job = self.queue.get()
+            try:
+                self._refresh(*job)
+            except Exception:
+                log.exception("Problem refreshing %s", job[0])
+            with self.lock:
+                self.pending.discard(job[0])
+            self.queue.task_done()
+
+    def _refresh(self, key, func, args, kwargs, expire, lock_time, stale_for):
+        if not self.cache._acquire_lock(key, lock_time):
+            # another worker is already regenerating this key
+            return
+        try:
+            self.cache._fill(key, func, args, kwargs, expire, stale_for)
+        finally:
+            self.cache._release_lock(key)
+
+_refresher_lock = threading.Lock()
+
 class BaseCache:
+    # how long to sleep between checks while waiting for another worker to
+    # generate a value
+    lock_poll_interval = 0.1
+
+    # number of background threads refreshing stale values
+    refresh_threads = 2
+
+    codec = Codec()
+
+    # a CacheStats to record operations in, if any
+    cache_stats = None
+
     def has_key(self, key):
         raise NotImplementedError()
 
-    def get(self, key, func, args=None, kwargs=None, expire=0, lock_time=600):
+    def _get_raw(self, key):
+        """Returns the serialized value for `key`, or raises KeyError"""
+        raise NotImplementedError()
+
+    def _put_raw(self, key, data, expire=0):
+        raise NotImplementedError()
+
+    def delete(self, key):
+        """Removes `key` from the cache, if it's there"""
+        raise NotImplementedError()
+
+    def _dumps(self, val, stale_at=None):
+        return self.codec.dumps(val, stale_at)
+
+    def _loads(self, data):
+        return self.codec.loads(data)
+
+    def _loads_entry(self, data):
+        return self.codec.loads_entry(data)
+
+    def _get_entry(self, key):
+        """Returns (value, stale_at) for `key`, or raises KeyError"""
+        return self._loads_entry(self._get_raw(key))
+
+    def _get(self, key):
+        return self._get_entry(key)[0]
+
+    def _put(self, key, val, expire=0, stale_for=0):
+        """Stores `val`, and returns the size of its serialized form"""
+        if expire and stale_for:
+            data = self._dumps(val, expire)
+            self._put_raw(key, data, expire + stale_for)
+        else:
+            data = self._dumps(val)
+            self._put_raw(key, data, expire)
+        return len(data)
+
+    def _record(self, key, op, elapsed=None, size=None):
+        if self.cache_stats is not None:
+            self.cache_stats.record_key(key, op, elapsed, size)
+
+    def _timed_put(self, key, val, expire=0, stale_for=0):
+        start = time.time()
+        size = self._put(key, val, expire, stale_for)
+        self._record(key, 'put', time.time() - start, size)
+
+    def _fill(self, key, func, args, kwargs, expire, stale_for):
+        """Generates the value for `key` and stores it"""
+        start = time.time()
+        retval = func(*args, **kwargs)
+        self._record(key, 'fill', time.time() - start)
+        self._timed_put(key, retval, expire, stale_for)
+        return retval
+
+    def _lock_key(self, key):
+        return "%s.lock" % key
+
+    def _acquire_lock(self, key, lock_time):
+        """Try to take the generation lock for `key`, held for at most
+        `lock_time` seconds.  Returns True if the lock was acquired.  Backends
+        that can't lock always succeed, which just means that every worker
+        generates the value itself."""
+        return True
+
+    def _release_lock(self, key):
+        pass
+
+    def get(self, key, func, args=None, kwargs=None, expire=0, lock_time=600,
+            stale_for=0, on_stale=None):
+        """Returns the cached value for `key`, calling func(*args, **kwargs)
+        to generate it if it isn't cached.
+
+        The value expires at `expire` (a timestamp, or 0 for never).  If
+        `stale_for` is set, the value is kept for that many more seconds after
+        it expires.  During that time it is still returned, while a
+        background thread regenerates it; or, if `on_stale` is set, it's
+        passed to on_stale(value), which is then in charge of refreshing it
+        (e.g. incrementally).
+        """
         if args is None:
             args = ()
         if kwargs is None:
             kwargs = {}
 
-        # note that in a "thundering herd" situation, this may generate the
-        # same cached value several times.  That's OK.
+        start = time.time()
+        try:
+            return self._get_or_fill(key, func, args, kwargs, expire,
+                    lock_time, stale_for, on_stale)
+        finally:
+            self._record(key, 'get', time.time() - start)
+
+    def _get_or_fill(self, key, func, args, kwargs, expire, lock_time,
+            stale_for, on_stale):
+        # Only one worker generates a missing value while holding the lock for
+        # the key; everybody else waits for the value to show up in the
+        # cache.  The lock expires after lock_time seconds, so a worker that
+        # dies while generating only delays the others.
         try:
+            while True:
+                try:
+                    retval, stale_at = self._get_entry(key)
+                    if stale_at and stale_at <= time.time():
+                        self._record(key, 'stale')
+                        if on_stale is not None:
+                            on_stale(retval)
+                        else:
+                            self.refresh(key, func, args, kwargs, expire,
+                                    lock_time, stale_for)
+                    else:
+                        self._record(key, 'hit')
+                    return retval
+                except KeyError:
+                    pass
+                if self._acquire_lock(key, lock_time):
+                    break
+                time.sleep(self.lock_poll_interval)
+
             try:
-                return self._get(key)
-            except KeyError:
-                retval = func(*args, **kwargs)
-                self._put(key, retval, expire)
-                return retval
+                # somebody may have filled the cache between our last check
+                # and taking the lock
+                try:
+                    retval = self._get(key)
+                    self._record(key, 'hit')
+                    return retval
+                except KeyError:
+                    pass
+                self._record(key, 'miss')
+                return self._fill(key, func, args, kwargs, expire, stale_for)
+            finally:
+                self._release_lock(key)
         except Exception:
             log.exception("Problem with cache!")
+            self._record(key, 'error')
             return func(*args, **kwargs)
 
-    def put(self, key, val, expire=0):
-        return self._put(key, val, expire)
+    def put(self, key, val, expire=0, stale_for=0):
+        self._timed_put(key, val, expire, stale_for)
+
+    def refresh(self, key, func, args=None, kwargs=None, expire=0,
+            lock_time=600, stale_for=0):
+        """Regenerates the value for `key` in the background, unless that's
+        already happening"""
+        if args is None:
+            args = ()
+        if kwargs is None:
+            kwargs = {}
+        refresher = getattr(self, 'refresher', None)
+        if refresher is None:
+            with _refresher_lock:
+                refresher = getattr(self, 'refresher', None)
+                if refresher is None:
+                    refresher = self.refresher = Refresher(self,
+                            self.refresh_threads)
+        return refresher.refresh(key, func, args, kwargs, expire, lock_time,
+                stale_for)
+
+    def _get_raw_multi(self, keys):
+        retval = {}
+        for key in keys:
+            try:
+                retval[key] = self._get_raw(key)
+            except KeyError:
+                pass
+        return retval
+
+    def get_multi_entries(self, keys):
+        """Returns a dictionary of (value, stale_at) for those of `keys` that
+        are in the cache, fetched in as few round trips as the backend
+        allows."""
+        try:
+            retval = dict((key, self._loads_entry(data)) for (key, data) in
+                    self._get_raw_multi(keys).iteritems())
+        except Exception:
+            log.exception("Problem with cache!")
+            return {}
+        self._record_multi(keys, retval)
+        return retval
+
+    def _record_multi(self, keys, found):
+        if self.cache_stats is None:
+            return
+        now = time.time()
+        for key in keys:
+            if key not in found:
+                self._record(key, 'miss')
+            elif found[key][1] and found[key][1] <= now:
+                self._record(key, 'stale')
+            else:
+                self._record(key, 'hit')
+
+    def get_multi(self, keys):
+        """Returns a dictionary of the cached values for those of `keys` that
+        are in the cache"""
+        return dict((key, val) for (key, (val, stale_at)) in
+                self.get_multi_entries(keys).iteritems())
+
+def _lock_token():
+    return "%s:%s:%s" % (os.getpid(), threading.current_thread().ident,
+            random.random())
+
+class LRUStore(object):
+    """A thread-safe mapping whose items expire, bounded both by number of
+    items and by their total size.  The least recently used items are evicted
+    first."""
+
+    def __init__(self, max_entries, max_bytes):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        # key -> (value, size, expires_at), least recently used first
+        self.items = OrderedDict()
+        self.size = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        """Returns the value for `key`, or raises KeyError"""
+        with self.lock:
+            value, size, expires_at = self.items.pop(key)
+            if expires_at and expires_at <= time.time():
+                self.size -= size
+                raise KeyError(key)
+            # re-insert as the most recently used item
+            self.items[key] = (value, size, expires_at)
+            return value
+
+    def set(self, key, value, size, expires_at=0):
+        """Stores `value` until `expires_at` (0 for never)"""
+        if size > self.max_bytes:
+            self.pop(key)
+            return
+        with self.lock:
+            if key in self.items:
+                self.size -= self.items.pop(key)[1]
+            self.items[key] = (value, size, expires_at)
+            self.size += size
+            while len(self.items) > self.max_entries or \
+                    self.size > self.max_bytes:
+                self.size -= self.items.popitem(last=False)[1][1]
+
+    def pop(self, key):
+        with self.lock:
+            if key in self.items:
+                self.size -= self.items.pop(key)[1]
+
+    def __contains__(self, key):
+        try:
+            self.get(key)
+            return True
+        except KeyError:
+            return False
+
+    def __len__(self):
+        return len(self.items)
+
+    def keys(self):
+        with self.lock:
+            return self.items.keys()
+
+    def clear(self):
+        with self.lock:
+            self.items.clear()
+            self.size = 0
+
+class InProcessLocksMixin:
+    """Generation locks for caches that live in a single process.  Classes
+    using this must set self.locks = {} and self.locks_lock =
+    threading.Lock()"""
+
+    def _acquire_lock(self, key, lock_time):
+        now = time.time()
+        with self.locks_lock:
+            if key in self.locks and self.locks[key][0] > now:
+                return False
+            self.locks[key] = (now + lock_time,
+                    threading.current_thread().ident)
+            return True
+
+    def _release_lock(self, key):
+        with self.locks_lock:
+            # don't release a lock that expired and was taken by somebody else
+            if self.locks.get(key, (0, None))[1] == \
+                    threading.current_thread().ident:
+                del self.locks[key]
+
+class TieredCache(BaseCache):
+    """An in-process LRU cache in front of another cache backend.
+
+    Recently used values are kept deserialized in memory for at most `ttl`
+    seconds, so hot keys are served without a network round trip or a
+    deserialization.  The in-process tier is bounded both by number of
+    entries and by the total serialized size of the values it holds.
+
+    Values returned from the in-process tier are shared between callers, and
+    must not be modified.
+    """
+    def __init__(self, backend, max_entries=1000, max_bytes=64*1024*1024,
+            ttl=10):
+        self.backend = backend
+        self.ttl = ttl
+
+        # key -> (value, stale_at)
+        self.entries = LRUStore(max_entries, max_bytes)
+
+        self.l1_hits = 0
+        self.l1_misses = 0
+        self.l2_hits = 0
+        self.l2_misses = 0
+
+    def _remember(self, key, entry, size, expire=0):
+        expires_at = time.time() + self.ttl
+        if expire:
+            expires_at = min(expires_at, expire)
+        self.entries.set(key, entry, size, expires_at)
+
+    def _lookup(self, key):
+        """Returns the (value, stale_at) entry for `key` from the in-process
+        tier, or None"""
+        try:
+            return self.entries.get(key)
+        except KeyError:
+            return None
+
+    def _get_entry(self, key):
+        entry = self._lookup(key)
+        if entry is not None:
+            self.l1_hits += 1
+            return entry
+        self.l1_misses += 1
+
+        try:
+            data = self.backend._get_raw(key)
+        except KeyError:
+            self.l2_misses += 1
+            raise
+        self.l2_hits += 1
+        entry = self.backend._loads_entry(data)
+        self._remember(key, entry, len(data))
+        return entry
+
+    def _put(self, key, val, expire=0, stale_for=0):
+        if expire and stale_for:
+            stale_at, hard_expire = expire, expire + stale_for
+        else:
+            stale_at, hard_expire = 0, expire
+        data = self.backend._dumps(val, stale_at)
+        self.backend._put_raw(key, data, hard_expire)
+        self._remember(key, (val, stale_at), len(data), hard_expire)
+        return len(data)
+
+    def get_multi_entries(self, keys):
+        retval = {}
+        missing = []
+        for key in keys:
+            entry = self._lookup(key)
+            if entry is not None:
+                retval[key] = entry
+            else:
+                missing.append(key)
+        self.l1_hits += len(retval)
+        self.l1_misses += len(missing)
+        if not missing:
+            self._record_multi(keys, retval)
+            return retval
+
+        try:
+            found = self.backend._get_raw_multi(missing)
+            for key, data in found.iteritems():
+                entry = self.backend._loads_entry(data)
+                self._remember(key, entry, len(data))
+                retval[key] = entry
+        except Exception:
+            log.exception("Problem with cache!")
+            return retval
+        self.l2_hits += len(found)
+        self.l2_misses += len(missing) - len(found)
+        self._record_multi(keys, retval)
+        return retval
+
+    def has_key(self, key):
+        return self._lookup(key) is not None or self.backend.has_key(key)
+
+    def delete(self, key):
+        # other processes' in-process tiers keep their copy for up to `ttl`
+        # seconds
+        self.entries.pop(key)
+        self.backend.delete(key)
+
+    def _acquire_lock(self, key, lock_time):
+        return self.backend._acquire_lock(key, lock_time)
+
+    def _release_lock(self, key):
+        return self.backend._release_lock(key)
+
+    def stats(self):
+        """Returns hit/miss counters for the in-process tier (l1) and the
+        backend (l2)"""
+        return {
+            'l1': {'hits': self.l1_hits, 'misses': self.l1_misses,
+                   'entries': len(self.entries), 'bytes': self.entries.size},
+            'l2': {'hits': self.l2_hits, 'misses': self.l2_misses},
+        }
+
+class LocalCache(InProcessLocksMixin, BaseCache):
+    """A cache living in this process' memory, for single-node deployments
+    and tests.  Values are kept serialized, bounded by number of entries and
+    by total size, least recently used first."""
+
+    def __init__(self, max_entries=10000, max_bytes=256*1024*1024,
+            codec=None):
+        self.store = LRUStore(max_entries, max_bytes)
+        self.locks = {}
+        self.locks_lock = threading.Lock()
+        if codec is not None:
+            self.codec = codec
+
+    def _get_raw(self, key):
+        return self.store.get(key)
+
+    def _put_raw(self, key, data, expire=0):
+        self.store.set(key, data, len(data), expire)
+
+    def delete(self, key):
+        self.store.pop(key)
+
+    def has_key(self, key):
+        return key in self.store
+
+class DiskCache(InProcessLocksMixin, BaseCache):
+    """A cache kept in a dbm file at `path`, which survives restarts.  It
+    must only be used by one process at a time."""
+
+    def __init__(self, path, codec=None):
+        self.path = path
+        self.db = anydbm.open(path, 'c')
+        self.db_lock = threading.Lock()
+        self.locks = {}
+        self.locks_lock = threading.Lock()
+        if codec is not None:
+            self.codec = codec
+        self.purge()
+
+    def _get_raw(self, key):
+        key = utf8(key)
+        with self.db_lock:
+            if not self.db.has_key(key):
+                raise KeyError(key)
+            data = self.db[key]
+            expire = struct.unpack('>I', data[:4])[0]
+            if expire and expire <= time.time():
+                del self.db[key]
+                raise KeyError(key)
+            return data[4:]
+
+    def _put_raw(self, key, data, expire=0):
+        with self.db_lock:
+            self.db[utf8(key)] = struct.pack('>I', int(expire)) + data
+            if hasattr(self.db, 'sync'):
+                self.db.sync()
+
+    def delete(self, key):
+        key = utf8(key)
+        with self.db_lock:
+            if self.db.has_key(key):
+                del self.db[key]
+                if hasattr(self.db, 'sync'):
+                    self.db.sync()
+
+    def has_key(self, key):
+        try:
+            self._get_raw(key)
+            return True
+        except KeyError:
+            return False
+
+    def purge(self):
+        """Removes expired entries"""
+        now = time.time()
+        with self.db_lock:
+            for key in self.db.keys():
+                expire = struct.unpack('>I', self.db[key][:4])[0]
+                if expire and expire <= now:
+                    del self.db[key]
+
+    def close(self):
+        with self.db_lock:
+            self.db.close()
+
+def utf8(s):
+    if isinstance(s, unicode):
+        return s.encode('utf-8')
+    return s
 
 try:
     import redis.client
     class RedisCache(BaseCache):
-        def __init__(self, host='localhost', port=6379):
+        def __init__(self, host='localhost', port=6379, codec=None):
             self.r = redis.client.Redis(host, port)
+            if codec is not None:
+                self.codec = codec
             # use a thread-local object for holding locks, so that different
             # threads can use locks without stepping on feet
             self.local = threading.local()
+            self._release_script = self.r.register_script(
+                    self.release_lock_script)
 
-        def _get(self, key):
-            if not self.has_key(key):
-                raise KeyError
+        # deletes a lock only if it's still ours; checking and deleting in
+        # two commands could delete one that expired in between and was
+        # taken by somebody else
+        release_lock_script = """
+            if redis.call('get', KEYS[1]) == ARGV[1] then
+                return redis.call('del', KEYS[1])
+            end
+            return 0
+        """
 
+        def _get_raw(self, key):
             retval = self.r.get(key)
-            if retval is not None:
-                return json.loads(retval)
-            return None
+            if retval is None:
+                raise KeyError
+            return retval
 
-        def _put(self, key, val, expire=0):
-            val = json.dumps(val)
+        def _put_raw(self, key, data, expire=0):
             if expire == 0:
-                self.r.set(key, val)
+                self.r.set(key, data)
             else:
                 expire = int(expire - time.time())
-                self.r.setex(key, val, expire)
+                self.r.setex(key, data, expire)
+
+        def delete(self, key):
+            self.r.delete(key)
+
+        def _get_raw_multi(self, keys):
+            if not keys:
+                return {}
+            return dict((key, data) for (key, data) in
+                    zip(keys, self.r.mget(keys)) if data is not None)
 
         def has_key(self, key):
             return self.r.exists(key)
 
+        def _locks(self):
+            if not hasattr(self.local, 'locks'):
+                self.local.locks = {}
+            return self.local.locks
+
+        def _acquire_lock(self, key, lock_time):
+            lock_key = self._lock_key(key)
+            token = _lock_token()
+            # set with its expiry at once, so that a worker dying in between
+            # can't leave a lock that never expires
+            if not self.r.set(lock_key, token, nx=True,
+                    ex=max(int(lock_time), 1)):
+                return False
+            self._locks()[key] = token
+            return True
+
+        def _release_lock(self, key):
+            token = self._locks().pop(key, None)
+            if token is not None:
+                self._release_script(keys=[self._lock_key(key)],
+                        args=[token])
+
 except ImportError:
     pass
 
 try:
     import memcache
-    def utf8(s):
-        if isinstance(s, unicode):
-            return s.encode('utf-8')
-        return s
 
     class MemcacheCache(BaseCache):
-        def __init__(self, hosts=['localhost:11211']):
+        def __init__(self, hosts=['localhost:11211'], codec=None):
             self.m = memcache.Client(hosts)
+            if codec is not None:
+                self.codec = codec
+            self.local = threading.local()
 
-        def _get(self, key):
+        def _get_raw(self, key):
             retval = self.m.get(utf8(key))
             if retval is None:
                 raise KeyError
-            else:
-                return json.loads(retval)
+            return retval
 
-        def _put(self, key, val, expire=0):
-            val = json.dumps(val)
+        def _put_raw(self, key, data, expire=0):
             if expire == 0:
-                self.m.set(utf8(key), val)
+                self.m.set(utf8(key), data)
             else:
                 expire = int(expire - time.time())
-                self.m.set(utf8(key), val, expire)
+                self.m.set(utf8(key), data, expire)
+
+        def delete(self, key):
+            self.m.delete(utf8(key))
+
+        def _get_raw_multi(self, keys):
+            found = self.m.get_multi([utf8(key) for key in keys])
+            return dict((key, found[utf8(key)]) for key in keys
+                    if found.get(utf8(key)) is not None)
 
         def has_key(self, key):
             return self.m.get(utf8(key)) is not None
 
+        def _locks(self):
+            if not hasattr(self.local, 'locks'):
+                self.local.locks = {}
+            return self.local.locks
+
+        def _acquire_lock(self, key, lock_time):
+            lock_key = utf8(self._lock_key(key))
+            token = _lock_token()
+            if not self.m.add(lock_key, token, int(lock_time)):
+                return False
+            self._locks()[key] = token
+            return True
+
+        def _release_lock(self, key):
+            token = self._locks().pop(key, None)
+            lock_key = utf8(self._lock_key(key))
+            # don't delete a lock that expired and was taken by somebody else
+            if token is not None and self.m.get(lock_key) == token:
+                self.m.delete(lock_key)
+
 except ImportError:
     pass
@@ -0,0 +1,92 @@
+"""Incremental JSON encoding, for responses too large to build in memory
+
+iterencode() produces the same document json.dumps() would, as a series of
+string chunks suitable for a WSGI response body.  Besides the usual types,
+IterDict instances are encoded as objects and other iterators (like
+generators) as arrays, and are only consumed as the document is written.
+"""
+import types
+
+from buildapi.lib import json
+
+# Encoded pieces are joined into chunks of about this many bytes
+chunk_size = 64 * 1024
+
+class IterDict(object):
+    """A JSON object whose (key, value) items are produced by an iterable"""
+    def __init__(self, items):
+        self.items = items
+
+    def __iter__(self):
+        return iter(self.items)
+
+def _encodeKey(key):
+    # like json.dumps, write keys that aren't strings as the string of their
+    # own encoding
+    if not isinstance(key, basestring):
+        key = json.dumps(key)
+    return json.dumps(key)
+
+def _isLazy(obj):
+    return isinstance(obj, (IterDict, types.GeneratorType)) or \
+            (hasattr(obj, 'next') and hasattr(obj, '__iter__'))
+
+def _hasLazy(obj):
+    if isinstance(obj, dict):
+        obj = obj.itervalues()
+    elif not isinstance(obj, (list, tuple)):
+        return False
+    for value in obj:
+        if _isLazy(value) or _hasLazy(value):
+            return True
+    return False
+
+def _iterencode(obj):
+    if isinstance(obj, dict):
+        if not _hasLazy(obj):
+            # plain objects are encoded in one go
+            yield json.dumps(obj)
+            return
+        obj = IterDict(obj.iteritems())
+    if isinstance(obj, IterDict):
+        yield '{'
+        first = True
+        for key, value in obj:
+            if not first:
+                yield ', '
+            first = False
+            yield _encodeKey(key)
+            yield ': '
+            for piece in _iterencode(value):
+                yield piece
+        yield '}'
+    elif isinstance(obj, (list, tuple)) or _isLazy(obj):
+        # arrays are written an item at a time
+        yield '['
+        first = True
+        for value in obj:
+            if not first:
+                yield ', '
+            first = False
+            for piece in _iterencode(value):
+                yield piece
+        yield ']'
+    else:
+        yield json.dumps(obj)
+
+def iterencode(obj, size=None):
+    """Yields the JSON encoding of `obj` in chunks of about `size` bytes,
+    chunk_size by default"""
+    if size is None:
+        size = chunk_size
+    buf = []
+    buffered = 0
+    for piece in _iterencode(obj):
+        buf.append(piece)
+        buffered += len(piece)
+        if buffered >= size:
+            yield ''.join(buf)
+            buf = []
+            buffered = 0
+    if buf:
+        yield ''.join(buf)
@@ -208,13 +208,26 @@ class LoggingJobRequestDoneConsumer(JobRequestDoneConsumer):
     _clock = time.time
 
     def __init__(self, engine, *args, **kwargs):
+        # a BuildapiCache to invalidate as jobs complete
+        self.buildapi_cache = kwargs.pop('buildapi_cache', None)
         JobRequestDoneConsumer.__init__(self, *args, **kwargs)
         self.engine = engine
         self.session = sessionmaker(bind=engine)
 
+    def invalidate_cache(self, r):
+        """Evicts the cached builds affected by job request `r`"""
+        if not self.buildapi_cache:
+            return
+        try:
+            self.buildapi_cache.job_finished(r.action, json.loads(r.what))
+        except:
+            log.exception("Unable to invalidate cache for %s %s", r.action,
+                    r.what)
+
     def receive(self, message_data, message):
         """Handles new job completion messages.  Marks them as finished in the
-        DB by setting the complete_at and complete_data columsn."""
+        DB by setting the complete_at and complete_data columsn, and
+        invalidates the cached builds the job affected."""
         try:
             log.info("Got %s", message_data)
             now = self._clock()
@@ -227,6 +240,7 @@ class LoggingJobRequestDoneConsumer(JobRequestDoneConsumer):
                 r.completed_at = now
                 r.complete_data = json.dumps(message_data)
                 s.commit()
+                self.invalidate_cache(r)
             message.ack()
         except:
             log.exception("Unable to process message %s", message_data)
@@ -0,0 +1,28 @@
+"""Opaque cursors for keyset pagination
+
+A cursor holds the sort key of the last item of a page; the next page is
+whatever sorts after it, which the database finds through an index however
+deep into the results it is.
+"""
+import base64
+import binascii
+
+from buildapi.lib import json
+
+def encode_cursor(*values):
+    """Returns a url-safe token holding `values`"""
+    return base64.urlsafe_b64encode(json.dumps(values)).rstrip('=')
+
+def decode_cursor(token, count):
+    """Returns the list of `count` values held by `token`, or raises
+    ValueError if it isn't a valid cursor"""
+    try:
+        token = str(token)
+        values = json.loads(base64.urlsafe_b64decode(
+            token + '=' * (-len(token) % 4)))
+    except (TypeError, UnicodeError, binascii.Error):
+        raise ValueError("Invalid cursor: %r" % token)
+    if not isinstance(values, list) or len(values) != count or \
+            not all(isinstance(v, (int, long)) for v in values):
+        raise ValueError("Invalid cursor: %r" % token)
+    return values
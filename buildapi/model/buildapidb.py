@@ -7,10 +7,12 @@ Base = declarative_base()
 
 class JobRequest(Base):
     __tablename__ = 'jobrequests'
-    #__table_args__ = (
+    __table_args__ = (
             #UniqueConstraint('action', 'who', 'when'),
-            #{},
-            #)
+            # for paging through the jobs
+            Index('ix_jobrequests_when_id', 'when', 'id'),
+            {},
+            )
 
     id = Column(Integer, primary_key=True)
 
@@ -32,3 +34,67 @@ class JobRequest(Base):
                     completed_at=self.completed_at,
                     complete_data=(json.loads(self.complete_data) if self.complete_data else self.complete_data),
                     what=json.loads(self.what))
+
+class RevisionIndex(Base):
+    """Maps the short (12 character) revisions of the scheduler db's
+    sourcestamps to their ids, since sourcestamps.revision isn't indexed"""
+    __tablename__ = 'revision_index'
+
+    sourcestampid = Column(Integer, primary_key=True, autoincrement=False)
+    revision = Column(String(12), nullable=False, index=True)
+
+class Rollup(Base):
+    """The range of hours each of the report rollups covers"""
+    __tablename__ = 'rollups'
+
+    name = Column(String(32), primary_key=True)
+    starttime = Column(Integer, nullable=False) # epoch timestamp
+    endtime = Column(Integer, nullable=False) # epoch timestamp
+
+class WaitTimesRollup(Base):
+    """The wait times report's build requests, counted by pool and hour of
+    submission, buildername, hour their wait started and minutes waited"""
+    __tablename__ = 'waittimes_rollup'
+    __table_args__ = (
+            Index('ix_waittimes_rollup_pool_hour', 'pool', 'hour'),
+            {},
+            )
+
+    id = Column(Integer, primary_key=True)
+
+    pool = Column(String(32), nullable=False)
+    hour = Column(Integer, nullable=False) # epoch timestamp
+    buildername = Column(String(256), nullable=False)
+    stime = Column(Integer, nullable=False) # epoch timestamp
+    wait = Column(Integer) # minutes, NULL if the jobs haven't started
+    total = Column(Integer, nullable=False)
+    no_changes = Column(Integer, nullable=False)
+
+class PushesRollup(Base):
+    """The pushes report's pushes, counted by hour and branch"""
+    __tablename__ = 'pushes_rollup'
+
+    id = Column(Integer, primary_key=True)
+
+    hour = Column(Integer, nullable=False, index=True) # epoch timestamp
+    branch = Column(String(256))
+    total = Column(Integer, nullable=False)
+
+class BuildersRollup(Base):
+    """The builders report's run times, summed up by hour of submission,
+    branch, buildername and results"""
+    __tablename__ = 'builders_rollup'
+
+    id = Column(Integer, primary_key=True)
+
+    hour = Column(Integer, nullable=False, index=True) # epoch timestamp
+    branch = Column(String(256))
+    buildername = Column(String(256), nullable=False)
+    results = Column(Integer, nullable=False)
+    total = Column(Integer, nullable=False)
+    sum_run_time = Column(Integer, nullable=False)
+    min_run_time = Column(Integer, nullable=False)
+    max_run_time = Column(Integer, nullable=False)
+    # json blob of the run times' QuantileSketch, NULL in the rows rolled up 
+    # before it was kept
+    run_times = Column(Text)
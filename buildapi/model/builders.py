@@ -1,13 +1,17 @@
 import simplejson
+from sqlalchemy import bindparam, select, and_
 
+from buildapi.lib import json
 import buildapi.model.meta as meta
-from buildapi.model.buildrequest import BuildRequest, BuildRequestsQuery
-from buildapi.model.reports import Report
+from buildapi.model import rollups, shards, statements
+from buildapi.model.buildrequest import BuildRequest, BuildRequestsQuery, \
+BuildRequestsStatement, ExecuteBuildRequestsQuery
+from buildapi.model.reports import Report, QuantileSketch
 from buildapi.model.util import PENDING, RUNNING, NO_RESULT, SUCCESS, \
 WARNINGS, FAILURE, SKIPPED, EXCEPTION, RETRY
 from buildapi.model.util import BUILDERS_DETAIL_LEVELS
 from buildapi.model.util import get_time_interval, get_platform, \
-get_build_type, get_job_type
+get_build_type, get_job_type, classify_buildername
 
 def BuildersQuery(starttime, endtime, branch_name):
     """Constructs the sqlalchemy query for fetching all build requests in the 
@@ -30,15 +34,22 @@ def BuildersTypeQuery(starttime, endtime, buildername):
            buildername - builder's name
     Output: query
     """
+    return BuildersTypeStatement().params(starttime=starttime,
+            endtime=endtime, buildername=buildername)
+
+@statements.cached
+def BuildersTypeStatement():
+    """Returns the statement of BuildersTypeQuery, with starttime, endtime and
+    buildername bindparams."""
     br = meta.scheduler_db_meta.tables['buildrequests']
 
-    q = BuildRequestsQuery(starttime=starttime, endtime=endtime)
-    q = q.where(br.c.buildername.like(buildername))
+    q = BuildRequestsStatement(False, True, True)
+    q = q.where(br.c.buildername.like(bindparam('buildername')))
     return q
 
 def GetBuildersReport(starttime=None, endtime=None, 
     branch_name='mozilla-central', platform=None, build_type=None, 
-    job_type=None, detail_level='builder'):
+    job_type=None, detail_level='builder', sharded=False, shard=False):
     """Get the average time per builder report for the speficied time interval 
     and branch.
 
@@ -48,6 +59,12 @@ def GetBuildersReport(starttime=None, endtime=None,
                 starttime plus 24 hours or current time (if starttime is not 
                 specified either)
            branch_name - branch name, default vaue is 'mozilla-central'
+           sharded - if True, the report is merged out of the reports of
+                each of its days (see shards.MergeShards)
+           shard - if True, the report is one of these, which keeps the 
+                build requests submitted after endtime (for changes before 
+                it) apart, in report.late, for merge() to only count them 
+                if the day they were submitted isn't merged too
     Output: BuildersReport
     """
     platform = platform or []
@@ -57,21 +74,102 @@ def GetBuildersReport(starttime=None, endtime=None,
     starttime, endtime = get_time_interval(starttime, endtime)
     detail_level_no = BUILDERS_DETAIL_LEVELS.index(detail_level) + 1
 
-    q = BuildersQuery(starttime, endtime, branch_name)
-    q_results = q.execute()
-
     report = BuildersReport(starttime, endtime, branch_name, 
         detail_level=detail_level_no)
     report.set_filters(dict(platform=platform, build_type=build_type, 
         job_type=job_type))
-
+    if sharded:
+        return shards.MergeShards(report, GetBuildersReport, 
+            branch_name=branch_name, platform=platform, 
+            build_type=build_type, job_type=job_type, 
+            detail_level=detail_level, shard=True)
+
+    # the rollups count build requests by the hour they were submitted in
+    rolled_until = rollups.coveredUntil('builders', starttime, endtime)
+    if rolled_until > starttime:
+        q_results = statements.stream(BuildersRollupStatement(),
+                starttime=starttime, endtime=rolled_until,
+                branch_name=branch_name)
+        for r in q_results:
+            report.add_rollup(r['buildername'], r['results'], r['total'],
+                r['sum_run_time'], r['min_run_time'], r['max_run_time'], 
+                run_times=r['run_times'])
+
+    # the query also matches build requests submitted after endtime for 
+    # changes before it, so it's run even if the rollups cover the range
+    q_results = ExecuteBuildRequestsQuery(starttime=rolled_until,
+            endtime=endtime, branch_name=branch_name)
     for r in q_results:
-        params = dict((str(k), v) for (k, v) in dict(r).items())
-        br = BuildRequest(**params)
-        report.add(br)
+        br = BuildRequest.from_row(r)
+        if shard and br.submitted_at >= endtime:
+            report.late.append(br)
+        else:
+            report.add(br)
 
     return report
 
+def RollupBuilders(starttime, endtime):
+    """Returns the builders_rollup rows for the build requests submitted from 
+    starttime to endtime that have finished.
+
+    Input: starttime - start time, UNIX timestamp (in seconds)
+           endtime - end time, UNIX timestamp (in seconds)
+    Output: list of row dictionaries
+    """
+    q_results = statements.stream(BuildersSubmittedStatement(),
+            starttime=starttime, endtime=endtime)
+
+    totals = {}
+    for r in q_results:
+        br = BuildRequest.from_row(r)
+
+        key = (rollups.hourOf(br.submitted_at), br.branch, br.buildername,
+            br.results)
+        t = totals.setdefault(key, [0, 0, None, 0, QuantileSketch()])
+        # pending and running build requests aren't counted, but their 
+        # builders are still listed
+        if br.status in (PENDING, RUNNING):
+            continue
+
+        d = br.get_run_time()
+        t[0] += 1
+        t[1] += d
+        if d < t[2] or t[2] == None:
+            t[2] = d
+        t[3] = max(t[3], d)
+        t[4].add(d)
+
+    return [dict(hour=hour, branch=branch, buildername=buildername,
+                 results=results, total=total, sum_run_time=sum_run_time,
+                 min_run_time=min_run_time or 0, max_run_time=max_run_time,
+                 run_times=json.dumps(run_times.to_dict()))
+            for (hour, branch, buildername, results),
+                (total, sum_run_time, min_run_time, max_run_time, run_times)
+            in totals.iteritems()]
+
+@statements.cached
+def BuildersSubmittedStatement():
+    """Returns the statement of BuildRequestsQuery for the build requests 
+    submitted between the starttime and endtime bindparams."""
+    br = meta.scheduler_db_meta.tables['buildrequests']
+
+    q = BuildRequestsStatement()
+    return q.where(and_(br.c.submitted_at >= bindparam('starttime'),
+        br.c.submitted_at < bindparam('endtime')))
+
+@statements.cached
+def BuildersRollupStatement():
+    """Returns the statement reading a branch's builders rollup, with 
+    branch_name, starttime and endtime bindparams."""
+    bro = meta.buildapi_db_meta.tables['builders_rollup']
+
+    return select([bro.c.buildername, bro.c.results, bro.c.total,
+                   bro.c.sum_run_time, bro.c.min_run_time,
+                   bro.c.max_run_time, bro.c.run_times],
+                  and_(bro.c.branch.startswith(bindparam('branch_name')),
+                       bro.c.hour >= bindparam('starttime'),
+                       bro.c.hour < bindparam('endtime')))
+
 def GetBuilderTypeReport(starttime=None, endtime=None, buildername=None):
     """Get the average time per builder report for one builder for the 
     speficied time interval. The builder is specified by its buildername.
@@ -86,14 +184,13 @@ def GetBuilderTypeReport(starttime=None, endtime=None, buildername=None):
     """
     starttime, endtime = get_time_interval(starttime, endtime)
 
-    q = BuildersTypeQuery(starttime, endtime, buildername)
-    q_results = q.execute()
+    q_results = statements.stream(BuildersTypeStatement(),
+            starttime=starttime, endtime=endtime, buildername=buildername)
 
     report = BuilderTypeReport(buildername=buildername, starttime=starttime, 
         endtime=endtime)
     for r in q_results:
-        params = dict((str(k), v) for (k, v) in dict(r).items())
-        br = BuildRequest(**params)
+        br = BuildRequest.from_row(r)
         report.add(br)
 
     return report
@@ -123,15 +220,67 @@ class BuildersReport(Report):
         self.builders = Node(self.branch_name, 
             info=BuilderTypeReport(detail_level=0))
 
-    def add(self, br):
-        path = self.get_path(br)
+        # build requests left out of the tree of a shard (see 
+        # GetBuildersReport)
+        self.late = []
 
+    def add(self, br):
+        # no node keeps the build requests themselves (which shards would 
+        # carry a day of): the report only lists summaries
+        for info in self._get_path_reports(self.get_path(br)):
+            info.add(br, summary=True)
+
+    def add_rollup(self, buildername, results, total, sum_run_time, 
+        min_run_time, max_run_time, run_times=None):
+        """Adds the run times of `total` of buildername's build requests with 
+        `results` out of a rollup; run_times is the JSON of their 
+        QuantileSketch, if the rollup has it."""
+        platform, build_type, job_type = classify_buildername(buildername)
+        path = (platform, build_type, job_type, 
+            buildername)[:self.detail_level]
+        if run_times:
+            run_times = QuantileSketch.from_dict(json.loads(run_times))
+        for info in self._get_path_reports(path):
+            info.add_rollup(results, total, sum_run_time, min_run_time, 
+                max_run_time, run_times=run_times)
+
+    def merge(self, other):
+        """Adds the build requests of `other`, a report on the same branch 
+        with the same detail level and filters over part of this one's 
+        timeframe (e.g. one of its days)."""
+        if (other.branch_name, other.detail_level, other.filters) != \
+            (self.branch_name, self.detail_level, self.filters):
+            raise ValueError("Can't merge the %s builders report (detail "
+                "level %s, filters %s) into the %s one (detail level %s, "
+                "filters %s)" % (other.branch_name, other.detail_level, 
+                other.filters, self.branch_name, self.detail_level, 
+                self.filters))
+        self._merge_nodes(self.builders, other.builders)
+
+        # the days these were submitted in have them too, if they're merged
+        for br in other.late:
+            if br.submitted_at >= self.endtime:
+                self.add(br)
+
+    def _merge_nodes(self, node, other):
+        node.info.merge(other.info)
+        for name, other_next in other.next.iteritems():
+            if name not in node.next:
+                info = other_next.info
+                node.next[name] = Node(name, info=BuilderTypeReport(
+                    buildername=info.buildername, platform=info.platform, 
+                    build_type=info.build_type, job_type=info.job_type, 
+                    detail_level=info.detail_level))
+            self._merge_nodes(node.next[name], other_next)
+
+    def _get_path_reports(self, path):
+        """Yields the reports of the nodes on path, from the root down."""
         if not self._passes_filters(path):
             return
 
         params = {}
         node = self.builders  # root node
-        node.info.add(br)     # update root report
+        yield node.info
         for level, name in enumerate(path):
             params.update({self._filter_names[level]: name})
 
@@ -140,9 +289,8 @@ class BuildersReport(Report):
                 node.next[name] = Node(name, 
                     info=BuilderTypeReport(detail_level=level + 1, **params))
 
-            # update report
             node = node.next[name]
-            node.info.add(br, summary=True)
+            yield node.info
 
     def _passes_filters(self, path):
         for level, name in enumerate(path):
@@ -242,6 +390,9 @@ class BuilderTypeReport(Report):
         }
         self._total_br = 0
 
+        # distribution of the run times, for their percentiles
+        self._run_times = QuantileSketch()
+
     def get_avg_run_time(self):
         return self._d_sum / self._total_br if self._total_br else 0
 
@@ -254,6 +405,10 @@ class BuilderTypeReport(Report):
     def get_max_run_time(self):
         return self._d_max
 
+    def get_run_time_percentile(self, percentile):
+        run_time = self._run_times.quantile(percentile / 100.)
+        return run_time if run_time is not None else 0
+
     def get_total_build_requests(self):
         return self._total_br
 
@@ -274,6 +429,7 @@ class BuilderTypeReport(Report):
         if d > self._d_max:
             self._d_max = d
         self._d_sum += d
+        self._run_times.add(d)
 
         self._total_br += 1
         if br.results in self._total_br_results:
@@ -283,6 +439,54 @@ class BuilderTypeReport(Report):
         if not summary:
             self.build_requests.append(br)
 
+    def add_rollup(self, results, total, sum_run_time, min_run_time, 
+        max_run_time, run_times=None):
+        """Adds `total` build requests with `results` out of a rollup; 
+        run_times is the QuantileSketch of their run times, if the rollup 
+        has it."""
+        if not total:
+            return
+
+        if min_run_time < self._d_min or self._d_min == None:
+            self._d_min = min_run_time
+        if max_run_time > self._d_max:
+            self._d_max = max_run_time
+        self._d_sum += sum_run_time
+
+        if run_times is not None:
+            self._run_times.merge(run_times)
+        else:
+            # rolled up before the rollups kept the sketch: the shortest and 
+            # longest run times, and the others at their average
+            self._run_times.add(min_run_time)
+            if total > 1:
+                self._run_times.add(max_run_time)
+            if total > 2:
+                self._run_times.add(float(sum_run_time - min_run_time - 
+                    max_run_time) / (total - 2), count=total - 2)
+
+        self._total_br += total
+        if results in self._total_br_results:
+            self._total_br_results[results] = \
+                self._total_br_results[results] + total
+
+    def merge(self, other):
+        """Adds the build requests of `other`, the report of the same builder 
+        (or builders) over another part of the timeframe."""
+        if other._d_min != None and (self._d_min == None or 
+            other._d_min < self._d_min):
+            self._d_min = other._d_min
+        self._d_max = max(self._d_max, other._d_max)
+        self._d_sum += other._d_sum
+        self._run_times.merge(other._run_times)
+
+        self._total_br += other._total_br
+        for results, n in other._total_br_results.iteritems():
+            self._total_br_results[results] = \
+                self._total_br_results.get(results, 0) + n
+
+        self.build_requests.extend(other.build_requests)
+
     def to_dict(self, summary=False):
         json_obj = {
             'buildername': self.buildername or '',
@@ -293,6 +497,10 @@ class BuilderTypeReport(Report):
             'min_run_time': self.get_min_run_time(),
             'max_run_time': self.get_max_run_time(),
             'sum_run_time': self.get_sum_run_time(),
+            'p50_run_time': self.get_run_time_percentile(50),
+            'p90_run_time': self.get_run_time_percentile(90),
+            'p99_run_time': self.get_run_time_percentile(99),
+            'run_time_sketch': self._run_times.to_dict(),
             'total_build_requests': self.get_total_build_requests(),
         }
         if not summary:
@@ -1,11 +1,13 @@
-from sqlalchemy import outerjoin, or_
+from sqlalchemy import outerjoin, or_, bindparam
 
 import buildapi.model.meta as meta
+from buildapi.model import statements
+from buildapi.model.revisions import revisionClause
 from buildapi.model.util import PENDING, RUNNING, COMPLETE, CANCELLED, \
 INTERRUPTED, MISC
 from buildapi.model.util import NO_RESULT
-from buildapi.model.util import get_branch_name, get_platform, get_build_type, \
-get_job_type, get_revision, results_to_str, status_to_str
+from buildapi.model.util import get_branch_name, classify_buildername, \
+get_revision, results_to_str, status_to_str
 
 def BuildRequestsQuery(revision=None, branch_name=None, starttime=None, 
     endtime=None, changeid_all=False):
@@ -32,6 +34,27 @@ def BuildRequestsQuery(revision=None, branch_name=None, starttime=None,
                 per build request, with only one of the changeids at random
     Output: query
     """
+    s = meta.scheduler_db_meta.tables['sourcestamps']
+
+    q = BuildRequestsStatement(bool(branch_name), bool(starttime),
+            bool(endtime), changeid_all)
+    if revision:
+        if not isinstance(revision, list):
+            revision = [revision]
+        revmatcher = [revisionClause(s, rev) for rev in revision if rev]
+        if revmatcher: 
+            q = q.where(or_(*revmatcher))
+    return q.params(branch_name=branch_name, starttime=starttime,
+            endtime=endtime)
+
+@statements.cached
+def BuildRequestsStatement(branch_name=False, starttime=False, endtime=False,
+    changeid_all=False):
+    """Constructs the statement of BuildRequestsQuery without revisions, with
+    branch_name, starttime and endtime bindparams for those that are True.
+
+    Output: statement
+    """
     b = meta.scheduler_db_meta.tables['builds']
     br = meta.scheduler_db_meta.tables['buildrequests']
     bs = meta.scheduler_db_meta.tables['buildsets']
@@ -73,20 +96,14 @@ def BuildRequestsQuery(revision=None, branch_name=None, starttime=None,
             s.c.id.label('ssid'),
         ])
 
-    if revision:
-        if not isinstance(revision, list):
-            revision = [revision]
-        revmatcher = [s.c.revision.like(rev + '%') for rev in revision if rev]
-        if revmatcher: 
-            q = q.where(or_(*revmatcher))
     if branch_name:
-        q = q.where(s.c.branch.like(branch_name + '%'))
+        q = q.where(s.c.branch.startswith(bindparam('branch_name')))
     if starttime:
-        q = q.where(or_(c.c.when_timestamp >= starttime, 
-            br.c.submitted_at >= starttime))
+        q = q.where(or_(c.c.when_timestamp >= bindparam('starttime'), 
+            br.c.submitted_at >= bindparam('starttime')))
     if endtime:
-        q = q.where(or_(c.c.when_timestamp < endtime, 
-            br.c.submitted_at < endtime))
+        q = q.where(or_(c.c.when_timestamp < bindparam('endtime'), 
+            br.c.submitted_at < bindparam('endtime')))
 
     # some build requests might have multiple builds or changeids
     if not changeid_all:
@@ -96,6 +113,25 @@ def BuildRequestsQuery(revision=None, branch_name=None, starttime=None,
 
     return q
 
+def ExecuteBuildRequestsQuery(revision=None, branch_name=None, starttime=None,
+    endtime=None, changeid_all=False):
+    """Executes BuildRequestsQuery, through the statement cache unless it's
+    for revisions, whose clauses vary, and streams its rows.
+
+    Input: same as BuildRequestsQuery
+    Output: iterator over the query results
+    """
+    if revision:
+        q = BuildRequestsQuery(revision=revision, branch_name=branch_name,
+            starttime=starttime, endtime=endtime, changeid_all=changeid_all)
+        return statements.iterRows(
+                q.execution_options(stream_results=True).execute())
+
+    q = BuildRequestsStatement(bool(branch_name), bool(starttime),
+            bool(endtime), changeid_all)
+    return statements.stream(q, branch_name=branch_name, starttime=starttime,
+            endtime=endtime)
+
 def GetBuildRequests(revision=None, branch_name=None, starttime=None, 
     endtime=None, changeid_all=False):
     """Fetches all build requests matching the parameters, and returns them as 
@@ -118,24 +154,47 @@ def GetBuildRequests(revision=None, branch_name=None, starttime=None,
     Output: dictionary of BuildRequest objects, keyed by (br.brid, br.bid)
     """
 
-    q = BuildRequestsQuery(revision=revision, branch_name=branch_name, 
-            starttime=starttime, endtime=endtime, changeid_all=changeid_all)
-    q_results = q.execute()
+    q_results = ExecuteBuildRequestsQuery(revision=revision,
+            branch_name=branch_name, starttime=starttime, endtime=endtime,
+            changeid_all=changeid_all)
 
     build_requests = {}
     for r in q_results:
-        params = dict((str(k), v) for (k, v) in dict(r).items())
-        brid, bid = params['brid'], params['bid']
+        brid, bid = r['brid'], r['bid']
 
         if (brid, bid) not in build_requests:
-            build_requests[(brid, bid)] = BuildRequest(**params)
+            build_requests[(brid, bid)] = BuildRequest.from_row(r)
         else:
-            build_requests[(brid, bid)].add_changeid(params['changeid'])
-            build_requests[(brid, bid)].add_author(params['author'])
+            build_requests[(brid, bid)].add_changeid(r['changeid'])
+            build_requests[(brid, bid)].add_author(r['author'])
 
     return build_requests
 
+# Placeholder of the lazily worked out attributes of BuildRequest
+_unset = object()
+
 class BuildRequest(object):
+    """A build request, with one of its builds.
+
+    Reports hold many of these, so they are kept small: their attributes 
+    are slots, changeids and authors are kept as single values until a 
+    second one is added, and the branch name and the buildername's platform, 
+    build type and job type are only worked out when first asked for.
+    """
+    __slots__ = ('number', 'brid', 'bid', 'branch', 'buildername', 'ssid', 
+        'revision', 'changes_revision', '_changeid', 'when_timestamp', 
+        'submitted_at', 'claimed_at', 'start_time', 'complete_at', 
+        'finish_time', 'claimed_by_name', 'complete', 'reason', 'results', 
+        '_authors', 'comments', 'revlink', 'category', 'repository', 
+        'project', 'buildsetid', 'status', '_branch_name', '_classification')
+
+    # the columns of BuildRequestsQuery, in the order of __init__'s arguments
+    _columns = ('author', 'bid', 'branch', 'brid', 'buildername', 
+        'buildsetid', 'category', 'changeid', 'changes_revision', 'claimed_at', 
+        'claimed_by_name', 'comments', 'complete', 'complete_at', 
+        'finish_time', 'number', 'project', 'revlink', 'revision', 'reason', 
+        'repository', 'results', 'submitted_at', 'ssid', 'start_time', 
+        'when_timestamp')
 
     def __init__(self, author=None, bid=None, branch=None, brid=None,
         buildername=None, buildsetid=None, category=None, changeid=None,
@@ -148,13 +207,13 @@ class BuildRequest(object):
         self.brid = brid
         self.bid = bid      # build id
         self.branch = branch
-        self.branch_name = get_branch_name(branch)
+        self._branch_name = _unset
         self.buildername = buildername
         self.ssid = ssid
         self.revision = get_revision(revision) # get at most the first 12 chars
         self.changes_revision = get_revision(changes_revision)
 
-        self.changeid = set([changeid])
+        self._changeid = changeid
         self.when_timestamp = when_timestamp
         self.submitted_at = submitted_at
         self.claimed_at = claimed_at
@@ -167,7 +226,7 @@ class BuildRequest(object):
         self.reason = reason
         self.results = results if results != None else NO_RESULT
 
-        self.authors = set([author])
+        self._authors = author
         self.comments = comments
         self.revlink = revlink
         self.category = category
@@ -177,9 +236,61 @@ class BuildRequest(object):
 
         self.status = self._compute_status()
 
-        self.platform = get_platform(buildername)
-        self.build_type = get_build_type(buildername) # opt / debug
-        self.job_type = get_job_type(buildername)    # build / unittest / talos
+        # build_type is opt / debug, job_type is build / unittest / talos
+        self._classification = None
+
+    def __getstate__(self):
+        # slots aren't pickled (or dumped, see shards.dumpShard) by default, 
+        # and the placeholder of attributes that haven't been worked out 
+        # wouldn't survive unpickling
+        return dict((name, getattr(self, name)) for name in self.__slots__ 
+            if name not in ('_branch_name', '_classification'))
+
+    def __setstate__(self, state):
+        for name, value in state.iteritems():
+            setattr(self, name, value)
+        self._branch_name = _unset
+        self._classification = None
+
+    @classmethod
+    def from_row(cls, row):
+        """Returns the BuildRequest of a BuildRequestsQuery result row."""
+        return cls(*[row[column] for column in cls._columns])
+
+    @property
+    def branch_name(self):
+        if self._branch_name is _unset:
+            self._branch_name = get_branch_name(self.branch)
+        return self._branch_name
+
+    def _classify(self):
+        if self._classification is None:
+            self._classification = classify_buildername(self.buildername)
+        return self._classification
+
+    @property
+    def platform(self):
+        return self._classify()[0]
+
+    @property
+    def build_type(self):
+        return self._classify()[1]
+
+    @property
+    def job_type(self):
+        return self._classify()[2]
+
+    @property
+    def changeid(self):
+        if isinstance(self._changeid, set):
+            return self._changeid
+        return set([self._changeid])
+
+    @property
+    def authors(self):
+        if isinstance(self._authors, set):
+            return self._authors
+        return set([self._authors])
 
     def _compute_status(self):
         # when_timestamp & submitted_at ?
@@ -216,10 +327,16 @@ class BuildRequest(object):
         return self.get_duration() - self.get_wait_time()
 
     def add_changeid(self, changeid):
-        self.changeid.add(changeid)
+        if isinstance(self._changeid, set):
+            self._changeid.add(changeid)
+        elif changeid != self._changeid:
+            self._changeid = set([self._changeid, changeid])
 
     def add_author(self, author):
-        self.authors.add(author)
+        if isinstance(self._authors, set):
+            self._authors.add(author)
+        elif author != self._authors:
+            self._authors = set([self._authors, author])
 
     def to_dict(self, summary=False):
         json_obj = {
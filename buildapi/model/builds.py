@@ -2,6 +2,8 @@ import time
 
 from sqlalchemy import *
 import buildapi.model.meta as meta
+from buildapi.model.revisions import revisionClause
+from buildapi.model import statements
 from buildapi.lib import json
 
 import logging
@@ -133,7 +135,36 @@ def getBuild(branch, build_id):
         return None
     return buildFromRow(build, requestProps=True)
 
+def getSourceStamp(request_id=None, build_id=None):
+    """Returns the branch, revision and submitted_at of build request
+    `request_id`, or of the request for build `build_id`, or None if there's
+    no such request."""
+    b  = meta.scheduler_db_meta.tables['builds']
+    br = meta.scheduler_db_meta.tables['buildrequests']
+    bs = meta.scheduler_db_meta.tables['buildsets']
+    ss = meta.scheduler_db_meta.tables['sourcestamps']
+
+    q = select([
+        ss.c.branch,
+        ss.c.revision,
+        br.c.submitted_at,
+        ])
+    q = q.where(and_(br.c.buildsetid == bs.c.id, bs.c.sourcestampid==ss.c.id))
+    if build_id is not None:
+        q = q.where(and_(br.c.id == b.c.brid, b.c.id == build_id))
+    else:
+        q = q.where(br.c.id == request_id)
+    q = q.limit(1)
+    return q.execute().fetchone()
+
 def getBuildsQuery(branch, starttime=None, endtime=None, limit=None):
+    return getBuildsStatement(bool(starttime), bool(endtime), limit).params(
+            branch=branch, starttime=starttime, endtime=endtime)
+
+@statements.cached
+def getBuildsStatement(starttime=False, endtime=False, limit=None):
+    """Returns the statement of getBuildsQuery, with a `branch` bindparam,
+    and `starttime` and `endtime` ones if they're True"""
     b  = meta.scheduler_db_meta.tables['builds']
     br = meta.scheduler_db_meta.tables['buildrequests']
     bs = meta.scheduler_db_meta.tables['buildsets']
@@ -166,13 +197,13 @@ def getBuildsQuery(branch, starttime=None, endtime=None, limit=None):
         ss.c.id == bs.c.sourcestampid,
         ))
     q = q.where(or_(
-            ss.c.branch.startswith(branch),
-            ss.c.branch.endswith(branch),
+            ss.c.branch.startswith(bindparam('branch')),
+            ss.c.branch.endswith(bindparam('branch')),
     ))
     if starttime:
-        q = q.where(b.c.start_time >= starttime)
+        q = q.where(b.c.start_time >= bindparam('starttime'))
     if endtime:
-        q = q.where(b.c.start_time < endtime)
+        q = q.where(b.c.start_time < bindparam('endtime'))
     q = q.order_by(
         b.c.id.desc(),
         )
@@ -182,7 +213,30 @@ def getBuildsQuery(branch, starttime=None, endtime=None, limit=None):
 
     return q
 
+@statements.cached
+def getChangedBuildsStatement(starttime=False, endtime=False):
+    """Returns a statement for the builds of getBuildsStatement that were
+    created since build `build_id`, or whose request was claimed or
+    completed at or after `claimed_at` or `complete_at`, all bindparams"""
+    b  = meta.scheduler_db_meta.tables['builds']
+    br = meta.scheduler_db_meta.tables['buildrequests']
+
+    q = getBuildsStatement(starttime, endtime)
+    q = q.where(or_(
+        b.c.id > bindparam('build_id'),
+        br.c.claimed_at >= bindparam('claimed_at'),
+        br.c.complete_at >= bindparam('complete_at'),
+    ))
+    return q
+
 def getPendingQuery(branch, starttime=None, endtime=None, limit=None):
+    return getPendingStatement(bool(starttime), bool(endtime), limit).params(
+            branch=branch, starttime=starttime, endtime=endtime)
+
+@statements.cached
+def getPendingStatement(starttime=False, endtime=False, limit=None):
+    """Returns the statement of getPendingQuery, with a `branch` bindparam,
+    and `starttime` and `endtime` ones if they're True"""
     br = meta.scheduler_db_meta.tables['buildrequests']
     bs = meta.scheduler_db_meta.tables['buildsets']
     ss = meta.scheduler_db_meta.tables['sourcestamps']
@@ -206,13 +260,13 @@ def getPendingQuery(branch, starttime=None, endtime=None, limit=None):
     q = q.where(br.c.claimed_at == 0)
     q = q.where(br.c.complete == 0)
     q = q.where(or_(
-            ss.c.branch.startswith(branch),
-            ss.c.branch.endswith(branch),
+            ss.c.branch.startswith(bindparam('branch')),
+            ss.c.branch.endswith(bindparam('branch')),
     ))
     if starttime:
-        q = q.where(br.c.submitted_at >= starttime)
+        q = q.where(br.c.submitted_at >= bindparam('starttime'))
     if endtime:
-        q = q.where(br.c.submitted_at < endtime)
+        q = q.where(br.c.submitted_at < bindparam('endtime'))
     if limit:
         q = q.limit(limit)
     q = q.order_by(
@@ -220,65 +274,117 @@ def getPendingQuery(branch, starttime=None, endtime=None, limit=None):
         )
     return q
 
-def getBuilds(branch, starttime=None, endtime=None, limit=None):
-    br = meta.scheduler_db_meta.tables['buildrequests']
-    retval = {'builds': [], 'running':[], 'pending': []}
+# The columns of getBuildsQuery, which getPendingQuery's rows are padded to
+# when they're read together
+_row_columns = ('build_id', 'request_id', 'number', 'buildername', 'id',
+        'reason', 'branch', 'revision', 'start_time', 'finish_time', 'results',
+        'submitted_at', 'claimed_at', 'claimed_by_name',
+        'claimed_by_incarnation', 'priority', 'complete', 'complete_at')
+
+def getUnionQuery(queries):
+    """Returns a query for the rows of each of the getBuildsQuery and
+    getPendingQuery based `queries`, with a `part` column holding the index
+    of the query they came from.  The rows come in order of part, and in
+    each query's own order."""
+    parts = []
+    for i, q in enumerate(queries):
+        if q._limit is not None:
+            # the query's order picks its rows, so keep it in a subquery
+            q = select([q.alias('part%i' % i)])
+        by_name = dict((c.key, c) for c in q.inner_columns)
+        columns = [literal_column(str(i)).label('part')]
+        for name in _row_columns:
+            if name in by_name:
+                columns.append(by_name[name].label(name))
+            else:
+                columns.append(null().label(name))
+        parts.append(q.with_only_columns(columns).order_by(None))
+    q = union_all(*parts)
+    # pending requests have no build_id, and are ordered by submitted_at
+    return q.order_by(q.c.part, q.c.build_id.desc(), q.c.submitted_at.desc())
+
+@statements.cached
+def getUnionStatement(*queries):
+    """Returns the getUnionQuery of the statements `queries`"""
+    return getUnionQuery(queries)
+
+def executeQueries(queries, params=None, union=True):
+    """Returns the list of rows of each of `queries`, fetched in a single
+    round trip with getUnionQuery, or one query at a time if `union` is
+    False.  `queries` are statements, run with the bindparam values in
+    `params`, or if `params` is None, queries with their values bound."""
+    if params is None:
+        execute = lambda q: q.execute()
+        union_q = union and getUnionQuery(queries)
+    else:
+        execute = lambda q: statements.execute(q, **params)
+        union_q = union and getUnionStatement(*queries)
+    if not union:
+        return [execute(q).fetchall() for q in queries]
+    retval = [[] for q in queries]
+    for row in execute(union_q):
+        retval[row.part].append(row)
+    return retval
 
-    build_q = getBuildsQuery(branch, starttime, endtime, limit)
-    running_builds = build_q.where(br.c.complete == 0)
-    old_builds = build_q.where(br.c.complete != 0)
+def recordsFromRows(rows, builds=None):
+    """Returns the list of builds and pending requests of `rows`, merging
+    the rows of builds with several requests.  Builds are looked up and
+    added to the `builds` dictionary, when given, so that rows of the same
+    build read by several calls are only represented once."""
+    if builds is None:
+        builds = {}
+    retval = []
+    for row in rows:
+        if not row.has_key('build_id') or row.build_id is None:
+            retval.append(requestFromRow(row))
+            continue
+        # Elements with the same claimed_by_name, claimed_by_incarnation,
+        # claimed_at, buildername, and number are actually the same build
+        # and should only be represented once
+        key = (row.claimed_by_name, row.claimed_by_incarnation,
+                row.claimed_at, row.buildername, row.number)
+        if key in builds:
+            builds[key]['requests'].append(requestFromRow(row))
+        else:
+            builds[key] = buildFromRow(row)
+            retval.append(builds[key])
+    return retval
 
-    # Elements with the same claimed_by_name, claimed_by_incarnation,
-    # claimed_at, buildername, and number are actually the same build and
-    # should only be represented once
+def getBuilds(branch, starttime=None, endtime=None, limit=None):
+    running, old, pending = executeQueries(
+            _getBuildsStatements(bool(starttime), bool(endtime), limit),
+            dict(branch=branch, starttime=starttime, endtime=endtime))
     builds = {}
-    for btype, q in ( ('running', running_builds), ('builds', old_builds) ):
-        for build in q.execute():
-            key = (build.claimed_by_name, build.claimed_by_incarnation, build.claimed_at, build.buildername, build.number)
-            if key in builds:
-                request = requestFromRow(build)
-                builds[key]['requests'].append(request)
-            else:
-                builds[key] = buildFromRow(build)
-                retval[btype].append(builds[key])
+    return {
+        'running': recordsFromRows(running, builds),
+        'builds': recordsFromRows(old, builds),
+        'pending': recordsFromRows(pending),
+        }
 
-    q = getPendingQuery(branch, starttime, endtime, limit)
-    for req in q.execute():
-        retval['pending'].append(requestFromRow(req))
+@statements.cached
+def _getBuildsStatements(starttime, endtime, limit):
+    br = meta.scheduler_db_meta.tables['buildrequests']
 
-    return retval
+    build_q = getBuildsStatement(starttime, endtime, limit)
+    running_builds = build_q.where(br.c.complete == 0)
+    old_builds = build_q.where(br.c.complete != 0)
+    pending_q = getPendingStatement(starttime, endtime, limit)
+    return running_builds, old_builds, pending_q
 
 def getRevision(branch, revision, starttime=None, endtime=None, limit=None):
     ss = meta.scheduler_db_meta.tables['sourcestamps']
-    br = meta.scheduler_db_meta.tables['buildrequests']
-
-    retval = []
 
     revision = revision[:12]
 
     # TODO: Look at changes table too to find unscheduled or merged changes.
+    revision_clause = revisionClause(ss, revision)
     build_q = getBuildsQuery(branch, starttime, endtime, limit)
-    build_q = build_q.where(ss.c.revision.startswith(revision))
+    build_q = build_q.where(revision_clause)
+    pending_q = getPendingQuery(branch, starttime, endtime, limit)
+    pending_q = pending_q.where(revision_clause)
 
-    # Elements with the same claimed_by_name, claimed_by_incarnation,
-    # claimed_at, buildername, and number are actually the same build and
-    # should only be represented once
-    builds = {}
-    for build in build_q.execute():
-        key = (build.claimed_by_name, build.claimed_by_incarnation, build.claimed_at, build.buildername, build.number)
-        if key in builds:
-            request = requestFromRow(build)
-            builds[key]['requests'].append(request)
-        else:
-            builds[key] = buildFromRow(build)
-            retval.append(builds[key])
-
-    q = getPendingQuery(branch, starttime, endtime, limit)
-    q = q.where(ss.c.revision.contains(revision))
-    for req in q.execute():
-        retval.append(requestFromRow(req))
-
-    return retval
+    builds, pending = executeQueries([build_q, pending_q])
+    return recordsFromRows(builds) + recordsFromRows(pending)
 
 def getBuilders(branch, starttime=None, endtime=None):
     """Returns a lits of builders available on branch between starttime and endtime.
@@ -298,43 +404,69 @@ def getBuilders(branch, starttime=None, endtime=None):
 
     return [row[0] for row in q.execute()]
 
-def getBuildsForUser(branch, user, starttime=None, endtime=None, limit=None):
+def _splitPage(rows, limit):
+    """Returns the rows of a full page of `limit` getBuildsQuery rows that
+    make up whole builds, and the build id that the next page's builds are
+    less than.  The rows of the page's last build are left for the next page,
+    since some of its requests may not have fit."""
+    if not limit or len(rows) < limit:
+        return rows, None
+    key = lambda r: (r.claimed_by_name, r.claimed_by_incarnation, r.claimed_at,
+            r.buildername, r.number)
+    last = key(rows[-1])
+    for i, row in enumerate(rows):
+        if key(row) == last:
+            break
+    if i == 0:
+        # a single build filled the page
+        return rows, rows[-1].build_id
+    return rows[:i], rows[i].build_id + 1
+
+def getBuildsForUser(branch, user, starttime=None, endtime=None, limit=None,
+        before=None):
+    """Returns the builds and requests for `user`'s changes on `branch`.
+    Completed builds are paged through `limit` request rows at a time: only
+    those with build ids less than `before` are returned if it's given (and
+    running builds and pending requests aren't), and 'next' holds the
+    `before` of the next page, or None on the last one."""
+    retval = {'builds': [], 'running':[], 'pending': [], 'next': None}
+    running_builds, old_builds, pending_q, older_builds = \
+            _getBuildsForUserStatements(bool(starttime), bool(endtime), limit)
+    params = dict(branch=branch, user=user, starttime=starttime,
+            endtime=endtime, before=before)
+
+    if before is not None:
+        old, = executeQueries([older_builds], params)
+        running = pending = []
+    else:
+        running, old, pending = executeQueries(
+                [running_builds, old_builds, pending_q], params)
+    old, retval['next'] = _splitPage(old, limit)
+
+    builds = {}
+    retval['running'] = recordsFromRows(running, builds)
+    retval['builds'] = recordsFromRows(old, builds)
+    retval['pending'] = recordsFromRows(pending)
+    return retval
+
+@statements.cached
+def _getBuildsForUserStatements(starttime, endtime, limit):
+    b  = meta.scheduler_db_meta.tables['builds']
     br = meta.scheduler_db_meta.tables['buildrequests']
     ss = meta.scheduler_db_meta.tables['sourcestamps']
     sc = meta.scheduler_db_meta.tables['sourcestamp_changes']
     c = meta.scheduler_db_meta.tables['changes']
-    retval = {'builds': [], 'running':[], 'pending': []}
-
-    build_q = getBuildsQuery(branch, starttime, endtime, limit)
-    build_q = build_q.where(and_(
+    user_clause = and_(
         ss.c.id == sc.c.sourcestampid,
         sc.c.changeid == c.c.changeid,
-        c.c.author == user,
-        ))
+        c.c.author == bindparam('user'),
+        )
+
+    build_q = getBuildsStatement(starttime, endtime, limit)
+    build_q = build_q.where(user_clause)
     running_builds = build_q.where(br.c.complete == 0)
     old_builds = build_q.where(br.c.complete != 0)
-
-    # Elements with the same claimed_by_name, claimed_by_incarnation,
-    # claimed_at, buildername, and number are actually the same build and
-    # should only be represented once
-    builds = {}
-    for btype, q in ( ('running', running_builds), ('builds', old_builds) ):
-        for build in q.execute():
-            key = (build.claimed_by_name, build.claimed_by_incarnation, build.claimed_at, build.buildername, build.number)
-            if key in builds:
-                request = requestFromRow(build)
-                builds[key]['requests'].append(request)
-            else:
-                builds[key] = buildFromRow(build)
-                retval[btype].append(builds[key])
-
-    q = getPendingQuery(branch, starttime, endtime, limit)
-    q = q.where(and_(
-        ss.c.id == sc.c.sourcestampid,
-        sc.c.changeid == c.c.changeid,
-        c.c.author == user,
-        ))
-    for req in q.execute():
-        retval['pending'].append(requestFromRow(req))
-
-    return retval
+    older_builds = old_builds.where(b.c.id < bindparam('before'))
+    pending_q = getPendingStatement(starttime, endtime, limit)
+    pending_q = pending_q.where(user_clause)
+    return running_builds, old_builds, pending_q, older_builds
@@ -1,5 +1,6 @@
 import buildapi.model.meta as meta
 from buildapi.model.buildrequest import GetBuildRequests
+from buildapi.model import shards
 from buildapi.model.changes import GetChanges
 from buildapi.model.reports import Report
 from buildapi.model.util import BUILDSET_REASON, PENDING, RUNNING, COMPLETE, \
@@ -9,7 +10,7 @@ SKIPPED, EXCEPTION, RETRY
 from buildapi.model.util import get_time_interval, get_revision, results_to_str
 
 def GetEndtoEndTimes(starttime=None, endtime=None,
-    branch_name='mozilla-central'):
+    branch_name='mozilla-central', sharded=False):
     """Get end to end times report for the speficied time interval and branch.
 
     Input: starttime - start time (UNIX timestamp in seconds), if not 
@@ -18,11 +19,16 @@ def GetEndtoEndTimes(starttime=None, endtime=None,
                 starttime plus 24 hours or current time (if starttime is not 
                 specified either)
            branch_name - branch name, default vaue is 'mozilla-central'
+           sharded - if True, the report is merged out of the reports of
+                each of its days (see shards.MergeShards)
     Output: EndtoEndTimesReport
     """
     starttime, endtime = get_time_interval(starttime, endtime)
 
     report = EndtoEndTimesReport(starttime, endtime, branch_name)
+    if sharded:
+        return shards.MergeShards(report, GetEndtoEndTimes, 
+            branch_name=branch_name)
 
     build_requests = GetBuildRequests(branch_name=branch_name, 
         starttime=starttime, endtime=endtime, changeid_all=True)
@@ -139,7 +145,8 @@ class EndtoEndTimesReport(Report):
 
     def add_build_request(self, br):
         if br.revision not in self._runs:
-            self._runs[br.revision] = BuildRun(br.revision, br.branch_name)
+            self._runs[br.revision] = self._new_run(br.revision, 
+                br.branch_name)
         run = self._runs[br.revision]
         run.add(br)
 
@@ -155,6 +162,30 @@ class EndtoEndTimesReport(Report):
         self._u_total_br = EndtoEndTimesReport.outdated
         self._avg_run_duration = EndtoEndTimesReport.outdated
 
+    def merge(self, other):
+        """Adds the build runs of `other`, a report on the same branch over 
+        part of this one's timeframe (e.g. one of its days).  The build 
+        requests both have are only counted once.
+        """
+        for revision, other_run in other._runs.iteritems():
+            if revision not in self._runs:
+                self._runs[revision] = self._new_run(revision, 
+                    other_run.branch_name)
+            self._runs[revision].merge(other_run)
+        for revision, other_run in other._changes_revision_runs.iteritems():
+            if revision not in self._changes_revision_runs:
+                self._changes_revision_runs[revision] = \
+                    self._runs[other_run.revision]
+        self._changes.update(other._changes)
+        self.pending_changes.update(other.pending_changes)
+
+        self._total_br = EndtoEndTimesReport.outdated
+        self._u_total_br = EndtoEndTimesReport.outdated
+        self._avg_run_duration = EndtoEndTimesReport.outdated
+
+    def _new_run(self, revision, branch_name):
+        return BuildRun(revision, branch_name)
+
     def to_dict(self, summary=False):
         json_obj = {
             'starttime': self.starttime,
@@ -270,6 +301,23 @@ class BuildRun(Report):
             else:
                 self.builds += 1
 
+    def merge(self, other):
+        """Adds the build requests of `other`, the same build run as seen 
+        over another part of the timeframe, that it doesn't have yet."""
+        brs = set((br.brid, br.bid) for br in self.build_requests)
+        for br in other.build_requests:
+            if (br.brid, br.bid) not in brs:
+                brs.add((br.brid, br.bid))
+                self.add(br)
+        self.changes_revision.update(other.changes_revision)
+        self.authors.update(other.authors)
+
+        if other.f_incomplete:
+            self.f_incomplete = True
+        changeids = set(c.changeid for c in self.pending_changes)
+        self.pending_changes.extend(c for c in other.pending_changes 
+            if c.changeid not in changeids)
+
     def get_duration(self):
         return self.gst_complete_at_time - self.lst_change_time \
             if self.gst_complete_at_time and self.lst_change_time else 0
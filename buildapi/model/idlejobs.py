@@ -1,6 +1,7 @@
 from sqlalchemy import *
 from sqlalchemy.sql import func
 import buildapi.model.meta as meta
+from buildapi.model.reports import IntervalCounts
 from buildapi.model.util import get_time_interval
 from pylons.decorators.cache import beaker_cache
 from decimal import *
@@ -61,33 +62,46 @@ class IdleJobsReport(object):
         self.builders = builders or []
         self.int_size = int_size
         self.int_no = int((self.endtime - self.starttime-1)/self.int_size) +1 if self.int_size else 1
-        self.builder_intervals = {}
-        self.builder_intervals['Total'] = [0]*self.int_no
+        self._builder_counts = {}
+        self._builder_counts['Total'] = IntervalCounts(self.int_no)
+        self._builder_intervals = None
         self.totals = {}
         self.totals['Total'] = 0
 
+    @property
+    def builder_intervals(self):
+        """Number of jobs per interval, by builder and 'Total'."""
+        if self._builder_intervals is None:
+            self._builder_intervals = dict((builder, counts.get_counts())
+                for builder, counts in self._builder_counts.iteritems())
+        return self._builder_intervals
+
     def get_interval_timestamp(self, int_idx):
         return self.starttime + int_idx*self.int_size
 
     def get_interval_indices(self, stime, etime):
+        return range(*self._get_interval_range(stime, etime))
+
+    def _get_interval_range(self, stime, etime):
         t = stime - self.starttime if stime > self.starttime else 0
         first_interval = int(t/self.int_size) if self.int_size else 0
         t = etime - self.starttime if etime > self.starttime else 0
         last_interval = int(t/self.int_size) if self.int_size else 0
-        return range(first_interval, last_interval+1)
+        return first_interval, last_interval+1
 
     def add(self, builder, row):
-        int_idxs = self.get_interval_indices(row['starttime'], row['endtime'])
+        first_idx, end_idx = self._get_interval_range(row['starttime'],
+            row['endtime'])
         if builder not in self.builders:
             self.builders.append(builder)
-            self.builder_intervals[builder] = [0]*self.int_no
+            self._builder_counts[builder] = IntervalCounts(self.int_no)
             self.totals[builder] = 0
 
         self.totals[builder] += row['endtime']-row['starttime']
         self.totals['Total'] += row['endtime']-row['starttime']
-        for i in int_idxs:
-            self.builder_intervals[builder][i] += 1
-            self.builder_intervals['Total'][i] += 1
+        self._builder_counts[builder].add(first_idx, end_idx)
+        self._builder_counts['Total'].add(first_idx, end_idx)
+        self._builder_intervals = None
         self.total+=1
         return True
 
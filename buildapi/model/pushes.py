@@ -1,9 +1,10 @@
 from datetime import datetime
 import math
-from sqlalchemy import select, and_, or_, not_
+from sqlalchemy import select, and_, or_, not_, bindparam
 
 import buildapi.model.meta as meta
-from buildapi.model.reports import IntervalsReport
+from buildapi.model import rollups, shards, statements
+from buildapi.model.reports import IntervalsReport, merge_counts
 from buildapi.model.util import get_time_interval, get_branch_name
 from buildapi.model.util import PUSHES_SOURCESTAMPS_BRANCH_SQL_EXCLUDE
 
@@ -23,6 +24,22 @@ def PushesQuery(starttime, endtime, branches=None):
                 all branches
     Output: query
     """
+    q = PushesStatement(len(branches or ()), starttime is not None,
+            endtime is not None)
+    return q.params(starttime=starttime, endtime=endtime,
+            **PushesBranchParams(branches))
+
+def PushesBranchParams(branches):
+    """Returns the values of PushesStatement's branch_pattern_<i>
+    bindparams."""
+    return dict(('branch_pattern_%i' % i, '%' + b + '%')
+            for i, b in enumerate(branches or ()))
+
+@statements.cached
+def PushesStatement(num_branches=0, starttime=False, endtime=False):
+    """Returns the statement of PushesQuery, with num_branches
+    branch_pattern_<i> bindparams and starttime and endtime bindparams if they
+    are True."""
     s = meta.scheduler_db_meta.tables['sourcestamps']
     sch = meta.scheduler_db_meta.tables['sourcestamp_changes']
     c = meta.scheduler_db_meta.tables['changes']
@@ -44,18 +61,20 @@ def PushesQuery(starttime, endtime, branches=None):
         q = q.where(and_(*bexcl))
 
     # filter desired branches
-    if branches:
-        bexp = [s.c.branch.like('%' + b + '%') for b in branches]
+    if num_branches:
+        bexp = [s.c.branch.like(bindparam('branch_pattern_%i' % i))
+            for i in range(num_branches)]
         q = q.where(or_(*bexp))
 
-    if starttime is not None:
-        q = q.where(c.c.when_timestamp >= starttime)
-    if endtime is not None:
-        q = q.where(c.c.when_timestamp < endtime)
+    if starttime:
+        q = q.where(c.c.when_timestamp >= bindparam('starttime'))
+    if endtime:
+        q = q.where(c.c.when_timestamp < bindparam('endtime'))
 
     return q
 
-def GetPushes(starttime=None, endtime=None, int_size=0, branches=None):
+def GetPushes(starttime=None, endtime=None, int_size=0, branches=None,
+    sharded=False):
     """Get pushes and statistics.
 
     Input: starttime - start time (UNIX timestamp in seconds), if not
@@ -66,15 +85,34 @@ def GetPushes(starttime=None, endtime=None, int_size=0, branches=None):
            int_size - break down results per interval (in seconds), if specified
            branches - filter by list of branches, if not spefified fetches all
                 branches
+           sharded - if True, the report is merged out of the reports of
+                each of its days (see shards.MergeShards)
     Output: pushes report
     """
     starttime, endtime = get_time_interval(starttime, endtime)
-
-    q = PushesQuery(starttime, endtime, branches)
-    q_results = q.execute()
+    branch_params = PushesBranchParams(branches)
 
     report = PushesReport(starttime, endtime, int_size=int_size,
         branches=branches)
+    if sharded:
+        return shards.MergeShards(report, GetPushes, int_size=int_size,
+            branches=branches)
+
+    rolled_until = rollups.coveredUntil('pushes', starttime, endtime,
+        int_size)
+    if rolled_until > starttime:
+        q = PushesRollupStatement(len(branches or ()))
+        q_results = statements.stream(q, starttime=starttime,
+                endtime=rolled_until, **branch_params)
+        for r in q_results:
+            push = Push(r['hour'], get_branch_name(r['branch']), None)
+            report.add(push, count=r['total'])
+    if rolled_until >= endtime:
+        return report
+
+    q = PushesStatement(len(branches or ()), True, True)
+    q_results = statements.stream(q, starttime=rolled_until, endtime=endtime,
+            **branch_params)
     for r in q_results:
         branch_name = get_branch_name(r['branch'])
         stime = float(r['when_timestamp'])
@@ -85,6 +123,39 @@ def GetPushes(starttime=None, endtime=None, int_size=0, branches=None):
 
     return report
 
+def RollupPushes(starttime, endtime):
+    """Returns the pushes_rollup rows for the pushes from starttime to
+    endtime.
+
+    Input: starttime - start time, UNIX timestamp (in seconds)
+           endtime - end time, UNIX timestamp (in seconds)
+    Output: list of row dictionaries
+    """
+    q = PushesStatement(0, True, True)
+    q_results = statements.stream(q, starttime=starttime, endtime=endtime)
+
+    counts = {}
+    for r in q_results:
+        key = (rollups.hourOf(r['when_timestamp']), r['branch'])
+        counts[key] = counts.get(key, 0) + 1
+
+    return [dict(hour=hour, branch=branch, total=total)
+            for (hour, branch), total in counts.iteritems()]
+
+@statements.cached
+def PushesRollupStatement(num_branches=0):
+    """Returns the statement reading the pushes rollup, with starttime,
+    endtime and num_branches branch_pattern_<i> bindparams."""
+    pr = meta.buildapi_db_meta.tables['pushes_rollup']
+
+    q = select([pr.c.hour, pr.c.branch, pr.c.total],
+               and_(pr.c.hour >= bindparam('starttime'),
+                    pr.c.hour < bindparam('endtime')))
+    if num_branches:
+        q = q.where(or_(*[pr.c.branch.like(bindparam('branch_pattern_%i' % i))
+            for i in range(num_branches)]))
+    return q
+
 class PushesReport(IntervalsReport):
 
     def __init__(self, starttime, endtime, int_size=0, branches=None):
@@ -123,7 +194,9 @@ class PushesReport(IntervalsReport):
             return self.intervals
         return self.branch_intervals[branch]
 
-    def add(self, push):
+    def add(self, push, count=1):
+        """Adds `count` pushes at push.stime; rollups add an hour's pushes 
+        at the start of that hour."""
         if self.filter_branches and push.branch_name not in self.branches:
             return False
 
@@ -132,16 +205,37 @@ class PushesReport(IntervalsReport):
 
         int_idx = self.get_interval_index(push.stime)
 
-        self.total += 1
-        self.intervals[int_idx] += 1
-        self.branch_intervals[push.branch_name][int_idx] += 1
-        self.branch_totals[push.branch_name] += 1
+        self.total += count
+        self.intervals[int_idx] += count
+        self.branch_intervals[push.branch_name][int_idx] += count
+        self.branch_totals[push.branch_name] += count
 
         if push.stime:
-            self.daily_intervals[datetime.fromtimestamp(push.stime).hour] += 1
+            self.daily_intervals[datetime.fromtimestamp(push.stime).hour] += \
+                count
 
         return True
 
+    def merge(self, other):
+        """Adds the pushes of `other`, a report over part of this one's 
+        timeframe (e.g. one of its days), with the same branches filter."""
+        if other.filter_branches != self.filter_branches or \
+            self.filter_branches and \
+            set(other.branches) != set(self.branches):
+            raise ValueError("Can't merge the pushes to %s into those to %s" 
+                % (other.branches, self.branches))
+        offset = self.get_interval_offset(other)
+
+        self.total += other.total
+        merge_counts(self.intervals, other.intervals, offset)
+        for branch in other.branches:
+            if branch not in self.branch_intervals:
+                self._init_branch(branch)
+            merge_counts(self.branch_intervals[branch], 
+                other.branch_intervals[branch], offset)
+            self.branch_totals[branch] += other.branch_totals[branch]
+        merge_counts(self.daily_intervals, other.daily_intervals)
+
     def to_dict(self, summary=False):
         json_obj = {
             'starttime': self.starttime,
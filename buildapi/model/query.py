@@ -1,48 +1,140 @@
 from sqlalchemy import *
+from buildapi.lib.cacher import LRUStore
+from buildapi.lib.jsonstream import IterDict
 import buildapi.model.meta as meta
+from buildapi.model import statements
+from buildapi.model.revisions import revisionClause
 from buildapi.model.util import get_time_interval
 from pylons.decorators.cache import beaker_cache
 
 import math, re, time
+from itertools import groupby
+from operator import attrgetter
 
 @beaker_cache(expire=600, cache_response=False)
-def GetAllBranches():
+def GetAllBranchLongnames():
+    """Returns the sorted branches of all the sourcestamps, as they're named
+    in them (e.g. releases/mozilla-1.9.2)"""
     ss = meta.scheduler_db_meta.tables['sourcestamps']
     q = select([ss.c.branch]).distinct()
-    q = q.where(not_(ss.c.branch.like("%unittest")))
-    q = q.where(not_(ss.c.branch.like("%talos")))
-    results = q.execute()
+    return sorted(r['branch'] for r in q.execute() if r['branch'])
 
+@beaker_cache(expire=600, cache_response=False)
+def GetAllBranches():
     # exclude defunct branches
     exclusions = ('releases/mozilla-1.9.3',
                  )
 
     branches = []
-    for r in results:
-        if r['branch'] not in exclusions:
-            # return last part of releases/mozilla-1.9.2, users/bob/foo
-            branches.append(r['branch'].split('/')[-1])
+    for longname in GetAllBranchLongnames():
+        if longname in exclusions or \
+                longname.lower().endswith(('unittest', 'talos')):
+            continue
+        # return last part of releases/mozilla-1.9.2, users/bob/foo
+        branches.append(longname.split('/')[-1])
 
     return sorted(branches)
 
+class BranchResolver(object):
+    """Maps sourcestamp branches to the longest of `branches` that the last
+    component of their name starts with, or 'Unknown'"""
+
+    def __init__(self, branches, memo_size=10000):
+        self.branches = branches
+        self.names = set(b for b in branches if b)
+        # try the longest prefixes first
+        self.lengths = sorted(set(len(b) for b in self.names), reverse=True)
+        self.memo = LRUStore(memo_size, memo_size)
+
+    def resolve(self, longname):
+        # nightlies don't have a branch set (bug 570814)
+        if not longname:
+            return None
+        try:
+            return self.memo.get(longname)
+        except KeyError:
+            pass
+
+        shortname = longname.split('/')[-1]
+        branch = 'Unknown'
+        for length in self.lengths:
+            if shortname[:length] in self.names:
+                branch = shortname[:length]
+                break
+        self.memo.set(longname, branch, 1)
+        return branch
+
+_branch_resolver = None
+
+def GetBranchResolver():
+    """Returns a BranchResolver for the current GetAllBranches()"""
+    global _branch_resolver
+    branches = GetAllBranches()
+    resolver = _branch_resolver
+    if resolver is None or (resolver.branches is not branches and
+            resolver.branches != branches):
+        resolver = _branch_resolver = BranchResolver(branches)
+    return resolver
+
 def GetBranchName(longname):
-    # nightlies don't have a branch set (bug 570814)
-    if not longname:
-        return None
-
-    allBranches = GetAllBranches()
-    shortname = longname.split('/')[-1]
-    maybeBranch = ''
-    for branch in allBranches:
-        if shortname.startswith(branch):
-            if len(branch) > len(maybeBranch):
-                maybeBranch = branch
-
-    if not maybeBranch:
-        maybeBranch = 'Unknown'
-    return maybeBranch
+    return GetBranchResolver().resolve(longname)
+
+def GetBranchNames(longnames):
+    """Returns a dictionary of GetBranchName(longname) for each of
+    `longnames`"""
+    resolve = GetBranchResolver().resolve
+    return dict((longname, resolve(longname)) for longname in set(longnames))
+
+def _groupRunningBuilds(rows, branch_name):
+    """Merges the request rows of each running build, which must be
+    consecutive in `rows`, and yields a (branch, revision, build) tuple per
+    build, as soon as its last row has been read"""
+    build_key = None
+    for r in rows:
+        key = (r.claimed_by_name, r.buildername, r.start_time, r.number)
+        if key != build_key:
+            if build_key is not None:
+                yield _runningBuild(real_branch, this_result)
+            build_key = key
+            real_branch = branch_name(r.branch)
+            min_brid = max_brid = r.brid
+            this_result = dict(
+                # These things shouldn't change between requests
+                buildername=r.buildername,
+                last_heartbeat=r.last_heartbeat,
+                claimed_by_name=r.claimed_by_name,
+                start_time=r.start_time,
+                number=r.number,
 
-def GetBuilds(branch=None, type='pending', rev=None):
+                # These do change between requests
+                id=r.id,
+                revision=r.revision,
+                request_ids=[r.brid],
+                submitted_at=r.submitted_at,
+                )
+            continue
+
+        # Use the latest information for the id and revision
+        if r.brid > max_brid:
+            max_brid = r.brid
+            this_result['id'] = r.id
+            this_result['revision'] = r.revision
+
+        # Use earliest information for submitted_at
+        if r.brid < min_brid:
+            min_brid = r.brid
+            this_result['submitted_at'] = r.submitted_at
+
+        this_result['request_ids'].append(r.brid)
+
+    if build_key is not None:
+        yield _runningBuild(real_branch, this_result)
+
+def _runningBuild(real_branch, this_result):
+    revision = this_result['revision'] or 'Unknown'
+    return (real_branch or 'Unknown', revision[:12], this_result)
+
+def GetBuildsQuery(branch=None, type='pending', rev=None, order_by=()):
     b  = meta.scheduler_db_meta.tables['builds']
     br = meta.scheduler_db_meta.tables['buildrequests']
     bs = meta.scheduler_db_meta.tables['buildsets']
@@ -78,13 +170,16 @@ def GetBuilds(branch=None, type='pending', rev=None):
         q = q.where(and_(br.c.claimed_at > 0,
                          br.c.complete == 0,
                          b.c.finish_time == None))
+        # keep the rows of each build together for _groupRunningBuilds
+        order_by = tuple(order_by) + (br.c.claimed_by_name,
+                br.c.buildername, b.c.start_time, b.c.number)
     # use an outer join to catch pending builds
     # can probably trim the list of columns a bunch
     elif type == 'revision':
         q = join(br, bs, br.c.buildsetid==bs.c.id) \
                 .join(ss, bs.c.sourcestampid==ss.c.id) \
                 .outerjoin(b, br.c.id == b.c.brid) \
-                .select(ss.c.revision.like(rev[0] + '%')) \
+                .select(revisionClause(ss, rev[0])) \
                 .with_only_columns([
                     br.c.id,
                     br.c.buildsetid,
@@ -101,97 +196,160 @@ def GetBuilds(branch=None, type='pending', rev=None):
 
     if branch is not None:
       q = q.where(ss.c.branch.like('%' + branch[0] + '%'))
+    if order_by:
+        q = q.order_by(*order_by)
+    return q
 
-    query_results = q.execute()
+def GetBuilds(branch=None, type='pending', rev=None):
+    query_results = GetBuildsQuery(branch, type, rev).execute()
+    branch_name = GetBranchResolver().resolve
 
     builds = {}
     if type == "running":
-        # Mapping of (claimed_by_name, buildername, start_time, number) to list of results
-        real_builds = {}
-        for r in query_results:
-            build_key = (r.claimed_by_name, r.buildername, r.start_time, r.number)
-            if build_key not in real_builds:
-                real_builds[build_key] = [r]
-            else:
-                real_builds[build_key].append(r)
-
-        for build_key, requests in real_builds.items():
-            real_branch = GetBranchName(requests[0]['branch'])
-            if not real_branch:
-                real_branch = 'Unknown'
-            if real_branch not in builds:
-                builds[real_branch] = {}
-
-            this_result = dict(
-                # These things shouldn't change between requests
-                buildername=requests[0].buildername,
-                last_heartbeat=requests[0].last_heartbeat,
-                claimed_by_name=requests[0].claimed_by_name,
-                start_time=requests[0].start_time,
-                number=requests[0].number,
-
-                # These do change between requests
-                id=None,
-                revision=None,
-                request_ids=[],
-                submitted_at=None,
-                )
-
-            for r in requests:
-                if not this_result['request_ids']:
-                    this_result['request_ids'].append(r.brid)
-                    this_result['id'] = r.id
-                    this_result['submitted_at'] = r.submitted_at
-                    this_result['revision'] = r.revision
-                else:
-                    # Use the latest information for the id and revision
-                    if r.brid > max(this_result['request_ids']):
-                        this_result['id'] = r.id
-                        this_result['revision'] = r.revision
-
-                    # Use earliest information for submitted_at
-                    if r.brid < min(this_result['request_ids']):
-                        this_result['submitted_at'] = r.submitted_at
-
-                    this_result['request_ids'].append(r.brid)
-
-            revision = this_result.get('revision')
-            if not revision:
-                revision = 'Unknown'
-            revision = revision[:12]
-            if revision not in builds[real_branch]:
-                builds[real_branch][revision] = []
-            builds[real_branch][revision].append(this_result)
+        for real_branch, revision, this_result in \
+                _groupRunningBuilds(query_results, branch_name):
+            builds.setdefault(real_branch, {}).setdefault(revision, []) \
+                    .append(this_result)
 
     else:
         for r in query_results:
-            real_branch = GetBranchName(r['branch'])
+            real_branch = branch_name(r['branch'])
             if not real_branch:
                 real_branch = 'Unknown'
-            revision = r['revision']
-            if not revision:
-                revision = 'Unknown'
-            revision = revision[:12]
+            revision = _revisionKey(r)
             if real_branch not in builds:
                 builds[real_branch] = {}
             if revision not in builds[real_branch]:
                 builds[real_branch][revision] = []
-
-            this_result = {}
-            for key,value in r.items():
-                if key not in ('branch','revision'):
-                    this_result[key] = value
-            builds[real_branch][revision].append(this_result)
+            builds[real_branch][revision].append(_resultFromRow(r))
 
     return builds
 
-def GetHistoricBuilds(slave, count=20):
+def _revisionKey(r):
+    return (r['revision'] or 'Unknown')[:12]
+
+def _resultFromRow(r):
+    this_result = {}
+    for key,value in r.items():
+        if key not in ('branch','revision'):
+            this_result[key] = value
+    return this_result
+
+def _iterBranches(rows, stream, gather):
+    """Yields a (branch name, builds) tuple per branch, named like GetBuilds
+    does, out of `rows` ordered by sourcestamp branch.
+
+    The builds of the branches that a single one of the sourcestamp branches
+    of GetAllBranchLongnames() resolves to are stream(rows) of its rows, in
+    turn.  The rows of the others, which can be apart (e.g. mozilla-1.9.2
+    and releases/mozilla-1.9.2, or the Unknown ones), are passed to
+    gather(rows, builds) with the dictionary of their branch's builds, and
+    those are yielded last.  Only a sourcestamp branch added since the
+    longnames were cached, that resolves to a branch streamed before it, can
+    make that one repeat, until they expire.
+    """
+    resolve = GetBranchResolver().resolve
+    names = GetBranchNames(GetAllBranchLongnames())
+    counts = {}
+    for name in names.itervalues():
+        counts[name] = counts.get(name, 0) + 1
+
+    gathered = {}
+    for longname, branch_rows in groupby(rows, attrgetter('branch')):
+        real_branch = resolve(longname) or 'Unknown'
+        if real_branch != 'Unknown' and longname in names and \
+                counts[real_branch] == 1 and real_branch not in gathered:
+            yield real_branch, stream(branch_rows)
+        else:
+            gather(branch_rows, gathered.setdefault(real_branch, {}))
+    for real_branch, builds in gathered.iteritems():
+        yield real_branch, builds
+
+def _pendingRevisions(rows):
+    for revision, revision_rows in groupby(rows, _revisionKey):
+        yield revision, (_resultFromRow(r) for r in revision_rows)
+
+def _gatherPending(rows, revisions):
+    for r in rows:
+        revisions.setdefault(_revisionKey(r), []).append(_resultFromRow(r))
+
+def _gatherRunning(rows, revisions):
+    for _, revision, this_result in _groupRunningBuilds(rows,
+            lambda longname: None):
+        revisions.setdefault(revision, []).append(this_result)
+    return revisions
+
+def IterBuilds(branch=None, type='pending'):
+    """Returns what GetBuilds(branch, type) does for pending or running
+    builds, as an IterDict for jsonstream.iterencode that reads the rows as
+    it goes.  Most branches' builds are read, and must be consumed, in turn
+    (see _iterBranches); running builds are then grouped by revision a
+    branch at a time."""
+    ss = meta.scheduler_db_meta.tables['sourcestamps']
+    order_by = (ss.c.branch,)
+    if type == 'pending':
+        order_by += (ss.c.revision,)
+    q = GetBuildsQuery(branch, type, order_by=order_by)
+    # with a server side cursor, so that the rows aren't all held in memory
+    # either (see statements.enableStreaming)
+    query_results = statements.iterRows(
+            q.execution_options(stream_results=True).execute())
+
+    if type == 'running':
+        return IterDict(_iterBranches(query_results,
+            lambda rows: _gatherRunning(rows, {}), _gatherRunning))
+    return IterDict(_iterBranches(query_results,
+        lambda rows: IterDict(_pendingRevisions(rows)), _gatherPending))
+
+# Builds are read, and their buildername properties looked up, this many at a
+# time
+historic_batch_size = 1000
+
+# The buildername properties of finished builds, which never change
+_buildername_cache = LRUStore(10000, 10000)
+
+def GetBuildernames(build_ids):
+    """Returns a dictionary of the buildername property of those of
+    `build_ids` that have one"""
+    p  = meta.status_db_meta.tables['properties']
+    bp = meta.status_db_meta.tables['build_properties']
+    q = select([bp.c.build_id, p.c.value])
+    q = q.where(and_(bp.c.property_id==p.c.id,
+                     p.c.name=='buildername',
+                     bp.c.build_id.in_(build_ids)))
+
+    retval = {}
+    for r in q.execute():
+        if r.build_id not in retval and r.value:
+            # Properties come wrapped in double-quotes. Strip them.
+            retval[r.build_id] = r.value.strip('"')
+    return retval
+
+def _addBuildernames(builds):
+    missing = []
+    for build in builds:
+        try:
+            build['buildername'] = _buildername_cache.get(build['id'])
+        except KeyError:
+            build['buildername'] = ""
+            missing.append(build)
+    if not missing:
+        return
+
+    buildernames = GetBuildernames([build['id'] for build in missing])
+    for build in missing:
+        if build['id'] in buildernames:
+            build['buildername'] = buildernames[build['id']]
+        if build['result'] is not None:
+            _buildername_cache.set(build['id'], build['buildername'], 1)
+
+def GetHistoricBuilds(slave, count=20, before=None):
+    """Returns the `count` most recent builds, of slaves whose names start
+    with `slave` if it's given, with ids less than `before` if it's given"""
     b  = meta.status_db_meta.tables['builds']
     bs = meta.status_db_meta.tables['builders']
     s  = meta.status_db_meta.tables['slaves']
     m  = meta.status_db_meta.tables['masters']
-    p  = meta.status_db_meta.tables['properties']
-    bp = meta.status_db_meta.tables['build_properties']
     if slave is not None:
         q = select([b.c.id,
                     bs.c.name.label('buildname'),
@@ -207,6 +365,8 @@ def GetHistoricBuilds(slave, count=20):
                         b.c.master_id==m.c.id))
         q = q.where(b.c.result != None)
         q = q.where(s.c.name.like(slave+'%'))
+        if before is not None:
+            q = q.where(b.c.id < before)
         q = q.order_by(b.c.id.desc()).limit(count)
     else:
         subq = select([b.c.id,
@@ -218,6 +378,8 @@ def GetHistoricBuilds(slave, count=20):
                        b.c.slave_id,
                        b.c.master_id])
         subq = subq.where(b.c.builder_id == bs.c.id)
+        if before is not None:
+            subq = subq.where(b.c.id < before)
         subq = subq.order_by(b.c.id.desc()).limit(count)
         subq = subq.alias('t')
         q = select([subq.c.id, subq.c.buildname, subq.c.buildnumber, subq.c.starttime, subq.c.endtime, subq.c.result, s.c.name.label('slavename'), m.c.name.label('master')])
@@ -227,24 +389,19 @@ def GetHistoricBuilds(slave, count=20):
 
     query_results = q.execute()
 
-    q2 = select([p.c.value])
-    q2 = q2.where(and_(bp.c.property_id==p.c.id,
-                       "properties.name='buildername'",
-                       "build_properties.build_id = :x"))
-
     builds = []
-    for r in query_results:
-        this_result = {}
-        for key,value in r.items():
-            this_result[str(key)] = value
-        this_result['buildername'] = ""
-        if 'id' in this_result:
-            q2_results = q2.execute(x=this_result['id'])
-            one_row = q2_results.fetchone()
-            if one_row and 'value' in one_row:
-                # Properties come wrapped in double-quotes. Strip them.
-                this_result['buildername'] = one_row['value'].strip('"')
-        builds.append(this_result)
+    while True:
+        rows = query_results.fetchmany(historic_batch_size)
+        if not rows:
+            break
+        batch = []
+        for r in rows:
+            this_result = {}
+            for key,value in r.items():
+                this_result[str(key)] = value
+            batch.append(this_result)
+        _addBuildernames(batch)
+        builds.extend(batch)
 
     return builds
 
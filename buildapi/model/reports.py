@@ -1,3 +1,5 @@
+import math
+
 import simplejson
 
 class Report(object):
@@ -35,3 +37,190 @@ class IntervalsReport(Report):
         """Returns the index of a certain interval, based on its timestamp."""
         tdiff = stime - self.starttime if stime > self.starttime else 0
         return int(tdiff / self.int_size) if self.int_size else 0
+
+    def get_interval_offset(self, other):
+        """Returns the index of the interval the first interval of `other`, 
+        a report over part of this one's timeframe, lines up with.  Raises 
+        ValueError if their intervals don't line up."""
+        if other.int_size != self.int_size or \
+            other.starttime < self.starttime or other.endtime > self.endtime:
+            raise ValueError("Can't merge a report from %s to %s with "
+                "intervals of %ss into one from %s to %s with intervals of "
+                "%ss" % (other.starttime, other.endtime, other.int_size, 
+                self.starttime, self.endtime, self.int_size))
+        if not self.int_size:
+            return 0
+        offset, rest = divmod(other.starttime - self.starttime, self.int_size)
+        if rest:
+            raise ValueError("The intervals of a report from %s don't line "
+                "up with those of one from %s" % (other.starttime, 
+                self.starttime))
+        return int(offset)
+
+def merge_counts(counts, other_counts, offset=0):
+    """Adds the list of per interval `other_counts` to `counts`, starting at 
+    interval `offset`."""
+    for idx, count in enumerate(other_counts):
+        counts[offset + idx] += count
+
+class IntervalCounts(object):
+    """Counts of how many ranges of intervals cover each of int_no intervals.
+
+    Ranges are recorded in a difference array, as +count at their first 
+    interval and -count past their last, so adding one takes the same time 
+    however many intervals it spans; get_counts() adds them all up in a 
+    single pass over the intervals.
+    """
+
+    def __init__(self, int_no):
+        self.int_no = int_no
+        self._diff = [0] * (int_no + 1)
+
+    def add(self, first_idx, end_idx, count=1):
+        """Counts the intervals from first_idx up to, but not including, 
+        end_idx `count` times."""
+        first_idx = max(first_idx, 0)
+        end_idx = min(end_idx, self.int_no)
+        if first_idx < end_idx:
+            self._diff[first_idx] += count
+            self._diff[end_idx] -= count
+
+    def add_union(self, ranges):
+        """Counts each interval covered by any of the (first_idx, end_idx) 
+        `ranges`, sorted by first_idx, once."""
+        first_idx = end_idx = None
+        for first, end in ranges:
+            if end_idx is not None and first <= end_idx:
+                end_idx = max(end_idx, end)
+                continue
+            if end_idx is not None:
+                self.add(first_idx, end_idx)
+            first_idx, end_idx = first, end
+        if end_idx is not None:
+            self.add(first_idx, end_idx)
+
+    def get_counts(self):
+        """Returns the list of the counts of each interval."""
+        counts = [0] * self.int_no
+        count = 0
+        for idx in xrange(self.int_no):
+            count += self._diff[idx]
+            counts[idx] = count
+        return counts
+
+class QuantileSketch(object):
+    """Mergeable sketch of the distribution of non-negative values (e.g. run 
+    or wait times), which answers quantiles within `relative_accuracy` of 
+    their exact values, as DDSketch does.
+
+    Values are counted in buckets whose bounds grow by a factor of 
+    (1 + relative_accuracy) / (1 - relative_accuracy), so at 1% a sketch of 
+    run times up to a week in seconds has fewer than 700 of them, however 
+    many values it counts.  Past max_buckets buckets, the lowest ones are 
+    collapsed together, which only loses accuracy on the lowest quantiles.  
+    Sketches with the same accuracy merge by adding up their buckets' 
+    counts, so merging is exact and doesn't depend on the order.
+    """
+
+    def __init__(self, relative_accuracy=0.01, max_buckets=1024):
+        self.relative_accuracy = relative_accuracy
+        self.max_buckets = max_buckets
+        self._gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = math.log(self._gamma)
+
+        self.count = 0
+        self.zero_count = 0  # values of 0, which have no bucket
+        self.min = None
+        self.max = None
+        self._bins = {}  # bucket index: count
+
+    def add(self, value, count=1):
+        """Counts `value` `count` times."""
+        if not count:
+            return
+
+        if value <= 0:
+            self.zero_count += count
+        else:
+            idx = int(math.ceil(math.log(value) / self._log_gamma))
+            self._bins[idx] = self._bins.get(idx, 0) + count
+            if len(self._bins) > self.max_buckets:
+                self._collapse()
+
+        self.count += count
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def merge(self, other):
+        """Counts the values of `other`, a sketch with the same accuracy."""
+        if other.relative_accuracy != self.relative_accuracy:
+            raise ValueError("Can't merge a sketch with a relative accuracy "
+                "of %s into one of %s" % (other.relative_accuracy, 
+                self.relative_accuracy))
+        if not other.count:
+            return
+
+        for idx, count in other._bins.iteritems():
+            self._bins[idx] = self._bins.get(idx, 0) + count
+        if len(self._bins) > self.max_buckets:
+            self._collapse()
+
+        self.count += other.count
+        self.zero_count += other.zero_count
+        if self.min is None or other.min < self.min:
+            self.min = other.min
+        if self.max is None or other.max > self.max:
+            self.max = other.max
+
+    def _collapse(self):
+        indexes = sorted(self._bins)
+        lowest = indexes[:len(indexes) - self.max_buckets]
+        first = indexes[len(lowest)]
+        for idx in lowest:
+            self._bins[first] += self._bins.pop(idx)
+
+    def quantile(self, q):
+        """Returns the value of quantile `q`, from 0 to 1 (e.g. 0.5 for the 
+        median), or None if no values were counted."""
+        if not self.count:
+            return None
+        if q <= 0:
+            return self.min
+        if q >= 1:
+            return self.max
+
+        rank = q * (self.count - 1)
+        seen = self.zero_count
+        if seen > rank:
+            return max(self.min, 0)
+        for idx in sorted(self._bins):
+            seen += self._bins[idx]
+            if seen > rank:
+                break
+        value = 2 * self._gamma ** idx / (self._gamma + 1)
+        return min(max(value, self.min), self.max)
+
+    def to_dict(self):
+        return {
+            'relative_accuracy': self.relative_accuracy,
+            'count': self.count,
+            'zero_count': self.zero_count,
+            'min': self.min,
+            'max': self.max,
+            'bins': [[idx, count] 
+                for idx, count in sorted(self._bins.iteritems())],
+        }
+
+    @classmethod
+    def from_dict(cls, obj):
+        """Returns the sketch `obj`, the output of to_dict(), is of (e.g. to 
+        merge the sketches of reports read as JSON)."""
+        sketch = cls(relative_accuracy=obj['relative_accuracy'])
+        sketch.count = obj['count']
+        sketch.zero_count = obj['zero_count']
+        sketch.min = obj['min']
+        sketch.max = obj['max']
+        sketch._bins = dict((idx, count) for idx, count in obj['bins'])
+        return sketch
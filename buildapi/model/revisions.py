@@ -0,0 +1,135 @@
+"""Lookups of sourcestamps by revision.
+
+sourcestamps.revision isn't indexed in the scheduler db, so matching
+revisions with LIKE scans the whole table.  Instead, the revision_index
+table in the buildapi db maps short revisions to sourcestamp ids.  It is
+populated incrementally, from the newest sourcestamp it has seen: by
+scripts/rollup.py, and by a small batch at most every index_interval seconds
+on lookups.  Until it has caught up with the sourcestamps table, lookups
+fall back to LIKE; after that, the sourcestamps newer than the newest
+indexed one are still matched with LIKE, by id range.
+"""
+import threading
+import time
+
+from sqlalchemy import select, func, and_, or_
+from sqlalchemy.exc import IntegrityError
+
+import buildapi.model.meta as meta
+
+import logging
+log = logging.getLogger(__name__)
+
+SHORT_REVISION_LENGTH = 12
+
+# Number of sourcestamps indexed per query, and queries per indexRevisions
+# call
+batch_size = 10000
+max_batches = 10
+
+# Number of sourcestamps indexed per check on lookups, which are made while
+# handling requests
+lookup_batch_size = 1000
+
+# Seconds between checks for new sourcestamps
+index_interval = 5
+
+_index_lock = threading.Lock()
+# whether the index of the buildapi db `bind` was complete when it was last
+# checked
+_index_state = {'bind': None, 'checked_at': 0, 'complete': False}
+
+def indexRevisions(batches=max_batches, size=None):
+    """Adds the sourcestamps newer than the newest indexed one to the
+    revision index, in at most `batches` batches of `size` (batch_size by
+    default) sourcestamps.
+
+    Output: True if the index is now complete
+    """
+    ri = meta.buildapi_db_meta.tables['revision_index']
+    ss = meta.scheduler_db_meta.tables['sourcestamps']
+
+    size = size or batch_size
+    last = getIndexedUntil()
+    for i in range(batches):
+        q = select([ss.c.id, ss.c.revision], ss.c.id > last)
+        q = q.order_by(ss.c.id).limit(size)
+        rows = q.execute().fetchall()
+        if not rows:
+            return True
+
+        # nightlies don't have a revision
+        values = [dict(sourcestampid=r.id,
+                       revision=r.revision[:SHORT_REVISION_LENGTH])
+                  for r in rows if r.revision]
+        if values:
+            try:
+                ri.insert().execute(values)
+            except IntegrityError:
+                # another process indexed them first
+                return False
+        last = rows[-1].id
+        if len(rows) < size:
+            return True
+    return False
+
+def getIndexedUntil():
+    """Returns the id of the newest indexed sourcestamp, 0 if none is"""
+    ri = meta.buildapi_db_meta.tables['revision_index']
+    return select([func.max(ri.c.sourcestampid)]).execute().scalar() or 0
+
+def _updateIndex(bind):
+    now = time.time()
+    if _index_state['bind'] is bind and \
+            now - _index_state['checked_at'] < index_interval:
+        return
+    # if another thread is updating the index, use it as it is
+    if not _index_lock.acquire(False):
+        return
+    try:
+        _index_state.update(bind=bind, checked_at=now, complete=False)
+        _index_state['complete'] = indexRevisions(batches=1,
+                size=lookup_batch_size)
+    except Exception:
+        log.exception("Couldn't update the revision index")
+    finally:
+        _index_lock.release()
+
+def getSourceStampIds(revision):
+    """Returns the ids of the indexed sourcestamps whose revision starts
+    with `revision`, and the id of the newest indexed sourcestamp, past which
+    the index doesn't know about them; or None if the revision index can't
+    tell yet."""
+    bind = meta.buildapi_db_meta.bind
+    if bind is None:
+        return None
+    _updateIndex(bind)
+    if _index_state['bind'] is not bind or not _index_state['complete']:
+        return None
+
+    ri = meta.buildapi_db_meta.tables['revision_index']
+    # before the lookup, so that whatever is indexed in between is either
+    # found by it or past `last`
+    last = getIndexedUntil()
+    short_revision = revision[:SHORT_REVISION_LENGTH]
+    q = select([ri.c.sourcestampid])
+    if len(short_revision) == SHORT_REVISION_LENGTH:
+        q = q.where(ri.c.revision == short_revision)
+    else:
+        q = q.where(ri.c.revision.startswith(short_revision))
+    return [r[0] for r in q.execute()], last
+
+def revisionClause(ss, revision):
+    """Returns a where clause matching the rows of sourcestamps table `ss`
+    whose revision starts with `revision`, looked up in the revision index
+    when possible."""
+    clause = ss.c.revision.startswith(revision)
+    found = getSourceStampIds(revision)
+    if found is None:
+        return clause
+    ids, last = found
+    # sourcestamps pushed since the index was last updated aren't in it
+    id_clause = ss.c.id > last
+    if ids:
+        id_clause = or_(ss.c.id.in_(ids), id_clause)
+    return and_(id_clause, clause)
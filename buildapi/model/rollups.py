@@ -0,0 +1,99 @@
+"""Hourly rollups of the wait times, pushes and builders reports.
+
+These reports join the scheduler db's build requests, changes and
+sourcestamps over the whole range they are asked for, which takes minutes
+for a month.  The rollup tables in the buildapi db hold what the reports
+need of those rows, aggregated by the hour they belong to.  They are
+extended incrementally by updateRollup (see scripts/rollup.py), up to the
+hours whose build requests have settled.
+
+A report starting on the hour, with intervals of whole hours, reads the
+hours its rollup covers from it, and only queries the scheduler db for the
+rest of its range.
+"""
+from sqlalchemy import select, and_
+
+import buildapi.model.meta as meta
+
+import logging
+log = logging.getLogger(__name__)
+
+HOUR = 3600
+
+# Seconds after which build requests are assumed to have settled (started
+# and finished), so that the hours they were submitted in can be rolled up
+settle_time = 12 * HOUR
+
+# Hours rolled up per transaction
+batch_hours = 24
+
+def hourOf(t):
+    """Returns the start of the hour timestamp `t` is in"""
+    t = int(t)
+    return t - t % HOUR
+
+def getRollupRange(name):
+    """Returns the (starttime, endtime) range of hours rollup `name` covers,
+    or None if it hasn't been started."""
+    r = meta.buildapi_db_meta.tables['rollups']
+    row = select([r.c.starttime, r.c.endtime], r.c.name == name).execute() \
+            .fetchone()
+    return tuple(row) if row else None
+
+def coveredUntil(name, starttime, endtime, int_size=0):
+    """Returns the time until which a report from `starttime` to `endtime`,
+    with intervals of `int_size` seconds, can be read from rollup `name`;
+    that's `starttime` if it can't be read from it at all.
+    """
+    if meta.buildapi_db_meta.bind is None:
+        return starttime
+    # the rollups can't tell apart times within an hour
+    if starttime % HOUR or int_size % HOUR:
+        return starttime
+    try:
+        covered = getRollupRange(name)
+    except Exception:
+        log.exception("Couldn't read the range of the %s rollup", name)
+        return starttime
+    if not covered or not covered[0] <= starttime < covered[1]:
+        return starttime
+    return max(starttime, min(covered[1], hourOf(endtime)))
+
+def updateRollup(name, rollup, until, since=None):
+    """Extends rollup `name` to the hours before `until`, by adding the rows
+    returned by rollup(starttime, endtime) for each batch of hours.
+
+    A rollup that hasn't been started yet starts at `since`.
+
+    Output: the end of the hours the rollup covers
+    """
+    r = meta.buildapi_db_meta.tables['rollups']
+    table = meta.buildapi_db_meta.tables['%s_rollup' % name]
+    bind = meta.buildapi_db_meta.bind
+
+    covered = getRollupRange(name)
+    if covered:
+        start = covered[1]
+    elif since is None:
+        raise ValueError("The %s rollup hasn't been started" % name)
+    else:
+        start = hourOf(since)
+        r.insert().execute(name=name, starttime=start, endtime=start)
+
+    until = hourOf(until)
+    while start < until:
+        end = min(start + batch_hours * HOUR, until)
+        rows = list(rollup(start, end))
+        with bind.begin() as conn:
+            # in case a previous run failed half way through
+            conn.execute(table.delete().where(
+                and_(table.c.hour >= start, table.c.hour < end)))
+            if rows:
+                conn.execute(table.insert(), rows)
+            conn.execute(r.update().where(r.c.name == name).values(
+                endtime=end))
+        log.info("Rolled up %s from %s to %s: %i rows", name, start, end,
+                len(rows))
+        start = end
+
+    return start
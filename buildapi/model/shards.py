@@ -0,0 +1,240 @@
+"""Reports computed as the merge of per-day shards.
+
+A report over a long timeframe can be put together out of the reports of
+each of its days, merged with their merge() methods.  The days are
+independent of each other, so they can be computed in a pool of processes
+(see startProcesses), and whole days that have settled (see
+rollups.settle_time) don't change anymore, so they're kept in `cache`, if
+there is one, and only computed once.  The controllers cache the merged
+reports, open days included, for a few minutes on top of that.
+
+A report function only returns sharded reports if asked to (e.g.
+GetWaitTimes(..., sharded=True)); it then calls MergeShards with the empty
+report over the whole timeframe and itself, to compute the shards.
+
+The build request reports match build requests by their changes' times as
+well as their own, so a request for a change pushed before midnight and
+submitted after it is in the shards of both days; their merge() methods
+only count it once.
+"""
+import hashlib
+import multiprocessing
+import sys
+import time
+
+import buildapi.model.meta as meta
+from buildapi.model import rollups
+
+import logging
+log = logging.getLogger(__name__)
+
+DAY = 86400
+
+# Pool of processes computing the shards of reports, forked by
+# startProcesses; without it, they're computed in the calling process
+_pool = None
+
+# Cache of the shards of settled days, which never change: an object with
+# get_multi(keys), returning a dictionary of the shards it has, and
+# put(key, shard) methods (e.g. buildapi.lib.cache.ShardCache)
+cache = None
+
+def startProcesses(processes):
+    """Forks the pool of `processes` processes computing the shards of
+    reports, if there's to be more than one.
+
+    It must be called before any other thread is started, e.g. while the
+    application is loaded: a process forked while another thread holds a
+    lock (logging's, an engine pool's, ...) would wait for it forever.
+    """
+    global _pool
+    if processes > 1 and _pool is None:
+        _pool = multiprocessing.Pool(processes, initializer=_initProcess)
+
+def stopProcesses():
+    """Stops the pool of processes started by startProcesses, if any"""
+    global _pool
+    if _pool is not None:
+        _pool.close()
+        _pool.join()
+        _pool = None
+
+def dayRanges(starttime, endtime, int_size=0):
+    """Splits the timeframe of a report with intervals of `int_size` seconds
+    into (starttime, endtime) ranges, at the midnights (UTC) its intervals
+    start at.  That's all of them if `int_size` is a divisor of a day, and
+    starttime is midnight plus a multiple of int_size.
+
+    Output: list of (starttime, endtime) ranges, from the first to the last
+    """
+    bounds = [starttime]
+    midnight = int(starttime) - int(starttime) % DAY + DAY
+    while midnight < endtime:
+        if not int_size or not (midnight - starttime) % int_size:
+            bounds.append(midnight)
+        midnight += DAY
+    bounds.append(endtime)
+
+    return zip(bounds[:-1], bounds[1:])
+
+def shardKey(func, starttime, endtime, params):
+    """Returns the cache key of the shard func(starttime=starttime,
+    endtime=endtime, **params) returns.  The params are hashed, since
+    memcached keys can't have spaces."""
+    return 'shards:%s.%s:%s:%s:%s' % (func.__module__, func.__name__,
+        starttime, endtime,
+        hashlib.md5(repr(sorted(params.items()))).hexdigest())
+
+# The classes of the objects shards are made of, which dumpShard saves the
+# state of and loadShard creates again; no other class is ever loaded
+state_classes = frozenset([
+    'buildapi.model.builders.BuilderTypeReport',
+    'buildapi.model.builders.BuildersReport',
+    'buildapi.model.builders.Node',
+    'buildapi.model.buildrequest.BuildRequest',
+    'buildapi.model.endtoend.BuildRun',
+    'buildapi.model.endtoend.EndtoEndTimesReport',
+    'buildapi.model.pushes.PushesReport',
+    'buildapi.model.reports.IntervalCounts',
+    'buildapi.model.reports.QuantileSketch',
+    'buildapi.model.slaves.Build',
+    'buildapi.model.slaves.SlaveDetailsReport',
+    'buildapi.model.slaves.SlavesReport',
+    'buildapi.model.trychooser.TryChooserBuildRun',
+    'buildapi.model.trychooser.TryChooserEndtoEndTimesReport',
+    'buildapi.model.waittimes.WaitTime',
+    'buildapi.model.waittimes.WaitTimeIntervals',
+    'buildapi.model.waittimes.WaitTimesReport',
+])
+
+def dumpShard(shard):
+    """Returns `shard` as plain data (lists, dictionaries with string keys,
+    strings and numbers), which any cacher codec can hold: tuples, sets,
+    other dictionaries and the objects of state_classes are tagged
+    dictionaries, objects holding their __getstate__() or __dict__.
+
+    Raises TypeError for objects of other classes.
+    """
+    if shard is None or isinstance(shard, (bool, int, long, float,
+        basestring)):
+        return shard
+    if isinstance(shard, list):
+        return [dumpShard(item) for item in shard]
+    if isinstance(shard, dict):
+        return {'dict': [[dumpShard(key), dumpShard(value)]
+            for key, value in shard.iteritems()]}
+    if isinstance(shard, tuple):
+        return {'tuple': [dumpShard(item) for item in shard]}
+    if isinstance(shard, (set, frozenset)):
+        return {'set': [dumpShard(item) for item in shard]}
+
+    cls = type(shard)
+    name = '%s.%s' % (cls.__module__, cls.__name__)
+    if name not in state_classes:
+        raise TypeError("%s objects can't be dumped" % name)
+    if hasattr(shard, '__getstate__'):
+        state = shard.__getstate__()
+    else:
+        state = shard.__dict__
+    return {'class': name, 'state': dumpShard(state)}
+
+def loadShard(data):
+    """Returns the shard dumpShard returned `data` for.
+
+    Raises ValueError if `data` isn't something dumpShard returns for a
+    report, e.g. if it has objects of other classes than state_classes.
+    """
+    if not isinstance(data, dict) or 'class' not in data:
+        raise ValueError("%r isn't a dumped shard" % (data,))
+    return _load(data)
+
+def _load(data):
+    if isinstance(data, list):
+        return [_load(item) for item in data]
+    if not isinstance(data, dict):
+        return data
+    if 'dict' in data:
+        return dict((_load(key), _load(value))
+            for key, value in data['dict'])
+    if 'tuple' in data:
+        return tuple(_load(item) for item in data['tuple'])
+    if 'set' in data:
+        return set(_load(item) for item in data['set'])
+
+    name = data.get('class')
+    if name not in state_classes:
+        raise ValueError("%s objects can't be loaded" % name)
+    module, cls_name = name.rsplit('.', 1)
+    __import__(module)
+    cls = getattr(sys.modules[module], cls_name)
+    shard = cls.__new__(cls)
+    state = _load(data['state'])
+    if hasattr(shard, '__setstate__'):
+        shard.__setstate__(state)
+    else:
+        shard.__dict__.update(state)
+    return shard
+
+def MergeShards(report, func, **params):
+    """Merges the reports func(starttime=..., endtime=..., **params) returns
+    for each of the days of `report` (see dayRanges), an empty report of the
+    same kind, into it.
+
+    The shards of the whole days that have settled are read from the cache
+    if they're in it, and put in it otherwise.  The rest, including the
+    partial days at either end of the report, whose ranges change with every
+    request, are computed in the process pool.
+
+    Output: report
+    """
+    ranges = dayRanges(report.starttime, report.endtime,
+        getattr(report, 'int_size', 0))
+    settled = time.time() - rollups.settle_time
+    cached = lambda starttime, endtime: (starttime % DAY == 0 and
+        endtime - starttime == DAY and endtime <= settled)
+
+    shards = {}
+    if cache is not None:
+        keys = dict((shardKey(func, starttime, endtime, params), starttime)
+            for (starttime, endtime) in ranges if cached(starttime, endtime))
+        for key, shard in cache.get_multi(keys.keys()).iteritems():
+            shards[keys[key]] = shard
+
+    missing = [(starttime, endtime) for (starttime, endtime) in ranges
+        if starttime not in shards]
+    for (starttime, endtime), shard in zip(missing,
+        computeShards(func, missing, params)):
+        shards[starttime] = shard
+        if cache is not None and cached(starttime, endtime):
+            cache.put(shardKey(func, starttime, endtime, params), shard)
+
+    log.debug("Merging %i shards of %s, %i of them computed", len(ranges),
+        func.__name__, len(missing))
+    for starttime, endtime in ranges:
+        report.merge(shards[starttime])
+
+    return report
+
+def computeShards(func, ranges, params):
+    """Returns the list of the reports func(starttime=..., endtime=...,
+    **params) returns for each of the (starttime, endtime) `ranges`,
+    computed in the process pool if there is one and there's more than one
+    of them."""
+    args = [(func, starttime, endtime, params)
+        for (starttime, endtime) in ranges]
+    if _pool is None or len(args) <= 1:
+        return map(_computeShard, args)
+    return _pool.map(_computeShard, args)
+
+def _computeShard(args):
+    func, starttime, endtime, params = args
+    return func(starttime=starttime, endtime=endtime, **params)
+
+def _initProcess():
+    # the processes are forked with any connections of the engines' pools,
+    # which must only be used (or closed) by the parent process: they're
+    # left behind, with their pools, rather than disposed of
+    for metadata in (meta.scheduler_db_meta, meta.status_db_meta,
+        meta.buildapi_db_meta):
+        if metadata.bind is not None:
+            metadata.bind.pool = metadata.bind.pool.recreate()
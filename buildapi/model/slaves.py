@@ -1,10 +1,12 @@
-from sqlalchemy import join
+from sqlalchemy import join, bindparam
 from datetime import datetime
 import re
 import time
 
 import buildapi.model.meta as meta
-from buildapi.model.reports import Report, IntervalsReport
+from buildapi.model import shards, statements
+from buildapi.model.reports import Report, IntervalsReport, IntervalCounts, \
+merge_counts
 from buildapi.model.util import get_time_interval, get_silos
 from buildapi.model.util import NO_RESULT, SUCCESS, WARNINGS, FAILURE, \
 SKIPPED, EXCEPTION, RETRY, SLAVE_SILOS, BUSY, IDLE
@@ -29,6 +31,16 @@ def BuildsQuery(starttime=None, endtime=None, slave_id=None, builder_name=None,
                 builder name for each build
     Output: query
     """
+    q = BuildsStatement(bool(starttime), bool(endtime), slave_id != None,
+            builder_name != None, get_builder_name)
+    return q.params(starttime=starttime, endtime=endtime, slave_id=slave_id,
+            builder_name=builder_name)
+
+@statements.cached
+def BuildsStatement(starttime=False, endtime=False, slave_id=False,
+    builder_name=False, get_builder_name=False):
+    """Returns the statement of BuildsQuery, with starttime, endtime, slave_id
+    and builder_name bindparams for those that are True."""
     q = join(b, s, b.c.slave_id == s.c.id)
     with_columns = [b.c.slave_id, s.c.name.label('slave_name'), b.c.result,
                     b.c.builder_id, b.c.starttime, b.c.endtime]
@@ -39,18 +51,31 @@ def BuildsQuery(starttime=None, endtime=None, slave_id=None, builder_name=None,
 
     q = q.select().with_only_columns(with_columns)
 
-    if slave_id != None:
-        q = q.where(b.c.slave_id == slave_id)
-    if builder_name != None:
-        q = q.where(bd.c.name == builder_name)
+    if slave_id:
+        q = q.where(b.c.slave_id == bindparam('slave_id'))
+    if builder_name:
+        q = q.where(bd.c.name == bindparam('builder_name'))
     if starttime:
-        q = q.where(b.c.starttime >= starttime)
+        q = q.where(b.c.starttime >= bindparam('starttime'))
     if endtime:
-        q = q.where(b.c.starttime <= endtime)
+        q = q.where(b.c.starttime <= bindparam('endtime'))
 
     return q
 
-def GetSlavesReport(starttime=None, endtime=None, int_size=0, last_int_size=0):
+def ExecuteBuildsQuery(starttime=None, endtime=None, slave_id=None,
+    builder_name=None, get_builder_name=False):
+    """Executes BuildsQuery through the statement cache, and streams its rows.
+
+    Input: same as BuildsQuery
+    Output: iterator over the query results
+    """
+    q = BuildsStatement(bool(starttime), bool(endtime), slave_id != None,
+            builder_name != None, get_builder_name)
+    return statements.stream(q, starttime=starttime, endtime=endtime,
+            slave_id=slave_id, builder_name=builder_name)
+
+def GetSlavesReport(starttime=None, endtime=None, int_size=0, last_int_size=0,
+    sharded=False):
     """Get the slaves report for the speficied time interval.
 
     Input: starttime - start time (UNIX timestamp in seconds), if not 
@@ -60,6 +85,8 @@ def GetSlavesReport(starttime=None, endtime=None, int_size=0, last_int_size=0):
                 specified either)
            last_int_size - the length in seconds for the last time interval 
                 for which to compute fail and busy/idle percentage.
+           sharded - if True, the report is merged out of the reports of
+                each of its days (see shards.MergeShards)
     Output: SlavesReport
     """
     starttime, endtime = get_time_interval(starttime, endtime)
@@ -68,9 +95,12 @@ def GetSlavesReport(starttime=None, endtime=None, int_size=0, last_int_size=0):
 
     report = SlavesReport(starttime, endtime, int_size=int_size,
         last_int_size=last_int_size)
+    if sharded:
+        return shards.MergeShards(report, GetSlavesReport, int_size=int_size,
+            last_int_size=last_int_size)
 
-    q = BuildsQuery(starttime=starttime_date, endtime=endtime_date)
-    q_results = q.execute()
+    q_results = ExecuteBuildsQuery(starttime=starttime_date,
+            endtime=endtime_date)
 
     for r in q_results:
         params = dict((str(k), v) for (k, v) in dict(r).items())
@@ -101,9 +131,8 @@ def GetSlaveDetailsReport(slave_id=None, starttime=None, endtime=None,
     report = SlaveDetailsReport(starttime, endtime, slave_id, 
         int_size=int_size, last_int_size=last_int_size)
 
-    q = BuildsQuery(slave_id=slave_id, get_builder_name=True,
-        starttime=starttime_date, endtime=endtime_date)
-    q_results = q.execute()
+    q_results = ExecuteBuildsQuery(slave_id=slave_id, get_builder_name=True,
+            starttime=starttime_date, endtime=endtime_date)
 
     for r in q_results:
         params = dict((str(k), v) for (k, v) in dict(r).items())
@@ -131,9 +160,8 @@ def GetStatusBuildersReport(starttime=None, endtime=None):
 
     report = BuildersReport(starttime, endtime)
 
-    q = BuildsQuery(starttime=starttime_date, endtime=endtime_date,
-        get_builder_name=True)
-    q_results = q.execute()
+    q_results = ExecuteBuildsQuery(starttime=starttime_date,
+            endtime=endtime_date, get_builder_name=True)
 
     for r in q_results:
         params = dict((str(k), v) for (k, v) in dict(r).items())
@@ -160,9 +188,9 @@ def GetBuilderDetailsReport(builder_name=None, starttime=None, endtime=None):
 
     report = BuilderDetailsReport(starttime, endtime, name=builder_name)
 
-    q = BuildsQuery(builder_name=builder_name, get_builder_name=True,
-        starttime=starttime_date, endtime=endtime_date)
-    q_results = q.execute()
+    q_results = ExecuteBuildsQuery(builder_name=builder_name,
+            get_builder_name=True, starttime=starttime_date,
+            endtime=endtime_date)
 
     for r in q_results:
         params = dict((str(k), v) for (k, v) in dict(r).items())
@@ -207,6 +235,19 @@ class SlavesReport(IntervalsReport):
         self._num_busy = SlavesReport.outdated
         self._avg_busy_time = SlavesReport.outdated
 
+    def merge(self, other):
+        """Adds the builds of `other`, a report over part of this one's 
+        timeframe (e.g. one of its days)."""
+        for slave_id, slave in other.slaves.iteritems():
+            if slave_id not in self.slaves:
+                self.slaves[slave_id] = SlaveDetailsReport(self.starttime, 
+                    self.endtime, slave_id, name=slave.name, 
+                    last_int_size=self.last_int_size, summary=True)
+            self.slaves[slave_id].merge(slave)
+
+        self._num_busy = SlavesReport.outdated
+        self._avg_busy_time = SlavesReport.outdated
+
     def total_slaves(self):
         """Total number of slaves."""
         return len(self.slaves.keys())
@@ -225,61 +266,43 @@ class SlavesReport(IntervalsReport):
         """Total number of idle slaves at endtime."""
         return self.total_slaves() - self.endtime_total_busy()
 
-    def get_int_busy(self):
-        """Number of busy machines per each interval."""
-        int_busy = [ 0 ] * self.int_no
-
-        for slave_id in self.slaves:
-            slave = self.slaves[slave_id]
-            disc_intervals = set()
+    def _get_busy_ranges(self, slave):
+        """The ranges of intervals a slave was busy in, sorted."""
+        intervals = sorted(slave.busy)
+        intervals.append((self.endtime, None, None)) # append fake interval
+        for inter in xrange(len(intervals) - 1):
+            start, end, _ = intervals[inter]
+            next_inter_start = intervals[inter + 1][0]
+            end = min(end or (next_inter_start - 1), self.endtime - 1)
 
-            intervals = sorted(slave.busy)
-            intervals.append((self.endtime, None, None)) # append fake interval
-            for inter in xrange(len(intervals) - 1):
-                start, end, _ = intervals[inter]
-                next_inter_start = intervals[inter + 1][0]
-                end = min(end or (next_inter_start - 1), self.endtime - 1)
+            yield self.get_interval_index(start), self.get_interval_index(end)
 
-                start_idx = self.get_interval_index(start)
-                end_idx = self.get_interval_index(end)
-                disc_intervals.update(xrange(start_idx, end_idx))
-
-            for int_idx in disc_intervals:
-                int_busy[int_idx] += 1
+    def get_int_busy(self):
+        """Number of busy machines per each interval."""
+        int_busy = IntervalCounts(self.int_no)
+        for slave in self.slaves.itervalues():
+            int_busy.add_union(self._get_busy_ranges(slave))
 
-        return int_busy
+        return int_busy.get_counts()
 
     def get_int_busy_silos(self):
         """Number of busy machines per each interval and per silos."""
         total_slaves = {}
-        int_busy = { 'Totals': [ 0 ] * self.int_no }
+        int_busy = {}
         for silos_name in SLAVE_SILOS:
-            int_busy[silos_name] = [ 0 ] * self.int_no
+            int_busy[silos_name] = IntervalCounts(self.int_no)
             total_slaves[silos_name] = set()
 
-        for slave_id in self.slaves:
-            slave = self.slaves[slave_id]
+        for slave in self.slaves.itervalues():
             silos_name = get_silos(slave.name)
-
-            disc_intervals = set()
-
-            intervals = sorted(slave.busy)
-            intervals.append((self.endtime, None, None)) # append fake interval
-            for inter in xrange(len(intervals) - 1):
-                start, end, _ = intervals[inter]
-                next_inter_start = intervals[inter + 1][0]
-                end = min(end or (next_inter_start - 1), self.endtime - 1)
-
-                start_idx = self.get_interval_index(start)
-                end_idx = self.get_interval_index(end)
-                disc_intervals.update(xrange(start_idx, end_idx))
-
-            for int_idx in disc_intervals:
-                int_busy[silos_name][int_idx] += 1
-                int_busy['Totals'][int_idx] += 1
-
+            int_busy[silos_name].add_union(self._get_busy_ranges(slave))
             total_slaves[silos_name].add(slave.name)
 
+        int_busy = dict((silos_name, counts.get_counts()) 
+            for silos_name, counts in int_busy.iteritems())
+        int_busy['Totals'] = [sum(busy) for busy in zip(*int_busy.values())] \
+            if int_busy else [ 0 ] * self.int_no
+
         totals = dict([(silos_name, len(total_slaves[silos_name])) 
             for silos_name in total_slaves])
         totals['Totals'] = self.total_slaves()
@@ -382,8 +405,7 @@ class SlaveDetailsReport(IntervalsReport):
             self.busy.append((build.starttime, endtime, result))
 
         # last interval
-        if build.starttime and self.endtime and self.last_int_size and (
-            build.starttime >= self.endtime - self.last_int_size):
+        if self._in_last_int(build.starttime):
             self.last_int_sum += self._busy_time(build)
             self.last_int_total += 1
 
@@ -398,13 +420,55 @@ class SlaveDetailsReport(IntervalsReport):
         if not self.summary:
             self.builds.append(build)
 
+    def merge(self, other):
+        """Adds the builds of `other`, the report of the same slave over part 
+        of this one's timeframe (e.g. one of its days).  Their busy times are 
+        worked out again, as `other` only counted them within its timeframe.
+        """
+        offset = self.get_interval_offset(other)
+
+        self.total += other.total
+        for result, n in other.results.iteritems():
+            self.results[result] += n
+        merge_counts(self.int_total, other.int_total, offset)
+        for result, int_results in other.results_int.iteritems():
+            merge_counts(self.results_int[result], int_results, offset)
+
+        # busy intervals hold the builds' results, with all the failing 
+        # ones as FAILURE
+        for starttime, endtime, result in other.busy:
+            busy_time = self._busy_range_time(starttime, endtime) \
+                if endtime else 0
+            self._d_sum += busy_time
+            if self._in_last_int(starttime):
+                self.last_int_sum += busy_time
+                self.last_int_total += 1
+                if result == FAILURE:
+                    self.last_int_fail += 1
+        self.busy.extend(other.busy)
+
+        if other.last_build and (not self.last_build or 
+            other.last_build.starttime >= self.last_build.starttime):
+            self.last_build = other.last_build
+
+        if not self.summary:
+            self.builds.extend(other.builds)
+
     def _busy_time(self, build):
         """Build run time within the report's timeframe."""
         if build.duration:
-            return (min(build.endtime, self.endtime) -
-                    max(build.starttime, self.starttime))
+            return self._busy_range_time(build.starttime, build.endtime)
         return 0
 
+    def _busy_range_time(self, starttime, endtime):
+        """Time from starttime to endtime within the report's timeframe."""
+        return min(endtime, self.endtime) - max(starttime, self.starttime)
+
+    def _in_last_int(self, starttime):
+        """Whether a build started at starttime is in the last interval."""
+        return bool(starttime and self.endtime and self.last_int_size and 
+            starttime >= self.endtime - self.last_int_size)
+
     def endtime_status(self):
         """Slave status at endtime: BUSY or IDLE."""
         if self.last_build and (not self.last_build.endtime or 
@@ -0,0 +1,102 @@
+"""Parameterised statements that are built and compiled only once
+
+Query builders decorated with @cached build their statement once per set of
+arguments, which should only describe its shape (which clauses it has); the
+values it's run with are left to bindparams.  execute() runs statements with
+SQLAlchemy's compiled cache, so each is compiled once per dialect too.
+
+stream() runs them the same way for the reports, which go through rows
+spanning up to months, but hands them out as they're fetched from the
+server, stream_batch_size at a time, instead of once they're all in memory.
+"""
+import functools
+
+# Statements built by @cached functions, by function and arguments
+_statements = {}
+
+# Compiled statements, by dialect, statement and parameter names.  It grows
+# with _statements, which is bounded by the shapes the builders can produce.
+_compiled = {}
+
+# Engines with the compiled cache option, by engine
+_engines = {}
+
+# Engines with the compiled cache and stream_results options, by engine
+_streaming_engines = {}
+
+# Rows fetched from the server at a time by stream()
+stream_batch_size = 1000
+
+def cached(func):
+    """Decorates a function returning a statement, to build it once for each
+    set of (positional) arguments"""
+    @functools.wraps(func)
+    def wrapper(*args):
+        key = (func, args)
+        try:
+            return _statements[key]
+        except KeyError:
+            statement = _statements[key] = func(*args)
+            return statement
+    return wrapper
+
+def execute(statement, **params):
+    """Executes `statement` with the values of its bindparams in `params`,
+    compiling it only the first time it's run on each dialect"""
+    bind = statement.bind
+    try:
+        engine = _engines[bind]
+    except KeyError:
+        engine = _engines[bind] = bind.execution_options(
+                compiled_cache=_compiled)
+    return engine.execute(statement, **params)
+
+def stream(statement, batch_size=None, **params):
+    """Executes `statement` like execute(), but with a server side cursor
+    where the engine has one (see enableStreaming), and returns an iterator
+    over its rows, fetched `batch_size` (by default stream_batch_size) at a
+    time."""
+    bind = statement.bind
+    try:
+        engine = _streaming_engines[bind]
+    except KeyError:
+        engine = _streaming_engines[bind] = bind.execution_options(
+                compiled_cache=_compiled, stream_results=True)
+    return iterRows(engine.execute(statement, **params), batch_size)
+
+def iterRows(results, batch_size=None):
+    """Iterates over the rows of `results`, fetching them `batch_size` (by
+    default stream_batch_size) at a time, and closes it once done."""
+    batch_size = batch_size or stream_batch_size
+    try:
+        while True:
+            rows = results.fetchmany(batch_size)
+            if not rows:
+                break
+            for row in rows:
+                yield row
+    finally:
+        # a server side cursor holds its connection until all the rows are
+        # read or it's closed
+        results.close()
+
+def enableStreaming(engine):
+    """Makes the statements executed on `engine` with the stream_results
+    option use a server side cursor, if it's a MySQLdb engine; SQLAlchemy
+    only does so itself for psycopg2.
+
+    A connection can't run anything else while such a cursor is open, so the
+    rows must be consumed (or the results closed) before it's reused."""
+    if engine.dialect.driver != 'mysqldb':
+        return
+    import MySQLdb.cursors
+
+    base = engine.dialect.execution_ctx_cls
+    class StreamingExecutionContext(base):
+        def create_cursor(self):
+            if self.execution_options.get('stream_results', False):
+                return self._dbapi_connection.cursor(
+                        MySQLdb.cursors.SSCursor)
+            return base.create_cursor(self)
+
+    engine.dialect.execution_ctx_cls = StreamingExecutionContext
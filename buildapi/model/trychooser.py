@@ -1,9 +1,11 @@
-from buildapi.model.buildrequest import BuildRequest, BuildRequestsQuery
+from buildapi.model import shards
+from buildapi.model.buildrequest import BuildRequest, \
+ExecuteBuildRequestsQuery
 from buildapi.model.endtoend import BuildRun, EndtoEndTimesReport
 from buildapi.model.util import get_time_interval
 
 def TryChooserGetEndtoEndTimes(starttime=None, endtime=None, 
-    branch_name='mozilla-central'):
+    branch_name='mozilla-central', sharded=False):
     """Get end to end times report for the speficied time interval and branch.
 
     Input: starttime - start time (UNIX timestamp in seconds), if not 
@@ -12,18 +14,22 @@ def TryChooserGetEndtoEndTimes(starttime=None, endtime=None,
                 starttime plus 24 hours or current time (if starttime is not 
                 specified either)
            branch_name - branch name, default vaue is 'mozilla-central'
+           sharded - if True, the report is merged out of the reports of
+                each of its days (see shards.MergeShards)
     Output: EndtoEndTimesReport
     """
     starttime, endtime = get_time_interval(starttime, endtime)
 
-    q = BuildRequestsQuery(starttime=starttime, endtime=endtime, 
+    report = TryChooserEndtoEndTimesReport(starttime, endtime, branch_name)
+    if sharded:
+        return shards.MergeShards(report, TryChooserGetEndtoEndTimes,
             branch_name=branch_name)
-    q_results = q.execute()
 
-    report = TryChooserEndtoEndTimesReport(starttime, endtime, branch_name)
+    q_results = ExecuteBuildRequestsQuery(starttime=starttime,
+            endtime=endtime, branch_name=branch_name)
+
     for r in q_results:
-        params = dict((str(k), v) for (k, v) in dict(r).items())
-        br = BuildRequest(**params)
+        br = BuildRequest.from_row(r)
         report.add_build_request(br)
 
     return report
@@ -49,6 +55,13 @@ class TryChooserEndtoEndTimesReport(EndtoEndTimesReport):
         self._avg_run_duration = EndtoEndTimesReport.outdated
         self._trychooser_flag = EndtoEndTimesReport.outdated
 
+    def merge(self, other):
+        EndtoEndTimesReport.merge(self, other)
+        self._trychooser_flag = EndtoEndTimesReport.outdated
+
+    def _new_run(self, revision, branch_name):
+        return TryChooserBuildRun(revision, branch_name)
+
     def get_used_trychooser(self):
         self._update_trychooser()
         return self.used_trychooser
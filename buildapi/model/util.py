@@ -267,6 +267,77 @@ def results_to_str(results):
     return _RESULTS_TO_STR[results]
 
 
+# Number of results kept by the classifiers below
+MEMO_SIZE = 10000
+
+class Classifier(object):
+    """Classifies strings by the first pattern of `table` they match.
+
+    `table` maps each class to a list of compiled patterns, which are tried
+    in the table's iteration order, like a loop over the table would.  They
+    are combined into as few alternations as possible, one named group per
+    pattern, so a string is matched by a handful of regexes instead of one
+    per pattern.  Results are memoized, for at most `memo_size` strings.
+    """
+    # python's re allows at most 100 groups per pattern
+    max_groups = 99
+
+    def __init__(self, table, memo_size=MEMO_SIZE):
+        self.memo_size = memo_size
+        self.memo = {}
+
+        # runs of consecutive patterns with the same flags, and few enough
+        # groups, each as [flags, number of groups, sources, classes]
+        runs = []
+        for name, patterns in table.iteritems():
+            for pat in patterns:
+                if not runs or runs[-1][0] != pat.flags or \
+                        runs[-1][1] + pat.groups + 1 > self.max_groups:
+                    runs.append([pat.flags, 0, [], []])
+                run = runs[-1]
+                run[1] += pat.groups + 1
+                run[2].append('(?P<c%i>%s)' % (len(run[3]), pat.pattern))
+                run[3].append(name)
+
+        # (combined regex, group name -> class)
+        self.regexes = []
+        for flags, groups, sources, classes in runs:
+            regex = re.compile('|'.join(sources), flags)
+            names = dict(('c%i' % i, name) for (i, name) in enumerate(classes))
+            self.regexes.append((regex, names))
+
+    def _classify(self, text):
+        for regex, names in self.regexes:
+            m = regex.match(text)
+            if m:
+                # the pattern's own group closes last, so it's lastgroup
+                return names[m.lastgroup]
+        return None
+
+    def classify(self, text):
+        """Returns the class of the first pattern matching `text`, or None"""
+        try:
+            return self.memo[text]
+        except KeyError:
+            pass
+        retval = self._classify(text)
+        if len(self.memo) >= self.memo_size:
+            self.memo.clear()
+        self.memo[text] = retval
+        return retval
+
+    def classify_many(self, texts):
+        """Returns the list of classes of `texts`"""
+        return [self.classify(text) for text in texts]
+
+
+_branch_classifier = Classifier(SOURCESTAMPS_BRANCH)
+_platform_classifier = Classifier(PLATFORMS_BUILDERNAME)
+_build_type_classifier = Classifier(BUILD_TYPE_BUILDERNAME)
+_job_type_classifier = Classifier(JOB_TYPE_BUILDERNAME)
+_silos_classifier = Classifier(SLAVE_SILOS)
+
+
 def get_branch_name(text):
     """Returns the branch name.
 
@@ -278,12 +349,7 @@ def get_branch_name(text):
         return None
 
     text = text.lower()
-    for branch in SOURCESTAMPS_BRANCH:
-        for pat in SOURCESTAMPS_BRANCH[branch]:
-            if pat.match(text):
-                return branch
-
-    return text
+    return _branch_classifier.classify(text) or text
 
 
 def get_platform(buildername):
@@ -299,12 +365,7 @@ def get_platform(buildername):
     if buildername.startswith('TB '):
         buildername = buildername[3:]
 
-    for platform in PLATFORMS_BUILDERNAME:
-        for pat in PLATFORMS_BUILDERNAME[platform]:
-            if pat.match(buildername):
-                return platform
-
-    return 'other'
+    return _platform_classifier.classify(buildername) or 'other'
 
 
 def get_build_type(buildername):
@@ -323,12 +384,7 @@ def get_build_type(buildername):
     if not buildername:
         return None
 
-    for build_type in BUILD_TYPE_BUILDERNAME:
-        for pat in BUILD_TYPE_BUILDERNAME[build_type]:
-            if pat.match(buildername):
-                return build_type
-
-    return None
+    return _build_type_classifier.classify(buildername)
 
 
 def get_job_type(buildername):
@@ -348,12 +404,30 @@ def get_job_type(buildername):
     if not buildername:
         return None
 
-    for job_type in JOB_TYPE_BUILDERNAME:
-        for pat in JOB_TYPE_BUILDERNAME[job_type]:
-            if pat.match(buildername):
-                return job_type
+    return _job_type_classifier.classify(buildername)
+
 
-    return None
+_buildername_memo = {}
+
+def classify_buildername(buildername):
+    """Returns (platform, build type, job type) for a buildername, see
+    get_platform, get_build_type and get_job_type."""
+    try:
+        return _buildername_memo[buildername]
+    except KeyError:
+        pass
+    retval = (get_platform(buildername), get_build_type(buildername),
+              get_job_type(buildername))
+    if len(_buildername_memo) >= MEMO_SIZE:
+        _buildername_memo.clear()
+    _buildername_memo[buildername] = retval
+    return retval
+
+
+def classify_many(buildernames):
+    """Returns a dictionary of classify_buildername(buildername) for each of
+    `buildernames`"""
+    return dict((b, classify_buildername(b)) for b in set(buildernames))
 
 
 def get_revision(revision):
@@ -368,12 +442,7 @@ def get_silos(slave_name):
     if not slave_name:
         return None
 
-    for silos_name in SLAVE_SILOS:
-        for pat in SLAVE_SILOS[silos_name]:
-            if pat.match(slave_name):
-                return silos_name
-
-    return None
+    return _silos_classifier.classify(slave_name)
 
 
 def get_time_interval(starttime, endtime):
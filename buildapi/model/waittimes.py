@@ -1,9 +1,12 @@
 import math
-from sqlalchemy import outerjoin, and_, not_, or_, func
+from sqlalchemy import outerjoin, and_, not_, or_, func, bindparam, \
+select
 
 from buildapi.lib.helpers import get_masters_for_pool
 import buildapi.model.meta as meta
-from buildapi.model.reports import IntervalsReport
+from buildapi.model import rollups, shards, statements
+from buildapi.model.reports import IntervalsReport, QuantileSketch, \
+merge_counts
 from buildapi.model.util import get_time_interval, get_platform
 from buildapi.model.util import WAITTIMES_BUILDSET_REASON_SQL_EXCLUDE, \
 WAITTIMES_BUILDREQUESTS_BUILDERNAME_SQL_EXCLUDE, \
@@ -19,6 +22,13 @@ def WaitTimesQuery(starttime, endtime, pool):
            pool - fetches the builds only for masters in pool
     Output: query
     """
+    return WaitTimesStatement(pool, tuple(get_masters_for_pool(pool))).params(
+            starttime=starttime, endtime=endtime)
+
+@statements.cached
+def WaitTimesStatement(pool, masters):
+    """Returns the statement of WaitTimesQuery for pool and its masters, with
+    starttime and endtime bindparams."""
     b  = meta.scheduler_db_meta.tables['builds']
     br = meta.scheduler_db_meta.tables['buildrequests']
     bs = meta.scheduler_db_meta.tables['buildsets']
@@ -40,11 +50,10 @@ def WaitTimesQuery(starttime, endtime, pool):
                 func.min(c.c.when_timestamp).label("when_timestamp"),
             ])
 
-    q = q.where(bs.c.submitted_at >= starttime)
-    q = q.where(bs.c.submitted_at < endtime)
+    q = q.where(bs.c.submitted_at >= bindparam('starttime'))
+    q = q.where(bs.c.submitted_at < bindparam('endtime'))
 
     # filter by masters
-    masters = get_masters_for_pool(pool)
     mnames_matcher = [br.c.claimed_by_name.startswith(master) 
         for master in masters]
     if mnames_matcher:
@@ -73,7 +82,7 @@ def WaitTimesQuery(starttime, endtime, pool):
     return q
 
 def GetWaitTimes(pool='buildpool', mpb=15, starttime=None, endtime=None,
-    int_size=0, maxb=0):
+    int_size=0, maxb=0, sharded=False):
     """Get wait times and statistics for buildpool.
 
     Input: pool - name of the pool (e.g. buildpool, or trybuildpool)
@@ -86,15 +95,35 @@ def GetWaitTimes(pool='buildpool', mpb=15, starttime=None, endtime=None,
            int_size - break down results per interval (in seconds), if specified
            maxb - maximum block size; for wait times larger than maxb, group 
                     into the largest block
+           sharded - if True, the report is merged out of the reports of
+                each of its days (see shards.MergeShards)
     Output: wait times report
     """
     starttime, endtime = get_time_interval(starttime, endtime)
-
-    q = WaitTimesQuery(starttime, endtime, pool)
-    q_results = q.execute()
+    masters = get_masters_for_pool(pool)
 
     report = WaitTimesReport(pool, starttime, endtime, mpb=mpb, maxb=maxb, 
-        int_size = int_size, masters=get_masters_for_pool(pool))
+        int_size = int_size, masters=masters)
+    if sharded:
+        return shards.MergeShards(report, GetWaitTimes, pool=pool, mpb=mpb,
+            int_size=int_size, maxb=maxb)
+
+    # the rollups' blocks of a minute only add up to whole minutes
+    rolled_until = starttime
+    if mpb == int(mpb):
+        rolled_until = rollups.coveredUntil('waittimes', starttime, endtime,
+            int_size)
+    if rolled_until > starttime:
+        q_results = statements.stream(WaitTimesRollupStatement(), pool=pool,
+                starttime=starttime, endtime=rolled_until)
+        for r in q_results:
+            report.add_rollup(r['buildername'], r['stime'], r['wait'],
+                r['total'], r['no_changes'])
+    if rolled_until >= endtime:
+        return report
+
+    q = WaitTimesStatement(pool, tuple(masters))
+    q_results = statements.stream(q, starttime=rolled_until, endtime=endtime)
     for r in q_results:
         buildername = r['buildername']
         # start time is changes.when_timestamp, or buildrequests.submitted_at 
@@ -111,6 +140,60 @@ def GetWaitTimes(pool='buildpool', mpb=15, starttime=None, endtime=None,
 
     return report
 
+def RollupWaitTimes(starttime, endtime, pools):
+    """Returns the waittimes_rollup rows for the build requests submitted
+    from starttime to endtime.
+
+    Input: starttime - start time, UNIX timestamp (in seconds)
+           endtime - end time, UNIX timestamp (in seconds)
+           pools - dictionary of the masters of each pool to roll up
+    Output: list of row dictionaries
+    """
+    counts = {}
+    for pool, masters in pools.iteritems():
+        q = WaitTimesSubmittedStatement(pool, tuple(masters))
+        q_results = statements.stream(q, starttime=starttime,
+                endtime=endtime)
+        for r in q_results:
+            stime = r['when_timestamp'] or r['submitted_at']
+            etime = r['start_time']
+            wait = None
+            if etime:
+                wait = int(math.floor((etime - stime) / 60.0)) \
+                    if stime <= etime else 0
+
+            key = (pool, rollups.hourOf(r['buildset_submitted_at']),
+                r['buildername'], rollups.hourOf(stime), wait)
+            count = counts.setdefault(key, [0, 0])
+            count[0] += 1
+            count[1] += not r['when_timestamp']
+
+    return [dict(pool=pool, hour=hour, buildername=buildername, stime=stime,
+                 wait=wait, total=total, no_changes=no_changes)
+            for (pool, hour, buildername, stime, wait), (total, no_changes)
+            in counts.iteritems()]
+
+@statements.cached
+def WaitTimesSubmittedStatement(pool, masters):
+    """Returns WaitTimesStatement(pool, masters) with the buildsets'
+    submitted_at as buildset_submitted_at."""
+    bs = meta.scheduler_db_meta.tables['buildsets']
+
+    return WaitTimesStatement(pool, masters).column(
+            bs.c.submitted_at.label('buildset_submitted_at'))
+
+@statements.cached
+def WaitTimesRollupStatement():
+    """Returns the statement reading a pool's wait times rollup, with pool,
+    starttime and endtime bindparams."""
+    wr = meta.buildapi_db_meta.tables['waittimes_rollup']
+
+    return select([wr.c.buildername, wr.c.stime, wr.c.wait, wr.c.total,
+                   wr.c.no_changes],
+                  and_(wr.c.pool == bindparam('pool'),
+                       wr.c.hour >= bindparam('starttime'),
+                       wr.c.hour < bindparam('endtime')))
+
 class WaitTimesReport(IntervalsReport):
 
     def __init__(self, pool, starttime, endtime, mpb=15, maxb=0, int_size=0, 
@@ -137,6 +220,14 @@ class WaitTimesReport(IntervalsReport):
         self._wait_times = {0: WaitTimeIntervals(self.int_no)}
         self._platform_wait_times = {}
         self._platform_totals = {}
+        # distribution of each platform's wait times in whole minutes, for 
+        # their percentiles
+        self._platform_sketches = {}
+
+        # (platform, block_no, stime, count) of the wait times from before 
+        # starttime, which are counted in the first interval; a report this 
+        # one is merged into puts them in their own
+        self._early = []
 
     def get_total(self, platform=None):
         if not platform: 
@@ -151,6 +242,10 @@ class WaitTimesReport(IntervalsReport):
             if not platform else self._platform_wait_times[platform]
         return range(0, max(wt.keys()) + 1, self.mpb)
 
+    def get_wait_time_percentile(self, percentile, platform):
+        wait = self._platform_sketches[platform].quantile(percentile / 100.)
+        return wait if wait is not None else 0
+
     def get_wait_times(self, block_no, platform=None):
         wt = self._wait_times \
             if not platform else self._platform_wait_times[platform]
@@ -170,9 +265,78 @@ class WaitTimesReport(IntervalsReport):
 
         if wt.has_no_changes: self.no_changes += 1
 
-        block_no = self._get_block_no(wt.stime, wt.etime)
-        int_idx = self.get_interval_index(wt.stime)
-        self._update_wait_times(wt.platform, block_no, int_idx)
+        span = self._get_span(wt.stime, wt.etime)
+        self._add_wait_times(wt.platform, self._get_minutes_block_no(span), 
+            int(math.floor(span)), wt.stime)
+
+    def add_rollup(self, buildername, stime, wait, count, no_changes):
+        """Adds `count` wait times of buildername's jobs out of a rollup, 
+        which waited `wait` whole minutes (None if they haven't started) 
+        from the hour starting at stime; no_changes of them had no changes.
+        """
+        if self._is_unknownbuilder(buildername):
+            self.unknownbuilders.add(buildername)
+            return
+
+        if wait is None:
+            self.pending.extend([buildername] * count)
+            return
+
+        platform = get_platform(buildername)
+        if platform == 'other':
+            self.otherplatforms.add(buildername)
+
+        self.no_changes += no_changes
+
+        block_no = self._get_minutes_block_no(wait)
+        self._add_wait_times(platform, block_no, wait, stime, count=count)
+
+    def merge(self, other):
+        """Adds the wait times of `other`, a report on the same pool with the 
+        same blocks over part of this one's timeframe (e.g. one of its days).
+        """
+        if (other.pool, other.mpb, other.maxb) != \
+            (self.pool, self.mpb, self.maxb):
+            raise ValueError("Can't merge the %s wait times in blocks of %s "
+                "minutes (up to %s) into the %s ones in blocks of %s minutes "
+                "(up to %s)" % (other.pool, other.mpb, other.maxb, self.pool, 
+                self.mpb, self.maxb))
+        offset = self.get_interval_offset(other)
+
+        self.total += other.total
+        self.no_changes += other.no_changes
+        self.pending.extend(other.pending)
+        self.otherplatforms.update(other.otherplatforms)
+        self.unknownbuilders.update(other.unknownbuilders)
+
+        self._merge_wait_times(self._wait_times, other._wait_times, offset)
+        for platform, wait_times in other._platform_wait_times.iteritems():
+            self._merge_wait_times(
+                self._platform_wait_times.setdefault(platform, {}), 
+                wait_times, offset)
+        for platform, total in other._platform_totals.iteritems():
+            self._platform_totals[platform] = \
+                self._platform_totals.get(platform, 0) + total
+        for platform, sketch in other._platform_sketches.iteritems():
+            self._platform_sketches.setdefault(platform, 
+                QuantileSketch()).merge(sketch)
+
+        # other counted these in its first interval
+        for platform, block_no, stime, count in other._early:
+            int_idx = self.get_interval_index(stime)
+            if int_idx != offset:
+                for wait_times in (self._wait_times, 
+                    self._platform_wait_times[platform]):
+                    wait_times[block_no].update(offset, count=-count)
+                    wait_times[block_no].update(int_idx, count=count)
+            if stime < self.starttime:
+                self._early.append((platform, block_no, stime, count))
+
+    def _merge_wait_times(self, wait_times, other_wait_times, offset):
+        for block_no, wti in other_wait_times.iteritems():
+            if block_no not in wait_times:
+                wait_times[block_no] = WaitTimeIntervals(self.int_no)
+            wait_times[block_no].merge(wti, offset)
 
     def _is_unknownbuilder(self, buildername):
         if any(filter(lambda p: p.match(buildername), 
@@ -181,24 +345,36 @@ class WaitTimesReport(IntervalsReport):
 
         return False
 
-    def _get_block_no(self, stime, etime):
-        span = (etime - stime) / 60.0 if stime <= etime else 0
+    def _get_span(self, stime, etime):
+        """Returns the minutes waited from stime to etime"""
+        return (etime - stime) / 60.0 if stime <= etime else 0
+
+    def _get_minutes_block_no(self, span):
         block_no = int(math.floor(span / self.mpb)) * self.mpb
         if self.maxb: 
             block_no = min(block_no, self.maxb)
 
         return block_no
 
-    def _update_wait_times(self, platform, block_no, int_idx):
+    def _add_wait_times(self, platform, block_no, wait, stime, count=1):
+        self._update_wait_times(platform, block_no, 
+            self.get_interval_index(stime), count=count)
+        # in whole minutes, as the rollups have them
+        self._platform_sketches.setdefault(platform, 
+            QuantileSketch()).add(wait, count=count)
+        if stime < self.starttime:
+            self._early.append((platform, block_no, stime, count))
+
+    def _update_wait_times(self, platform, block_no, int_idx, count=1):
         # update overall wait times
-        self.total += 1
+        self.total += count
         if block_no not in self._wait_times:
             self._wait_times[block_no] = WaitTimeIntervals(self.int_no)
-        self._wait_times[block_no].update(int_idx)
+        self._wait_times[block_no].update(int_idx, count=count)
 
         # update platform specific wait times
         self._platform_totals[platform] = \
-            self._platform_totals.get(platform, 0) + 1
+            self._platform_totals.get(platform, 0) + count
 
         if platform not in self._platform_wait_times:
             self._platform_wait_times[platform] = \
@@ -207,7 +383,8 @@ class WaitTimesReport(IntervalsReport):
             self._platform_wait_times[platform][block_no] = \
                 WaitTimeIntervals(self.int_no)
 
-        self._platform_wait_times[platform][block_no].update(int_idx)
+        self._platform_wait_times[platform][block_no].update(int_idx,
+            count=count)
 
     def to_dict(self, summary=False):
         json_obj = {
@@ -232,6 +409,11 @@ class WaitTimesReport(IntervalsReport):
         for platform in self.get_platforms():
             json_obj['platforms'][platform] = {
                 'total': self.get_total(platform=platform), 
+                'p50_wait_time': self.get_wait_time_percentile(50, platform),
+                'p90_wait_time': self.get_wait_time_percentile(90, platform),
+                'p99_wait_time': self.get_wait_time_percentile(99, platform),
+                'wait_time_sketch': 
+                    self._platform_sketches[platform].to_dict(),
                 'wt':{}
             }
             for block_no in self.get_blocks(platform=platform):
@@ -246,9 +428,15 @@ class WaitTimeIntervals(object):
         self.total = 0
         self.intervals = [0] * int_no
 
-    def update(self, idx):
-        self.total += 1
-        self.intervals[idx] += 1
+    def update(self, idx, count=1):
+        self.total += count
+        self.intervals[idx] += count
+
+    def merge(self, other, offset=0):
+        """Adds the wait times of `other`, whose intervals start at interval 
+        `offset` of these."""
+        self.total += other.total
+        merge_counts(self.intervals, other.intervals, offset)
 
     def to_dict(self):
         return {'total': self.total, 'intervals': self.intervals}
@@ -0,0 +1,106 @@
+#!/usr/bin/python
+"""Times model.builds.getBuilds with its queries run separately and as a
+single UNION ALL round trip.
+
+Runs against a synthetic sqlite scheduler db by default, adding a simulated
+round trip latency to every statement; pass --db to use a real one."""
+import os
+import random
+import time
+
+import sqlalchemy
+
+from buildapi.model import init_scheduler_model
+from buildapi.model import builds
+
+def populate(engine, schema, num_requests, branch):
+    for statement in open(schema).read().split(';'):
+        if statement.strip():
+            engine.execute(statement)
+
+    now = int(time.time())
+    for i in range(1, num_requests + 1):
+        submitted_at = now - random.randint(0, 86400)
+        engine.execute("INSERT INTO sourcestamps (id, branch, revision) "
+                "VALUES (?, ?, ?)", i, branch, '%040x' % i)
+        engine.execute("INSERT INTO buildsets (id, reason, sourcestampid, "
+                "submitted_at) VALUES (?, 'bench', ?, ?)", i, i, submitted_at)
+
+        state = random.random()
+        if state < 0.2:
+            # pending
+            engine.execute("INSERT INTO buildrequests (id, buildsetid, "
+                    "buildername, submitted_at) VALUES (?, ?, ?, ?)",
+                    i, i, 'builder %i' % (i % 50), submitted_at)
+            continue
+        complete = int(state >= 0.3)
+        engine.execute("INSERT INTO buildrequests (id, buildsetid, "
+                "buildername, claimed_at, claimed_by_name, "
+                "claimed_by_incarnation, complete, results, submitted_at, "
+                "complete_at) VALUES (?, ?, ?, ?, 'master', 'i', ?, ?, ?, ?)",
+                i, i, 'builder %i' % (i % 50), submitted_at + 60, complete,
+                complete and 0 or None, submitted_at,
+                complete and submitted_at + 3600 or None)
+        engine.execute("INSERT INTO builds (number, brid, start_time, "
+                "finish_time) VALUES (?, ?, ?, ?)", i, i, submitted_at + 60,
+                complete and submitted_at + 3600 or None)
+
+def bench(branch, runs):
+    """Returns the sorted times of `runs` calls of getBuilds(branch) with
+    separate queries and with a union, by mode.  The modes take turns, so
+    that they see the same load."""
+    executeQueries = builds.executeQueries
+    times = {False: [], True: []}
+    try:
+        for i in range(runs):
+            for union in (False, True):
+                builds.executeQueries = lambda queries, params=None: \
+                        executeQueries(queries, params, union)
+                start = time.time()
+                builds.getBuilds(branch)
+                times[union].append(time.time() - start)
+    finally:
+        builds.executeQueries = executeQueries
+    for t in times.values():
+        t.sort()
+    return times
+
+if __name__ == '__main__':
+    from optparse import OptionParser
+    parser = OptionParser()
+    parser.set_defaults(
+            db=None,
+            schema=os.path.join(os.path.dirname(__file__), '..', '..',
+                'schedulerdb_schema.sql'),
+            requests=5000,
+            latency=1.0,
+            runs=10,
+            branch='mozilla-central',
+            )
+    parser.add_option("--db", dest="db", help="scheduler db url")
+    parser.add_option("--schema", dest="schema",
+            help="scheduler db schema, for the synthetic db")
+    parser.add_option("-n", "--requests", dest="requests", type="int",
+            help="number of requests in the synthetic db")
+    parser.add_option("-l", "--latency", dest="latency", type="float",
+            help="milliseconds added to every statement on the synthetic db")
+    parser.add_option("-r", "--runs", dest="runs", type="int")
+    parser.add_option("-b", "--branch", dest="branch")
+
+    options, args = parser.parse_args()
+
+    if options.db:
+        engine = sqlalchemy.create_engine(options.db)
+    else:
+        engine = sqlalchemy.create_engine('sqlite://')
+        populate(engine, options.schema, options.requests, options.branch)
+        sqlalchemy.event.listen(engine, 'before_cursor_execute',
+                lambda *args: time.sleep(options.latency / 1000.0))
+    init_scheduler_model(engine)
+
+    times = bench(options.branch, options.runs)
+    print "%-9s %8s %8s" % ("", "min", "median")
+    for union in (False, True):
+        t = times[union]
+        print "%-9s %6.1fms %6.1fms" % (union and "union" or "separate",
+                t[0] * 1000, t[len(t) // 2] * 1000)
@@ -13,6 +13,7 @@ import calendar
 import time
 
 import buildapi.model.statusdb_orm as model
+from buildapi.lib.cacher import Codec
 
 def encode_dates(dt):
     if dt is None:
@@ -93,6 +94,8 @@ def get_slave_name(cache, session, slave_id):
 
 class Cache(object):
 
+    codec = Codec()
+
     @staticmethod
     def new(config):
         cache_spec = config.get('general', 'cache', None)
@@ -104,9 +107,22 @@ class Cache(object):
         raise RuntimeError("invalid cache spec %r" % (cache_spec,))
 
     def get(self, key):
-        return None
+        data = self._get(key)
+        if data is None:
+            return None
+        try:
+            return self.codec.loads(data)
+        except Exception:
+            # e.g. slave names cached as plain strings; just regenerate them
+            return None
 
     def put(self, key, val, expire=0):
+        self._put(key, self.codec.dumps(val), expire)
+
+    def _get(self, key):
+        return None
+
+    def _put(self, key, data, expire=0):
         pass
 
 
@@ -121,14 +137,14 @@ class MemcacheCache(Cache):
             return s.encode('utf-8')
         return s
 
-    def get(self, key):
+    def _get(self, key):
         return self.m.get(self._utf8(key))
 
-    def put(self, key, val, expire=0):
+    def _put(self, key, data, expire=0):
         if expire == 0:
-            self.m.set(self._utf8(key), val)
+            self.m.set(self._utf8(key), data)
         else:
-            self.m.set(self._utf8(key), val, expire)
+            self.m.set(self._utf8(key), data, expire)
 
 
 def build_report(cache, session, scheduler_db, starttime, endtime, include_steps=False):
@@ -184,18 +200,9 @@ def build_report(cache, session, scheduler_db, starttime, endtime, include_steps
 
             builder_key = 'builders:%i' % build.builder_id
             builder = cache.get(builder_key)
-
-            if builder is not None:
-                try:
-                    builder = json.loads(builder.decode("zlib"))
-                except:
-                    cache.put(builder_key, builder.encode("zlib"),
-                              24*3600) # Keep it for a day
-                    builder = json.loads(builder)
-            else:
+            if builder is None:
                 builder = get_builder()
-                cache.put(builder_key, json.dumps(builder).encode("zlib"),
-                          24*3600) # Keep it for a day
+                cache.put(builder_key, builder, 24*3600) # Keep it for a day
 
             builders[build.builder_id] = builder
             times['builders'] += time.time() - s0
@@ -253,15 +260,9 @@ def build_report(cache, session, scheduler_db, starttime, endtime, include_steps
 
         build_key = 'builds:%i' % build.id
         build_dict = cache.get(build_key)
-        if build_dict is not None:
-            try:
-                build_dict = json.loads(build_dict.decode("zlib"))
-            except:
-                cache.put(build_key, build_dict.encode("zlib"), 24*3600)
-                build_dict = json.loads(build_dict)
-        else:
+        if build_dict is None:
             build_dict = get_build_dict()
-            cache.put(build_key, json.dumps(build_dict).encode("zlib"), 24*3600)
+            cache.put(build_key, build_dict, 24*3600)
         builds.append(build_dict)
 
     e = time.time()
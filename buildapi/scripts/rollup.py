@@ -0,0 +1,108 @@
+#!/usr/bin/python
+"""rollup.py [options] [rollup ...]
+
+Extends the hourly rollups of the wait times, pushes and builders reports
+(see buildapi.model.rollups) up to the hours that have settled; all of them
+unless some are named.  Also brings the revision index (see
+buildapi.model.revisions) up to date, so that requests don't have to.
+Meant to be run periodically, e.g. from cron."""
+import logging
+import time
+import urllib2
+
+import sqlalchemy
+
+from buildapi.lib import json
+from buildapi.lib.helpers import ROLE_MASTERS_POOLS
+from buildapi.model import init_scheduler_model, init_buildapi_model
+from buildapi.model import revisions, rollups
+from buildapi.model.builders import RollupBuilders
+from buildapi.model.pushes import RollupPushes
+from buildapi.model.util import POOLS
+from buildapi.model.waittimes import RollupWaitTimes
+
+log = logging.getLogger(__name__)
+
+ROLLUPS = ('waittimes', 'pushes', 'builders')
+
+def get_pools(masters_url):
+    """Returns the db names of the masters of each pool, out of the masters
+    json at masters_url"""
+    masters = json.load(urllib2.urlopen(masters_url, timeout=30))
+    pools = dict((pool, []) for pool in POOLS)
+    for m in masters:
+        pool = ROLE_MASTERS_POOLS.get(m['role'], None)
+        if pool in pools:
+            pools[pool].append(m['db_name'])
+    return pools
+
+def update_rollups(names, until, since=None, pools=None):
+    """Extends the rollups in `names` to the hours before `until`; those that
+    haven't been started yet start at `since`.  The waittimes rollup needs
+    the masters of each pool, in `pools`."""
+    funcs = {
+        'waittimes': lambda starttime, endtime:
+            RollupWaitTimes(starttime, endtime, pools),
+        'pushes': RollupPushes,
+        'builders': RollupBuilders,
+    }
+    for name in names:
+        covered = rollups.updateRollup(name, funcs[name], until, since)
+        log.info("The %s rollup covers the hours until %s", name, covered)
+
+def update_revision_index():
+    """Indexes the revisions of all the sourcestamps that aren't yet"""
+    while not revisions.indexRevisions():
+        pass
+    log.info("The revision index covers the sourcestamps until %s",
+            revisions.getIndexedUntil())
+
+def main():
+    from optparse import OptionParser
+    parser = OptionParser(__doc__)
+    parser.set_defaults(
+            scheduler_db=None,
+            buildapi_db=None,
+            masters_url="https://hg.mozilla.org/build/tools/raw-file/default/buildfarm/maintenance/production-masters.json",
+            days=30,
+            settle=rollups.settle_time / 3600.0,
+            verbosity=logging.INFO,
+            )
+    parser.add_option("--scheduler-db", dest="scheduler_db",
+            help="scheduler db url")
+    parser.add_option("--buildapi-db", dest="buildapi_db",
+            help="buildapi db url")
+    parser.add_option("--masters-url", dest="masters_url",
+            help="url of the masters json, for the pools' masters")
+    parser.add_option("-d", "--days", dest="days", type="int",
+            help="days back that rollups which haven't been started start")
+    parser.add_option("-s", "--settle", dest="settle", type="float",
+            help="hours after which build requests are rolled up")
+    parser.add_option("-q", "--quiet", dest="verbosity", action="store_const",
+            const=logging.WARNING)
+
+    options, args = parser.parse_args()
+    if not options.scheduler_db or not options.buildapi_db:
+        parser.error("--scheduler-db and --buildapi-db are required")
+    for name in args:
+        if name not in ROLLUPS:
+            parser.error("Unknown rollup: %s" % name)
+
+    logging.basicConfig(level=options.verbosity,
+            format="%(asctime)s - %(message)s")
+
+    init_scheduler_model(sqlalchemy.create_engine(options.scheduler_db))
+    init_buildapi_model(sqlalchemy.create_engine(options.buildapi_db))
+
+    names = args or ROLLUPS
+    pools = None
+    if 'waittimes' in names:
+        pools = get_pools(options.masters_url)
+
+    now = time.time()
+    update_rollups(names, now - options.settle * 3600,
+            since=now - options.days * 86400, pools=pools)
+    update_revision_index()
+
+if __name__ == '__main__':
+    main()
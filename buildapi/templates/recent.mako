@@ -63,6 +63,9 @@ $(document).ready(function() {
   </tr>
 %endfor
 </tbody></table>
+% if hasattr(c, 'next_url'):
+<p><a href="${c.next_url}">Older builds</a></p>
+% endif
 
 </body>
 </html>
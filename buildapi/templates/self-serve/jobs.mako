@@ -29,4 +29,7 @@ $(document).ready(function()
 % endfor
 </tbody>
 </table>
+% if hasattr(c, 'next_url'):
+<p><a href="${c.next_url}">Older jobs</a></p>
+% endif
 </%def>
@@ -1,5 +1,10 @@
+import os
+import shutil
+import tempfile
 import threading
+import time
 import mock
+import json
 from buildapi.lib import cacher
 from unittest import TestCase, SkipTest
 
@@ -12,7 +17,7 @@ class Cases(object):
                 args=(1, 2), kwargs=dict(a='a', b='b')),
             7)
         m.assert_called_with(1, 2, a='a', b='b')
-        m.clear()
+        m.reset_mock()
 
         # and the second time, it's in the cache
         self.assertEqual(self.c.get('not-there', m), 7)
@@ -32,13 +37,46 @@ class Cases(object):
         self.assertFalse(self.c.has_key('not-there'))
         self.assertTrue(self.c.has_key('there'))
 
+    def test_delete(self):
+        self.c.put('there', 'there')
+        self.c.delete('there')
+        self.assertFalse(self.c.has_key('there'))
+        # deleting a missing key is fine
+        self.c.delete('not-there')
+
+    def test_stale(self):
+        self.c.put('not-there', 7, expire=time.time() - 1, stale_for=60)
+        m = mock.Mock(return_value=8)
+        self.assertEqual(self.c.get('not-there', m, expire=time.time() + 60,
+            stale_for=60), 7)
+        self.c.refresher.queue.join()
+        self.assertEqual(self.c.get('not-there', m), 8)
+        self.assertEqual(m.call_count, 1)
+
+    def test_on_stale(self):
+        self.c.put('stale', 7, expire=time.time() - 1, stale_for=60)
+        m = mock.Mock(return_value=8)
+        on_stale = mock.Mock()
+        self.assertEqual(self.c.get('stale', m, expire=time.time() + 60,
+            stale_for=60, on_stale=on_stale), 7)
+        on_stale.assert_called_once_with(7)
+        self.assertFalse(m.called)
+
+    def test_get_multi(self):
+        self.c.put('there', 'there')
+        self.assertEqual(self.c.get_multi(['there', 'not-there']),
+                {'there': 'there'})
+        self.assertEqual(self.c.get_multi([]), {})
+
     def test_parallel_calls(self):
         # test that parallel calls to get in different cachers work and return
-        # appropriate results.  Note that generate() may be called once or ten
-        # times - we don't care.
+        # appropriate results, and that only one of them generates the value
+        # while the others wait for it.
         results = {}
+        calls = []
         def generate():
-            print "gen"
+            calls.append(1)
+            time.sleep(0.5)
             return 'result'
         def get(thd):
             c = self.newCache() if thd else self.c
@@ -50,6 +88,15 @@ class Cases(object):
         for thd in thds:
             thd.join()
         self.assertEqual(results, dict((i, 'result') for i in range(10)))
+        self.assertEqual(len(calls), 1)
+
+    def test_expired_lock(self):
+        # a worker that took the lock but never filled the cache only delays
+        # the others by lock_time
+        self.assertTrue(self.c._acquire_lock('not-there', 1))
+        m = mock.Mock(return_value=7)
+        self.assertEqual(self.newCache().get('not-there', m, lock_time=1), 7)
+        self.assertEqual(m.call_count, 1)
 
     # TODO: lists?
 
@@ -58,6 +105,9 @@ class TestRedisCacher(TestCase, Cases):
     def newCache(self):
         return cacher.RedisCache(host='localhost')
 
+    def redis(self):
+        return self.c.r
+
     def setUp(self):
         try:
             import redis
@@ -65,13 +115,28 @@ class TestRedisCacher(TestCase, Cases):
             raise SkipTest("redis not installed")
         self.c = self.newCache()
         try:
-            self.c.r.delete('not-there')
+            self.redis().delete('not-there')
         except redis.ConnectionError:
             raise SkipTest("no redis server on localhost")
 
     def tearDown(self):
-        self.c.r.delete('there')
-        self.c.r.delete('not-there')
+        self.redis().delete('there')
+        self.redis().delete('not-there')
+        self.redis().delete('not-there.lock')
+
+    def test_lock(self):
+        self.assertTrue(self.c._acquire_lock('not-there', 60))
+        self.assertFalse(self.c._acquire_lock('not-there', 60))
+        # set with its expiry
+        self.assertTrue(0 < self.redis().ttl('not-there.lock') <= 60)
+        self.c._release_lock('not-there')
+        self.assertFalse(self.redis().exists('not-there.lock'))
+
+        # expired, and taken by somebody else
+        self.assertTrue(self.c._acquire_lock('not-there', 60))
+        self.redis().set('not-there.lock', 'theirs')
+        self.c._release_lock('not-there')
+        self.assertEqual(self.redis().get('not-there.lock'), 'theirs')
 
 
 class TestMemcacheCacher(TestCase, Cases):
@@ -95,4 +160,281 @@ class TestMemcacheCacher(TestCase, Cases):
     def tearDown(self):
         self.c.m.delete('there')
         self.c.m.delete('not-there')
+        self.c.m.delete('not-there.lock')
+
+
+
+class TestTieredRedisCacher(TestRedisCacher):
+
+    def newCache(self):
+        return cacher.TieredCache(cacher.RedisCache(host='localhost'))
+
+    def redis(self):
+        return self.c.backend.r
+
+
+class DictCache(cacher.BaseCache):
+    """A trivial backend, for testing TieredCache"""
+
+    codec = cacher.Codec(cacher.FORMAT_JSON, compress_threshold=None)
+
+    def __init__(self):
+        self.d = {}
+
+    def _get_raw(self, key):
+        return self.d[key]
+
+    def _put_raw(self, key, data, expire=0):
+        self.d[key] = data
+
+    def has_key(self, key):
+        return key in self.d
+
+
+class TestTieredCache(TestCase):
+
+    def setUp(self):
+        self.backend = DictCache()
+        self.c = cacher.TieredCache(self.backend, max_entries=2,
+                max_bytes=100, ttl=60)
+
+    def test_hit_skips_backend(self):
+        self.c.put('a', [1, 2])
+        self.backend.d['a'] = '"changed"'
+        self.assertEqual(self.c.get('a', mock.Mock()), [1, 2])
+        self.assertEqual(self.c.stats()['l1']['hits'], 1)
+
+    def test_fill_from_backend(self):
+        self.backend.d['a'] = '[1, 2]'
+        m = mock.Mock()
+        self.assertEqual(self.c.get('a', m), [1, 2])
+        self.assertEqual(self.c.get('a', m), [1, 2])
+        m.assert_not_called()
+        stats = self.c.stats()
+        self.assertEqual(stats['l1']['hits'], 1)
+        self.assertEqual(stats['l1']['misses'], 1)
+        self.assertEqual(stats['l2']['hits'], 1)
+
+    def test_get_multi(self):
+        self.c.put('a', 1)
+        self.backend.d['b'] = '2'
+        self.assertEqual(self.c.get_multi(['a', 'b', 'c']), {'a': 1, 'b': 2})
+        stats = self.c.stats()
+        self.assertEqual(stats['l1'], dict(hits=1, misses=2, entries=2,
+            bytes=3))
+        self.assertEqual(stats['l2'], dict(hits=1, misses=1))
+
+    def test_stale(self):
+        self.c.put('a', 1, expire=time.time() - 1, stale_for=60)
+        m = mock.Mock(return_value=2)
+        # the stale value is returned, and refreshed in the background
+        self.assertEqual(self.c.get('a', m, expire=time.time() + 60,
+            stale_for=60), 1)
+        self.c.refresher.queue.join()
+        m.assert_called_once_with()
+        self.assertEqual(self.c.get('a', m), 2)
+        self.assertEqual(self.c.get_multi_entries(['a'])['a'][0], 2)
+        # and the backend has it too
+        self.c.entries.clear()
+        self.assertEqual(self.c.get('a', m), 2)
+
+    def test_refresh_once(self):
+        started = threading.Event()
+        release = threading.Event()
+        def generate():
+            started.set()
+            release.wait()
+            return 3
+        self.assertTrue(self.c.refresh('a', generate))
+        started.wait()
+        self.assertFalse(self.c.refresh('a', generate))
+        release.set()
+        self.c.refresher.queue.join()
+        self.assertEqual(self.c.get('a', mock.Mock()), 3)
+
+    def test_max_entries(self):
+        self.c.put('a', 1)
+        self.c.put('b', 2)
+        self.c.get('a', mock.Mock())
+        self.c.put('c', 3)
+        # b was the least recently used
+        self.assertEqual(self.c.entries.keys(), ['a', 'c'])
+
+    def test_max_bytes(self):
+        self.c.put('a', 'x' * 60)
+        self.c.put('b', 'y' * 60)
+        self.assertEqual(self.c.entries.keys(), ['b'])
+        self.assertEqual(self.c.stats()['l1']['bytes'], 63)
+        # too big to keep in memory at all
+        self.c.put('c', 'z' * 200)
+        self.assertEqual(self.c.entries.keys(), ['b'])
+        self.assertEqual(self.backend.d['c'], '\x01"%s"' % ('z' * 200))
+
+    def test_ttl(self):
+        self.c.put('a', 1)
+        self.backend.d['a'] = '2'
+        with mock.patch.object(time, 'time', return_value=time.time() + 61):
+            self.assertEqual(self.c.get('a', mock.Mock()), 2)
+
+
+class TestCodec(TestCase):
+
+    value = {'builds': [{'id': 1, 'name': u'b\xfcild', 'endtime': None}] * 50}
+
+    def test_roundtrip(self):
+        for fmt in (cacher.FORMAT_JSON, cacher.FORMAT_MARSHAL):
+            for threshold in (None, 0, 1 << 20):
+                codec = cacher.Codec(fmt, compress_threshold=threshold)
+                self.assertEqual(codec.loads(codec.dumps(self.value)),
+                        self.value)
+
+    def test_compression(self):
+        codec = cacher.Codec(cacher.FORMAT_JSON, compress_threshold=100)
+        self.assertEqual(ord(codec.dumps([1])[0]), cacher.FORMAT_JSON)
+        data = codec.dumps(self.value)
+        self.assertEqual(ord(data[0]),
+                cacher.FORMAT_JSON | cacher.FLAG_ZLIB)
+        self.assert_(len(data) < len(json.dumps(self.value)))
+
+    def test_other_settings(self):
+        data = cacher.Codec(cacher.FORMAT_MARSHAL).dumps(self.value)
+        codec = cacher.Codec(cacher.FORMAT_JSON, compress_threshold=None)
+        self.assertEqual(codec.loads(data), self.value)
+
+    def test_stale_at(self):
+        for threshold in (None, 0):
+            codec = cacher.Codec(compress_threshold=threshold)
+            self.assertEqual(codec.loads_entry(codec.dumps(self.value, 1234)),
+                    (self.value, 1234))
+            self.assertEqual(codec.loads_entry(codec.dumps(self.value)),
+                    (self.value, 0))
+            self.assertEqual(codec.loads(codec.dumps(self.value, 1234)),
+                    self.value)
+
+    def test_default(self):
+        codec = cacher.Codec()
+        data = codec.dumps(self.value)
+        self.assertEqual(ord(data[0]), cacher.FORMAT_JSON)
+        # what the JSON codec wrote before marshal was an option
+        data = chr(cacher.FORMAT_JSON) + json.dumps(self.value)
+        self.assertEqual(codec.loads(data), self.value)
+        data = chr(cacher.FORMAT_JSON | cacher.FLAG_ZLIB) + \
+                json.dumps(self.value).encode('zlib')
+        self.assertEqual(codec.loads(data), self.value)
+
+    def test_legacy(self):
+        codec = cacher.Codec()
+        self.assertEqual(codec.loads(json.dumps(self.value)), self.value)
+        self.assertEqual(codec.loads(json.dumps(self.value).encode('zlib')),
+                self.value)
+        self.assertEqual(codec.loads('7'), 7)
+        self.assertRaises(ValueError, codec.loads, 'not json')
+
+
+class TestLocalCacher(TestCase, Cases):
+
+    def newCache(self):
+        # every thread of the process shares the same cache
+        return self.c
+
+    def setUp(self):
+        self.c = cacher.LocalCache()
+
+    def test_eviction(self):
+        c = cacher.LocalCache(max_entries=2)
+        c.put('a', 1)
+        c.put('b', 2)
+        c.put('c', 3)
+        self.assertFalse(c.has_key('a'))
+        self.assertTrue(c.has_key('c'))
+
+    def test_expire(self):
+        self.c.put('there', 1, expire=time.time() - 1)
+        self.assertFalse(self.c.has_key('there'))
+
+
+class TestDiskCacher(TestCase, Cases):
+
+    def newCache(self):
+        # the dbm file can only be opened once
+        return self.c
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'cache')
+        self.c = cacher.DiskCache(self.path)
+
+    def tearDown(self):
+        self.c.close()
+        shutil.rmtree(self.dir)
+
+    def test_persistence(self):
+        self.c.put('there', [1, 2])
+        self.c.put('gone', 1, expire=time.time() + 1)
+        self.c.close()
+        with mock.patch.object(time, 'time', return_value=time.time() + 2):
+            self.c = cacher.DiskCache(self.path)
+        self.assertEqual(self.c.get('there', mock.Mock()), [1, 2])
+        self.assertFalse(self.c.has_key('gone'))
+
+
+class TestCacheStats(TestCase):
+
+    def setUp(self):
+        self.stats = cacher.CacheStats()
+        self.c = cacher.LocalCache()
+        self.c.cache_stats = self.stats
+
+    def test_get(self):
+        m = mock.Mock(return_value=[1, 2, 3])
+        self.c.get('builds:x', m)
+        self.c.get('builds:x', m)
+        stats = self.stats.to_dict()['builds']
+        self.assertEqual(stats['counters'],
+                {'get': 2, 'hit': 1, 'miss': 1, 'fill': 1, 'put': 1})
+        self.assertEqual(stats['hit_ratio'], 0.5)
+        self.assertEqual(stats['latency']['get']['count'], 2)
+        self.assertEqual(stats['latency']['fill']['count'], 1)
+        self.assertEqual(stats['size']['put']['count'], 1)
+        self.assertEqual(stats['size']['put']['sum'],
+                len(self.c._dumps([1, 2, 3])))
+
+    def test_get_multi(self):
+        self.c.put('a:1', 1)
+        self.c.put('b:1', 1, expire=time.time() - 1, stale_for=60)
+        self.c.get_multi(['a:1', 'b:1', 'c:1'])
+        counters = dict((family, s['counters']) for (family, s) in
+                self.stats.to_dict().iteritems())
+        self.assertEqual(counters, {
+            'a': {'put': 1, 'hit': 1},
+            'b': {'put': 1, 'stale': 1},
+            'c': {'miss': 1},
+        })
+
+    def test_hit_ratio(self):
+        m = mock.Mock(return_value=1)
+        self.c.get_multi_entries(['a:1'])
+        self.c.get('a:1', m)
+        self.c.put('a:2', 2)
+        self.c.get_multi_entries(['a:1', 'a:2', 'a:3'])
+        stats = self.stats.to_dict()['a']
+        self.assertEqual(stats['counters']['get'], 1)
+        # 2 hits out of 5 lookups
+        self.assertEqual(stats['counters']['hit'], 2)
+        self.assertEqual(stats['hit_ratio'], 0.4)
+
+        # only 'get's
+        self.stats.record('reports:x', 'get', 1)
+        self.assertFalse('hit_ratio' in self.stats.to_dict()['reports:x'])
+
+    def test_key_family(self):
+        stats = cacher.CacheStats(lambda key: 'all')
+        stats.record_key('builds:x', 'hit')
+        self.assertEqual(stats.to_dict().keys(), ['all'])
 
+    def test_histogram(self):
+        h = cacher.Histogram((1, 10))
+        for value in (0.5, 1, 5, 100):
+            h.add(value)
+        self.assertEqual(h.to_dict(), {'count': 4, 'sum': 106.5, 'max': 100,
+            'buckets': [(1, 2), (10, 1), (None, 1)]})
@@ -0,0 +1,29 @@
+from unittest import TestCase
+
+from buildapi.lib import json
+from buildapi.lib.jsonstream import iterencode, IterDict
+
+
+class TestIterEncode(TestCase):
+
+    def encode(self, obj, size=1):
+        return ''.join(iterencode(obj, size))
+
+    def test_plain(self):
+        for obj in ({'a': [1, 2.5, None], 'b': {'c': u'\u2603'}},
+                    [], {}, [{}], 'x', 3, {1: True}):
+            self.assertEqual(json.loads(self.encode(obj)),
+                    json.loads(json.dumps(obj)))
+
+    def test_lazy(self):
+        obj = {'a': IterDict((str(i), (j for j in range(i)))
+                             for i in range(3)),
+               'b': iter([{'c': 1}])}
+        self.assertEqual(json.loads(self.encode(obj)),
+                {'a': {'0': [], '1': [0], '2': [0, 1]}, 'b': [{'c': 1}]})
+
+    def test_chunks(self):
+        chunks = list(iterencode(range(1000), 100))
+        self.assertTrue(len(chunks) > 1)
+        self.assertTrue(all(len(c) < 110 for c in chunks))
+        self.assertEqual(json.loads(''.join(chunks)), range(1000))
@@ -0,0 +1,1155 @@
+import copy
+import os
+import random
+import re
+import shutil
+import tempfile
+import time
+import mock
+import pytz
+import sqlalchemy
+from buildapi.model import init_scheduler_model, init_buildapi_model, \
+    init_status_model, meta
+from buildapi.model import builders, builds, buildrequest, idlejobs, pushes, \
+query, reports, revisions, rollups, shards, statements, util, waittimes
+from buildapi.lib import cache, json, jsonstream
+from buildapi.lib.cacher import CacheStats, Codec, FORMAT_JSON, LocalCache, \
+    LRUStore
+from collections import OrderedDict, namedtuple
+from datetime import datetime
+from unittest import TestCase
+
+
+class TestUpdateBuilds(TestCase):
+
+    def setUp(self):
+        self.engine = sqlalchemy.create_engine("sqlite:///:memory:")
+        sql = open(os.path.join(os.path.dirname(__file__), "state.sql")).read().split(";")
+        for line in sql:
+            line = line.strip()
+            if line:
+                self.engine.execute(line)
+        init_scheduler_model(self.engine)
+
+    def test_unchanged(self):
+        builds = cache.getBuilds('branch1', 0, 2**31)
+        self.assertEqual(cache.updateBuilds('branch1', 0, 2**31, builds),
+                builds)
+
+    def test_new_build(self):
+        builds = cache.getBuilds('branch1', 0, 2**31)
+        cached = copy.deepcopy([b for b in builds if 'build_id' in b][1:])
+        self.assertEqual(cache.updateBuilds('branch1', 0, 2**31, cached),
+                builds)
+
+    def test_completed_build(self):
+        builds = cache.getBuilds('branch1', 0, 2**31)
+        cached = copy.deepcopy(builds)
+        cached[0]['endtime'] = None
+        for r in cached[0]['requests']:
+            r['complete'] = 0
+            r['complete_at'] = None
+        self.assertEqual(cache.updateBuilds('branch1', 0, 2**31, cached),
+                builds)
+
+    def test_builds_for_day(self):
+        backend = LocalCache()
+        backend.cache_stats = CacheStats(cache.BuildapiCache.key_family)
+        bc = cache.BuildapiCache(backend, pytz.utc)
+        date = datetime(2010, 9, 30, tzinfo=pytz.utc)
+        builds = bc.get_builds_for_day(date, 'branch1')
+        self.assertTrue(builds)
+        self.assertEqual(backend.cache_stats.to_dict()['builds:day']
+            ['counters'], {'get': 1, 'miss': 1, 'fill': 1, 'put': 1})
+
+        # stale builds are updated incrementally
+        key = bc.build_key_for_day(date, 'branch1')
+        cached = [b for b in builds if 'build_id' in b][1:]
+        backend.put(key, cached, expire=time.time() - 1, stale_for=60)
+        with mock.patch.object(random, 'random', return_value=1), \
+                mock.patch.object(backend, 'refresh') as refresh:
+            self.assertEqual(bc.get_builds_for_day(date, 'branch1'), cached)
+        self.assertEqual(refresh.call_args[0][:3], (key, cache.updateBuilds,
+            ('branch1', 1285804800, 1285891200, cached)))
+        self.assertEqual(backend.cache_stats.to_dict()['builds:day']
+            ['counters']['stale'], 1)
+
+
+class TestRevisionIndex(TestCase):
+
+    def setUp(self):
+        self.engine = sqlalchemy.create_engine("sqlite:///:memory:")
+        sql = open(os.path.join(os.path.dirname(__file__), "state.sql")).read().split(";")
+        for line in sql:
+            line = line.strip()
+            if line:
+                self.engine.execute(line)
+        init_scheduler_model(self.engine)
+        init_buildapi_model(self.engine)
+
+    def tearDown(self):
+        meta.buildapi_db_meta.bind = None
+
+    def test_index(self):
+        self.assertTrue(revisions.indexRevisions())
+        self.assertEqual([tuple(r) for r in self.engine.execute(
+            'select sourcestampid, revision from revision_index '
+            'order by sourcestampid')],
+            [(1, '123456789'), (2, 'abcdefghi'), (3, '987654321'),
+             (4, '24681012')])
+
+    def test_incremental(self):
+        with mock.patch.object(revisions, 'batch_size', 3):
+            self.assertFalse(revisions.indexRevisions(batches=1))
+            self.assertTrue(revisions.indexRevisions(batches=1))
+        self.assertEqual(self.engine.execute(
+            'select count(*) from revision_index').scalar(), 4)
+
+    def test_getSourceStampIds(self):
+        self.assertEqual(revisions.getSourceStampIds('1234'), ([1], 4))
+        self.assertEqual(revisions.getSourceStampIds('zzzz'), ([], 4))
+
+    def test_unindexed(self):
+        self.assertTrue(revisions.indexRevisions())
+        # pushed since the index was last updated
+        self.engine.execute("INSERT INTO sourcestamps (id, branch, revision) "
+                "VALUES (5, 'branch1', 'fedcba987654')")
+        with mock.patch.object(revisions, '_updateIndex'), \
+                mock.patch.dict(revisions._index_state, complete=True,
+                    bind=meta.buildapi_db_meta.bind):
+            ss = meta.scheduler_db_meta.tables['sourcestamps']
+            q = sqlalchemy.select([ss.c.id],
+                    revisions.revisionClause(ss, 'fedcba98'))
+            self.assertEqual([r[0] for r in q.execute()], [5])
+            q = sqlalchemy.select([ss.c.id],
+                    revisions.revisionClause(ss, '1234'))
+            self.assertEqual([r[0] for r in q.execute()], [1])
+
+    def test_getRevision(self):
+        self.assertEqual([b['build_id'] for b in
+                builds.getRevision('branch1', '123456789')], [1])
+        self.assertEqual(builds.getRevision('branch1', 'zzzz'), [])
+
+
+class TestBranchResolver(TestCase):
+
+    branches = ['comm-central', 'mozilla-central', 'mozilla-1.9.2', 'try',
+            'try-comm-central', 'tracemonkey']
+
+    def test_resolve(self):
+        r = query.BranchResolver(self.branches)
+        self.assertEqual(r.resolve('mozilla-central'), 'mozilla-central')
+        self.assertEqual(r.resolve('releases/mozilla-1.9.2'), 'mozilla-1.9.2')
+        self.assertEqual(r.resolve('try-comm-central'), 'try-comm-central')
+        self.assertEqual(r.resolve('try-foo'), 'try')
+        self.assertEqual(r.resolve('users/bob/tracemonkey-selfserve'),
+                'tracemonkey')
+        self.assertEqual(r.resolve('elm'), 'Unknown')
+        self.assertEqual(r.resolve(None), None)
+        self.assertEqual(r.resolve(''), None)
+
+    def test_memo(self):
+        r = query.BranchResolver(self.branches, memo_size=2)
+        for name in ('try', 'elm', 'mozilla-central', 'try'):
+            r.resolve(name)
+        self.assertEqual(sorted(r.memo.keys()), ['mozilla-central', 'try'])
+
+    def test_GetBranchNames(self):
+        with mock.patch.object(query, 'GetAllBranches',
+                return_value=self.branches):
+            self.assertEqual(query.GetBranchNames(['try', 'elm', 'try']),
+                    {'try': 'try', 'elm': 'Unknown'})
+
+
+class TestClassifier(TestCase):
+
+    def make_table(self):
+        table = OrderedDict()
+        table['first'] = [re.compile('.*foo.*')]
+        table['second'] = [re.compile('(bar)+ (?P<x>baz)'),
+                re.compile('.*QUX.*', re.IGNORECASE)]
+        table['third'] = [re.compile('.*qux.*'), re.compile('.*foo bar.*')]
+        return table
+
+    def test_precedence(self):
+        c = util.Classifier(self.make_table())
+        self.assertEqual(c.classify('a foo bar'), 'first')
+        self.assertEqual(c.classify('bar baz'), 'second')
+        self.assertEqual(c.classify('a qux'), 'second')
+        self.assertEqual(c.classify('nothing'), None)
+        self.assertEqual(c.classify_many(['foo', 'bar baz', 'x']),
+                ['first', 'second', None])
+
+    def test_many_groups(self):
+        table = OrderedDict(('c%i' % i, [re.compile('(%i)(x)' % i)])
+                for i in range(100))
+        c = util.Classifier(table)
+        self.assertTrue(len(c.regexes) > 1)
+        self.assertEqual(c.classify('99x'), 'c99')
+        self.assertEqual(c.classify('5x'), 'c5')
+
+    def test_memo(self):
+        c = util.Classifier(self.make_table(), memo_size=2)
+        c.classify_many(['a', 'b', 'c'])
+        self.assertEqual(c.memo, {'c': None})
+
+    def test_classify_buildername(self):
+        self.assertEqual(util.classify_buildername(
+            'WINNT 5.2 mozilla-central leak test build'),
+            ('win2k8', 'debug', 'build'))
+        self.assertEqual(util.classify_many(['TB foo talos tp5']),
+            {'TB foo talos tp5': ('other', 'opt', 'talos')})
+
+
+class TestHistoricBuilds(TestCase):
+
+    def setUp(self):
+        self.engine = sqlalchemy.create_engine("sqlite:///:memory:")
+        for sql in (
+                "CREATE TABLE builders (id INTEGER PRIMARY KEY, name VARCHAR)",
+                "CREATE TABLE slaves (id INTEGER PRIMARY KEY, name VARCHAR)",
+                "CREATE TABLE masters (id INTEGER PRIMARY KEY, name VARCHAR)",
+                "CREATE TABLE builds (id INTEGER PRIMARY KEY, "
+                    "buildnumber INTEGER, builder_id INTEGER, "
+                    "slave_id INTEGER, master_id INTEGER, "
+                    "starttime TIMESTAMP, endtime TIMESTAMP, result INTEGER)",
+                "CREATE TABLE properties (id INTEGER PRIMARY KEY, "
+                    "name VARCHAR, value VARCHAR)",
+                "CREATE TABLE build_properties (property_id INTEGER, "
+                    "build_id INTEGER)",
+                "INSERT INTO builders VALUES (1, 'builder1')",
+                "INSERT INTO slaves VALUES (1, 'slave1')",
+                "INSERT INTO masters VALUES (1, 'master1')",
+                ):
+            self.engine.execute(sql)
+        for i in range(1, 6):
+            result = 0 if i < 5 else None
+            self.engine.execute("INSERT INTO builds VALUES "
+                    "(?, ?, 1, 1, 1, NULL, NULL, ?)", i, i, result)
+            if i != 3:
+                self.engine.execute("INSERT INTO properties VALUES "
+                        "(?, 'buildername', ?)", i, '"name %i"' % i)
+                self.engine.execute("INSERT INTO build_properties VALUES "
+                        "(?, ?)", i, i)
+        init_status_model(self.engine)
+        patcher = mock.patch.object(query, '_buildername_cache',
+                LRUStore(100, 100))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.queries = []
+        sqlalchemy.event.listen(self.engine, 'before_cursor_execute',
+                self.count_query)
+
+    def count_query(self, *args):
+        self.queries.append(args[2])
+
+    def test_buildernames(self):
+        builds = query.GetHistoricBuilds(None, count=10)
+        self.assertEqual([(b['id'], b['buildername']) for b in builds],
+                [(5, 'name 5'), (4, 'name 4'), (3, ''), (2, 'name 2'),
+                 (1, 'name 1')])
+        self.assertEqual(len(self.queries), 2)
+
+    def test_batches(self):
+        with mock.patch.object(query, 'historic_batch_size', 2):
+            builds = query.GetHistoricBuilds('slave', count=10)
+        self.assertEqual([b['id'] for b in builds], [4, 3, 2, 1])
+        self.assertEqual(len(self.queries), 3)
+
+    def test_before(self):
+        self.assertEqual([b['id'] for b in
+            query.GetHistoricBuilds(None, count=2, before=4)], [3, 2])
+        self.assertEqual([b['id'] for b in
+            query.GetHistoricBuilds('slave', count=2, before=2)], [1])
+
+    def test_cache(self):
+        query.GetHistoricBuilds(None, count=10)
+        self.queries = []
+        builds = query.GetHistoricBuilds(None, count=10)
+        self.assertEqual(builds[1]['buildername'], 'name 4')
+        # only build 5 isn't finished
+        self.assertEqual(len(self.queries), 2)
+
+
+class TestRunningBuilds(TestCase):
+
+    Row = namedtuple('Row', 'id brid branch revision buildername '
+            'submitted_at last_heartbeat claimed_by_name start_time number')
+
+    def test_group(self):
+        rows = [
+            self.Row(1, 11, 'mozilla-central', 'abcdef1234567890', 'b1',
+                100, 150, 'm1', 110, 1),
+            self.Row(1, 10, 'mozilla-central', 'aaaaaa', 'b1',
+                90, 150, 'm1', 110, 1),
+            self.Row(1, 12, 'mozilla-central', 'bbbbbb', 'b1',
+                120, 150, 'm1', 110, 1),
+            self.Row(2, 13, 'elm', None, 'b2', 130, 160, 'm1', 140, 1),
+            ]
+        resolve = lambda b: b if b != 'elm' else None
+        builds = list(query._groupRunningBuilds(iter(rows), resolve))
+        self.assertEqual(builds, [
+            ('mozilla-central', 'bbbbbb', dict(buildername='b1',
+                last_heartbeat=150, claimed_by_name='m1', start_time=110,
+                number=1, id=1, revision='bbbbbb', request_ids=[11, 10, 12],
+                submitted_at=90)),
+            ('Unknown', 'Unknown', dict(buildername='b2',
+                last_heartbeat=160, claimed_by_name='m1', start_time=140,
+                number=1, id=2, revision=None, request_ids=[13],
+                submitted_at=130)),
+            ])
+        self.assertEqual(list(query._groupRunningBuilds([], resolve)), [])
+
+
+class TestIterBuilds(TestCase):
+
+    def setUp(self):
+        self.engine = sqlalchemy.create_engine("sqlite:///:memory:")
+        sql = open(os.path.join(os.path.dirname(__file__), "state.sql")).read().split(";")
+        for line in sql:
+            line = line.strip()
+            if line:
+                self.engine.execute(line)
+        init_scheduler_model(self.engine)
+
+    def test_same_as_GetBuilds(self):
+        # pending builds of a branch under another name, which sorts apart
+        # from branch1, and without a branch
+        for id, branch in ((10, 'releases/branch1'), (11, None)):
+            self.engine.execute("INSERT INTO sourcestamps (id, branch, "
+                "revision) VALUES (?, ?, ?)", id, branch, '123456789')
+            self.engine.execute("INSERT INTO buildsets (id, reason, "
+                "sourcestampid, submitted_at) VALUES (?, 'scheduler', ?, 1)",
+                id, id)
+            self.engine.execute("INSERT INTO buildrequests (id, buildsetid, "
+                "buildername, priority, claimed_at, complete, submitted_at) "
+                "VALUES (?, ?, 'branch1-build', 0, 0, 0, 1)", id, id)
+
+        queries = []
+        sqlalchemy.event.listen(self.engine, 'before_cursor_execute',
+                lambda *args: queries.append(args[2]))
+        with mock.patch.object(query, 'GetAllBranches',
+                return_value=['branch1', 'branch1', 'branch2']), \
+                mock.patch.object(query, 'GetAllBranchLongnames',
+                return_value=['branch1', 'branch2', 'releases/branch1']):
+            for type in ('pending', 'running'):
+                builds = query.GetBuilds(type=type)
+                del queries[:]
+                self.assertEqual(json.loads(''.join(jsonstream.iterencode(
+                    query.IterBuilds(type=type)))),
+                    json.loads(json.dumps(builds)))
+                self.assertTrue(builds)
+                self.assertEqual(len(queries), 1)
+
+
+class TestPaging(TestCase):
+
+    Row = namedtuple('Row', 'build_id claimed_by_name claimed_by_incarnation '
+            'claimed_at buildername number')
+
+    def rows(self, *builds):
+        return [self.Row(build_id, 'm', 'i', 0, 'b', number)
+                for build_id, number in builds]
+
+    def test_splitPage(self):
+        rows = self.rows((10, 1), (9, 2), (8, 2), (7, 3))
+        self.assertEqual(builds._splitPage(rows, 5), (rows, None))
+        self.assertEqual(builds._splitPage(rows, 0), (rows, None))
+        self.assertEqual(builds._splitPage(rows, 4), (rows[:3], 8))
+        self.assertEqual(builds._splitPage(rows[:3], 3), (rows[:1], 10))
+        rows = self.rows((10, 1), (9, 1))
+        self.assertEqual(builds._splitPage(rows, 2), (rows, 9))
+
+    def test_getBuildsForUser(self):
+        engine = sqlalchemy.create_engine("sqlite:///:memory:")
+        sql = open(os.path.join(os.path.dirname(__file__), "state.sql")).read().split(";")
+        for line in sql:
+            line = line.strip()
+            if line:
+                engine.execute(line)
+        init_scheduler_model(engine)
+
+        first = builds.getBuildsForUser('branch1', 'sendchange', limit=1)
+        self.assertEqual([b['build_id'] for b in first['builds']], [1])
+        self.assertEqual(first['next'], 1)
+        self.assertTrue(first['pending'])
+        rest = builds.getBuildsForUser('branch1', 'sendchange', limit=1,
+                before=first['next'])
+        self.assertEqual(rest, {'builds': [], 'running': [], 'pending': [],
+            'next': None})
+
+
+class TestUnionQuery(TestCase):
+
+    def setUp(self):
+        self.engine = sqlalchemy.create_engine("sqlite:///:memory:")
+        sql = open(os.path.join(os.path.dirname(__file__), "state.sql")).read().split(";")
+        for line in sql:
+            line = line.strip()
+            if line:
+                self.engine.execute(line)
+        init_scheduler_model(self.engine)
+
+        self.queries = []
+        sqlalchemy.event.listen(self.engine, 'before_cursor_execute',
+                lambda *args: self.queries.append(args[2]))
+
+    def separately(self, func, *args, **kwargs):
+        """Returns what `func` does when each of its queries is run on its
+        own"""
+        executeQueries = builds.executeQueries
+        with mock.patch.object(builds, 'executeQueries',
+                lambda queries, params=None:
+                    executeQueries(queries, params, union=False)):
+            with mock.patch.object(cache, 'executeQueries',
+                    lambda queries, params=None:
+                    executeQueries(queries, params, union=False)):
+                return func(*args, **kwargs)
+
+    def check(self, func, *args, **kwargs):
+        expected = self.separately(func, *args, **kwargs)
+        self.assertTrue(expected)
+        self.queries = []
+        self.assertEqual(func(*args, **kwargs), expected)
+        self.assertEqual(len(self.queries), 1)
+
+    def test_getBuilds(self):
+        self.check(builds.getBuilds, 'branch1')
+        self.check(builds.getBuilds, 'branch2', limit=1)
+
+    def test_getRevision(self):
+        self.check(builds.getRevision, 'branch1', '123456789')
+
+    def test_getBuildsForUser(self):
+        self.check(builds.getBuildsForUser, 'branch1', 'sendchange')
+
+    def test_cache_getBuilds(self):
+        self.check(cache.getBuilds, 'branch1', 0, 2**31)
+
+class TestStatements(TestCase):
+
+    def setUp(self):
+        self.engine = sqlalchemy.create_engine("sqlite:///:memory:")
+        sql = open(os.path.join(os.path.dirname(__file__), "state.sql")).read().split(";")
+        for line in sql:
+            line = line.strip()
+            if line:
+                self.engine.execute(line)
+        init_scheduler_model(self.engine)
+
+        patcher = mock.patch.multiple(statements, _statements={},
+                _compiled={}, _engines={}, _streaming_engines={})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_cached(self):
+        q = builds.getBuildsStatement(True, True)
+        self.assertTrue(builds.getBuildsStatement(True, True) is q)
+        self.assertFalse(builds.getBuildsStatement(True, False) is q)
+
+    def test_compiled_once(self):
+        builds.getBuilds('branch1')
+        compiled = len(statements._compiled)
+        self.assertTrue(compiled)
+        builds.getBuilds('branch2', starttime=1, endtime=2**31)
+        builds.getBuilds('branch1')
+        self.assertEqual(len(statements._compiled), compiled + 1)
+
+    def test_same_as_query(self):
+        for kwargs in (dict(), dict(branch_name='branch1'),
+                dict(starttime=0, endtime=2**31, changeid_all=True)):
+            expected = buildrequest.BuildRequestsQuery(**kwargs).execute()
+            self.assertEqual(
+                map(tuple, buildrequest.ExecuteBuildRequestsQuery(**kwargs)),
+                map(tuple, expected))
+
+    def test_stream(self):
+        q = buildrequest.BuildRequestsStatement()
+        expected = map(tuple, statements.execute(q))
+        self.assertTrue(len(expected) > 2)
+        self.assertEqual(map(tuple, statements.stream(q, batch_size=2)),
+            expected)
+        self.assertTrue(statements._streaming_engines)
+
+    def test_iter_rows(self):
+        results = mock.Mock()
+        results.fetchmany.side_effect = [[1, 2], [3], []]
+        rows = statements.iterRows(results, batch_size=2)
+        self.assertEqual(rows.next(), 1)
+        self.assertFalse(results.close.called)
+        self.assertEqual(list(rows), [2, 3])
+        self.assertEqual(results.fetchmany.call_args_list,
+            [mock.call(2)] * 3)
+        self.assertTrue(results.close.called)
+
+        # results left half way through are closed too
+        results = mock.Mock()
+        results.fetchmany.return_value = [1, 2]
+        rows = statements.iterRows(results, batch_size=2)
+        rows.next()
+        rows.close()
+        self.assertTrue(results.close.called)
+
+def create_status_tables():
+    """Creates the status db tables the slaves module needs, and imports it"""
+    engine = sqlalchemy.create_engine("sqlite:///:memory:")
+    for sql in (
+            "CREATE TABLE builders (id INTEGER PRIMARY KEY, name VARCHAR)",
+            "CREATE TABLE slaves (id INTEGER PRIMARY KEY, name VARCHAR)",
+            "CREATE TABLE builds (id INTEGER PRIMARY KEY, "
+                "builder_id INTEGER, slave_id INTEGER, "
+                "starttime TIMESTAMP, endtime TIMESTAMP, result INTEGER)",
+            ):
+        engine.execute(sql)
+    init_status_model(engine)
+    from buildapi.model import slaves
+    return slaves
+
+class SchedulerData(object):
+    """Fills a scheduler db with build requests over three days"""
+    buildernames = ['Linux mozilla-central build',
+                    'WINNT 5.2 mozilla-central opt test mochitests-1/5',
+                    'Rev3 Fedora 12 mozilla-central talos dromaeo',
+                    'Linux x86-64 mozilla-central leak test build',
+                    'Linux mozilla-central l10n nightly',
+                    'unknown builder']
+    branches = ['mozilla-central', 'mozilla-central', 'try',
+                'mozilla-central-l10n']
+
+    db_url = "sqlite:///:memory:"
+
+    def setUp(self):
+        self.engine = sqlalchemy.create_engine(self.db_url)
+        sql = open(os.path.join(os.path.dirname(__file__), "state.sql")).read().split(";")
+        for line in sql:
+            line = line.strip()
+            if line:
+                self.engine.execute(line)
+        init_scheduler_model(self.engine)
+        init_buildapi_model(self.engine)
+
+        patcher = mock.patch.object(waittimes, 'get_masters_for_pool',
+                lambda pool: ['master1'])
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.start = rollups.hourOf(1286000000)
+        self.populate(random.Random(1), 400, 3 * 86400)
+
+    def tearDown(self):
+        meta.buildapi_db_meta.bind = None
+
+    def populate(self, rnd, num_requests, span):
+        e = self.engine
+        for i in range(100, 100 + num_requests):
+            submitted_at = self.start + rnd.randint(0, span)
+            e.execute("INSERT INTO sourcestamps (id, branch, revision) "
+                    "VALUES (?, ?, ?)", i, rnd.choice(self.branches),
+                    '%040x' % i)
+            if rnd.random() < 0.9:
+                e.execute("INSERT INTO changes (changeid, author, comments, "
+                        "is_dir, revlink, when_timestamp) VALUES "
+                        "(?, 'a', '', 0, 'http://hg.mozilla.org/x', ?)",
+                        i, submitted_at - rnd.randint(0, 600))
+                e.execute("INSERT INTO sourcestamp_changes VALUES (?, ?)",
+                        i, i)
+            e.execute("INSERT INTO buildsets (id, reason, sourcestampid, "
+                    "submitted_at) VALUES (?, ?, ?, ?)", i,
+                    rnd.choice(['scheduler', 'Rebuilt by someone']), i,
+                    submitted_at)
+
+            buildername = rnd.choice(self.buildernames)
+            state = rnd.random()
+            if state < 0.1:
+                # pending
+                e.execute("INSERT INTO buildrequests (id, buildsetid, "
+                        "buildername, submitted_at) VALUES (?, ?, ?, ?)",
+                        i, i, buildername, submitted_at)
+                continue
+            start_time = submitted_at + rnd.randint(0, 3000)
+            complete = int(state >= 0.2)
+            complete_at = complete and start_time + rnd.randint(60, 7200) \
+                    or None
+            e.execute("INSERT INTO buildrequests (id, buildsetid, "
+                    "buildername, claimed_at, claimed_by_name, "
+                    "claimed_by_incarnation, complete, results, "
+                    "submitted_at, complete_at) VALUES "
+                    "(?, ?, ?, ?, 'master1', 'i', ?, ?, ?, ?)",
+                    i, i, buildername, start_time, complete,
+                    complete and rnd.choice([0, 1, 2]) or None, submitted_at,
+                    complete_at)
+            e.execute("INSERT INTO builds (number, brid, start_time, "
+                    "finish_time) VALUES (?, ?, ?, ?)", i, i, start_time,
+                    complete_at)
+
+class TestRollups(SchedulerData, TestCase):
+
+    def rollup(self, hours):
+        until = self.start + hours * 3600
+        funcs = [('waittimes', lambda starttime, endtime:
+                    waittimes.RollupWaitTimes(starttime, endtime,
+                        {'buildpool': ['master1'], 'testpool': ['master1']})),
+                 ('pushes', pushes.RollupPushes),
+                 ('builders', builders.RollupBuilders)]
+        for name, func in funcs:
+            self.assertEqual(rollups.updateRollup(name, func, until,
+                since=self.start), until)
+
+    def check(self, func, *args, **kwargs):
+        """Checks that func returns the same report read from the rollups as
+        computed from the scheduler db"""
+        with mock.patch.object(rollups, 'coveredUntil',
+                lambda name, starttime, *args: starttime):
+            expected = func(*args, **kwargs).to_dict()
+        report = func(*args, **kwargs).to_dict()
+        # the order of these doesn't matter
+        for key in ('pending', 'builders'):
+            if key in report:
+                report[key].sort()
+                expected[key].sort()
+        self.assertEqual(report, expected)
+        return report
+
+    def test_coveredUntil(self):
+        self.assertEqual(rollups.coveredUntil('pushes', self.start,
+            self.start + 86400), self.start)
+        self.rollup(24)
+        self.assertEqual(rollups.coveredUntil('pushes', self.start,
+            self.start + 7200), self.start + 7200)
+        self.assertEqual(rollups.coveredUntil('pushes', self.start + 3600,
+            self.start + 86400 * 2), self.start + 86400)
+        self.assertEqual(rollups.coveredUntil('pushes', self.start,
+            self.start + 5000), self.start + 3600)
+        # not on the hour
+        self.assertEqual(rollups.coveredUntil('pushes', self.start + 60,
+            self.start + 86400), self.start + 60)
+        self.assertEqual(rollups.coveredUntil('pushes', self.start,
+            self.start + 86400, 1800), self.start)
+        # not covered
+        self.assertEqual(rollups.coveredUntil('pushes', self.start - 3600,
+            self.start + 86400), self.start - 3600)
+
+    def test_incremental(self):
+        self.rollup(10)
+        self.rollup(50)
+        counts = self.engine.execute("SELECT COUNT(*), SUM(total) "
+                "FROM pushes_rollup").fetchone()
+        self.rollup(50)
+        self.assertEqual(self.engine.execute("SELECT COUNT(*), SUM(total) "
+                "FROM pushes_rollup").fetchone(), counts)
+
+    def test_waittimes(self):
+        self.rollup(50)
+        pending = []
+        for pool in ('buildpool', 'testpool'):
+            report = self.check(waittimes.GetWaitTimes, pool=pool, mpb=15,
+                    maxb=60, starttime=self.start + 3600,
+                    endtime=self.start + 3 * 86400 - 1800, int_size=3 * 3600)
+            self.assertTrue(report['total'])
+            pending.extend(report['pending'])
+        self.assertTrue(pending)
+        self.check(waittimes.GetWaitTimes, mpb=10, starttime=self.start,
+                endtime=self.start + 86400)
+
+    def test_pushes(self):
+        self.rollup(50)
+        report = self.check(pushes.GetPushes, starttime=self.start,
+                endtime=self.start + 3 * 86400, int_size=7200)
+        self.assertTrue(report['total'])
+        self.check(pushes.GetPushes, starttime=self.start,
+                endtime=self.start + 3 * 86400, branches=['try'])
+
+    def test_builders(self):
+        self.rollup(50)
+        report = self.check(builders.GetBuildersReport, starttime=self.start,
+                endtime=self.start + 3 * 86400 - 100, detail_level='job_type')
+        self.assertTrue(report['builders'])
+        self.check(builders.GetBuildersReport, starttime=self.start,
+                endtime=self.start + 86400, branch_name='try',
+                detail_level='platform')
+
+class TestShards(SchedulerData, TestCase):
+
+    def check(self, func, **kwargs):
+        """Checks that func returns the same report merged out of shards as
+        computed in one go"""
+        expected = func(**kwargs).to_dict()
+        report = func(sharded=True, **kwargs).to_dict()
+        for r in (report, expected):
+            for key in ('pending', 'builders'):
+                if key in r:
+                    r[key].sort()
+            # the order of these doesn't matter either
+            for run in r.get('build_runs', {}).values():
+                run['authors'].sort()
+                run['changes_revision'].sort()
+        self.assertEqual(report, expected)
+        return report
+
+    def test_dayRanges(self):
+        midnight = self.start - self.start % 86400
+        start = midnight + 6 * 3600
+        self.assertEqual(shards.dayRanges(start, start + 2 * 86400),
+            [(start, midnight + 86400), (midnight + 86400, midnight + 2 * 86400),
+             (midnight + 2 * 86400, start + 2 * 86400)])
+        self.assertEqual(shards.dayRanges(start, start + 2 * 86400, 7200),
+            shards.dayRanges(start, start + 2 * 86400))
+        # intervals of 5 hours never start at midnight
+        self.assertEqual(shards.dayRanges(start, start + 2 * 86400, 5 * 3600),
+            [(start, start + 2 * 86400)])
+        self.assertEqual(shards.dayRanges(midnight, midnight + 3600),
+            [(midnight, midnight + 3600)])
+
+    def test_interval_offset(self):
+        report = pushes.PushesReport(self.start, self.start + 86400, 3600)
+        self.assertEqual(report.get_interval_offset(pushes.PushesReport(
+            self.start + 7200, self.start + 86400, 3600)), 2)
+        for starttime, endtime, int_size in (
+                (self.start + 1800, self.start + 86400, 3600),
+                (self.start + 7200, self.start + 86400, 1800),
+                (self.start - 3600, self.start + 86400, 3600),
+                (self.start, self.start + 86401, 3600)):
+            self.assertRaises(ValueError, report.get_interval_offset,
+                pushes.PushesReport(starttime, endtime, int_size))
+
+    def test_pushes(self):
+        report = self.check(pushes.GetPushes, starttime=self.start,
+            endtime=self.start + 3 * 86400, int_size=7200)
+        self.assertTrue(report['total'])
+        self.check(pushes.GetPushes, starttime=self.start,
+            endtime=self.start + 3 * 86400, branches=['try'])
+
+    def test_waittimes(self):
+        # a job for a change pushed the day before its buildset was submitted
+        midnight = self.start - self.start % 86400 + 86400
+        e = self.engine
+        e.execute("INSERT INTO sourcestamps (id, branch, revision) "
+                "VALUES (1000, 'mozilla-central', 'abc')")
+        e.execute("INSERT INTO changes (changeid, author, comments, is_dir, "
+                "revlink, when_timestamp) VALUES "
+                "(1000, 'a', '', 0, 'http://hg.mozilla.org/x', ?)",
+                midnight - 1200)
+        e.execute("INSERT INTO sourcestamp_changes VALUES (1000, 1000)")
+        e.execute("INSERT INTO buildsets (id, reason, sourcestampid, "
+                "submitted_at) VALUES (1000, 'scheduler', 1000, ?)",
+                midnight + 60)
+        e.execute("INSERT INTO buildrequests (id, buildsetid, buildername, "
+                "claimed_at, claimed_by_name, claimed_by_incarnation, "
+                "complete, submitted_at) VALUES (1000, 1000, "
+                "'Linux mozilla-central build', ?, 'master1', 'i', 0, ?)",
+                midnight + 120, midnight + 60)
+        e.execute("INSERT INTO builds (number, brid, start_time) "
+                "VALUES (1000, 1000, ?)", midnight + 120)
+
+        report = self.check(waittimes.GetWaitTimes, pool='buildpool',
+            mpb=15, maxb=60, starttime=self.start,
+            endtime=self.start + 3 * 86400 - 1800, int_size=3 * 3600)
+        self.assertTrue(report['total'])
+        self.check(waittimes.GetWaitTimes, pool='testpool',
+            starttime=self.start, endtime=self.start + 2 * 86400)
+
+    def test_builders(self):
+        report = self.check(builders.GetBuildersReport, starttime=self.start,
+            endtime=self.start + 3 * 86400 - 100, detail_level='job_type')
+        self.assertTrue(report['builders'])
+        self.check(builders.GetBuildersReport, starttime=self.start,
+            endtime=self.start + 2 * 86400, branch_name='try',
+            detail_level='platform')
+
+        # shards only keep summaries, not a day's worth of build requests
+        shard = builders.GetBuildersReport(starttime=self.start,
+            endtime=self.start + 86400, detail_level='job_type', shard=True)
+        self.assertTrue(shard.builders.info.get_total_build_requests())
+        self.assertEqual(shard.builders.info.build_requests, [])
+
+    def test_endtoend(self):
+        from buildapi.model import endtoend
+        report = self.check(endtoend.GetEndtoEndTimes, starttime=self.start,
+            endtime=self.start + 3 * 86400)
+        self.assertTrue(report['total_build_requests'])
+
+    def test_slaves(self):
+        slaves = create_status_tables()
+        rnd = random.Random(1)
+        builds = []
+        for i in range(1000):
+            stime = self.start + rnd.randint(0, 2 * 86400 - 1)
+            etime = rnd.choice([None, stime + rnd.randint(0, 7200)])
+            slave_id = rnd.randint(0, 20)
+            builds.append(slaves.Build(slave_id=slave_id,
+                slave_name='linux-ix-slave%02i' % slave_id,
+                result=rnd.choice([None, 0, 1, 2]),
+                starttime=datetime.fromtimestamp(stime),
+                endtime=etime and datetime.fromtimestamp(etime)))
+
+        ranges = shards.dayRanges(self.start, self.start + 2 * 86400)
+        expected = slaves.SlavesReport(self.start, self.start + 2 * 86400,
+            last_int_size=3 * 3600)
+        report = slaves.SlavesReport(self.start, self.start + 2 * 86400,
+            last_int_size=3 * 3600)
+        for starttime, endtime in ranges:
+            shard = slaves.SlavesReport(starttime, endtime,
+                last_int_size=3 * 3600)
+            for build in builds:
+                if starttime <= build.starttime < endtime:
+                    shard.add(build)
+                    expected.add(build)
+            report.merge(shard)
+
+        key = lambda slave: slave['slave_id']
+        self.assertEqual(sorted(report.to_dict()['slaves'], key=key),
+            sorted(expected.to_dict()['slaves'], key=key))
+        self.assertEqual(report.get_int_busy(), expected.get_int_busy())
+        self.assertEqual(report.endtime_total_busy(),
+            expected.endtime_total_busy())
+
+    def test_cache(self):
+        backend = LocalCache(codec=Codec(FORMAT_JSON))
+        with mock.patch.object(shards, 'cache', cache.ShardCache(backend)):
+            computeShards = mock.Mock(wraps=shards.computeShards)
+            with mock.patch.object(shards, 'computeShards', computeShards):
+                report = self.check(pushes.GetPushes, starttime=self.start,
+                    endtime=self.start + 3 * 86400)
+                # only the two whole days are cached
+                midnight = self.start - self.start % 86400 + 86400
+                self.assertEqual(len(backend.store), 2)
+                self.assertEqual(len(computeShards.call_args[0][1]), 4)
+
+                # they've all settled, but the partial days are computed
+                self.assertEqual(pushes.GetPushes(starttime=self.start,
+                    endtime=self.start + 3 * 86400, sharded=True).to_dict(),
+                    report)
+                self.assertEqual(computeShards.call_args[0][1],
+                    [(self.start, midnight),
+                     (midnight + 2 * 86400, self.start + 3 * 86400)])
+
+                # days that haven't settled aren't cached
+                with mock.patch.object(shards.time, 'time',
+                    lambda: self.start + 2 * 86400):
+                    self.check(waittimes.GetWaitTimes, starttime=self.start,
+                        endtime=self.start + 3 * 86400)
+                self.assertEqual(len(backend.store), 2)
+                self.check(waittimes.GetWaitTimes, starttime=midnight,
+                    endtime=midnight + 86400)
+                self.assertEqual(len(backend.store), 3)
+
+    def test_cache_dump(self):
+        from buildapi.model import endtoend
+        midnight = self.start - self.start % 86400 + 86400
+        for func, kwargs in ((pushes.GetPushes, {}),
+                (waittimes.GetWaitTimes, {'pool': 'buildpool'}),
+                (builders.GetBuildersReport, {'detail_level': 'job_type'}),
+                (endtoend.GetEndtoEndTimes, {})):
+            backend = LocalCache(codec=Codec(FORMAT_JSON))
+            with mock.patch.object(shards, 'cache', cache.ShardCache(backend)):
+                report = self.check(func, starttime=midnight,
+                    endtime=midnight + 2 * 86400, **kwargs)
+                self.assertEqual(len(backend.store), 2)
+                # the same report, out of the shards loaded from the cache
+                self.assertEqual(self.check(func, starttime=midnight,
+                    endtime=midnight + 2 * 86400, **kwargs), report)
+
+        slaves = create_status_tables()
+        report = slaves.SlavesReport(midnight, midnight + 86400,
+            last_int_size=3600)
+        report.add(slaves.Build(slave_id=1, slave_name='slave1', result=0,
+            starttime=datetime.fromtimestamp(midnight + 60),
+            endtime=datetime.fromtimestamp(midnight + 600)))
+        loaded = shards.loadShard(json.loads(json.dumps(
+            shards.dumpShard(report))))
+        self.assertEqual(loaded.to_dict(), report.to_dict())
+        self.assertEqual(loaded.get_int_busy(), report.get_int_busy())
+
+        self.assertRaises(TypeError, shards.dumpShard, object())
+        self.assertRaises(ValueError, shards.loadShard,
+            {'class': 'subprocess.Popen', 'state': {'dict': []}})
+
+    def test_cache_corrupt(self):
+        backend = LocalCache()
+        shard_cache = cache.ShardCache(backend)
+        report = pushes.PushesReport(self.start, self.start + 86400, 3600)
+        shard_cache.put('shards:a', report)
+        backend.put('shards:b', 'garbage')
+        backend.put('shards:c', {'class': 'os.system', 'state': 'true'})
+        found = shard_cache.get_multi(['shards:a', 'shards:b', 'shards:c',
+            'shards:d'])
+        self.assertEqual(found.keys(), ['shards:a'])
+        self.assertEqual(found['shards:a'].to_dict(), report.to_dict())
+        self.assertEqual(cache.BuildapiCache.key_family(shards.shardKey(
+            pushes.GetPushes, 1, 2, {})), 'shards:GetPushes')
+
+    def test_cache_key(self):
+        key = shards.shardKey(waittimes.GetWaitTimes, 1, 2,
+            {'pool': 'build pool', 'mpb': 15})
+        # memcached keys can't have spaces or control characters
+        self.assertTrue(re.match(r'[\x21-\x7e]+$', key), key)
+        self.assertNotEqual(key, shards.shardKey(waittimes.GetWaitTimes, 1,
+            2, {'pool': 'build pool', 'mpb': 10}))
+
+    def test_cache_put_error(self):
+        backend = mock.Mock()
+        backend.put.side_effect = ValueError("bad key")
+        with mock.patch.object(shards, 'cache', cache.ShardCache(backend)):
+            backend.get_multi.return_value = {}
+            self.check(pushes.GetPushes, starttime=self.start,
+                endtime=self.start + 2 * 86400)
+        self.assertTrue(backend.put.called)
+
+    def test_reports_mismatch(self):
+        report = waittimes.WaitTimesReport('buildpool', self.start,
+            self.start + 86400, mpb=15)
+        self.assertRaises(ValueError, report.merge, waittimes.WaitTimesReport(
+            'buildpool', self.start, self.start + 86400, mpb=10))
+        report = builders.BuildersReport(self.start, self.start + 86400,
+            'try')
+        self.assertRaises(ValueError, report.merge, builders.BuildersReport(
+            self.start, self.start + 86400, 'mozilla-central'))
+
+class TestReportCache(TestCase):
+
+    def test_stats(self):
+        def beaker_cache(**kwargs):
+            # like beaker_cache, without pylons
+            def decorate(func):
+                values = {}
+                def get(**params):
+                    key = tuple(sorted(params.items()))
+                    if key not in values:
+                        values[key] = func(**params)
+                    return values[key]
+                return get
+            return decorate
+
+        stats = CacheStats()
+        with mock.patch.object(cache, 'beaker_cache', beaker_cache), \
+                mock.patch.object(cache, 'g', mock.Mock(cache_stats=stats)):
+            @cache.report_cache('pushes', expire=600, cache_response=False)
+            def get_report(**params):
+                return params['starttime']
+            self.assertEqual(get_report(starttime=1), 1)
+            self.assertEqual(get_report(starttime=1), 1)
+
+        family = stats.to_dict()['reports:pushes']
+        self.assertEqual(family['counters'],
+            {'get': 2, 'hit': 1, 'miss': 1, 'fill': 1})
+        self.assertEqual(family['hit_ratio'], .5)
+
+class TestShardProcesses(SchedulerData, TestCase):
+
+    def setUp(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        self.db_url = "sqlite:///%s" % os.path.join(tmpdir, "scheduler.db")
+        SchedulerData.setUp(self)
+
+    def test_processes(self):
+        expected = pushes.GetPushes(starttime=self.start,
+            endtime=self.start + 3 * 86400, int_size=3600).to_dict()
+        shards.startProcesses(2)
+        self.addCleanup(shards.stopProcesses)
+        with mock.patch.object(shards, 'computeShards',
+            mock.Mock(wraps=shards.computeShards)) as computeShards:
+            report = pushes.GetPushes(starttime=self.start,
+                endtime=self.start + 3 * 86400, int_size=3600, sharded=True)
+        self.assertEqual(report.to_dict(), expected)
+        self.assertEqual(len(computeShards.call_args[0][1]), 4)
+
+class TestBuildRequest(TestCase):
+
+    def setUp(self):
+        self.engine = sqlalchemy.create_engine("sqlite:///:memory:")
+        sql = open(os.path.join(os.path.dirname(__file__), "state.sql")).read().split(";")
+        for line in sql:
+            line = line.strip()
+            if line:
+                self.engine.execute(line)
+        init_scheduler_model(self.engine)
+
+    def test_from_row(self):
+        for r in buildrequest.BuildRequestsQuery().execute():
+            params = dict((str(k), v) for (k, v) in dict(r).items())
+            expected = buildrequest.BuildRequest(**params)
+            br = buildrequest.BuildRequest.from_row(r)
+            self.assertEqual(br.to_dict(), expected.to_dict())
+            self.assertFalse(hasattr(br, '__dict__'))
+
+    def test_sets(self):
+        br = buildrequest.BuildRequest(changeid=1, author='a')
+        self.assertEqual(br.changeid, set([1]))
+        br.add_changeid(1)
+        self.assertEqual(br._changeid, 1)
+        br.add_changeid(2)
+        br.add_changeid(3)
+        self.assertEqual(br.changeid, set([1, 2, 3]))
+        br.add_author(None)
+        self.assertEqual(br.authors, set(['a', None]))
+        self.assertEqual(br.to_dict()['authors'], ['a'])
+
+    def test_lazy(self):
+        br = buildrequest.BuildRequest(buildername='Linux mozilla-central build',
+                branch='mozilla-central')
+        self.assertEqual(br._classification, None)
+        self.assertEqual((br.platform, br.build_type, br.job_type),
+                util.classify_buildername(br.buildername))
+        self.assertEqual(br.branch_name,
+                util.get_branch_name('mozilla-central'))
+
+    def test_pickle(self):
+        import pickle
+        br = buildrequest.BuildRequest(buildername='Linux mozilla-central build',
+                branch='mozilla-central', changeid=1)
+        br.add_changeid(2)
+        br.branch_name
+        for protocol in (0, 2):
+            loaded = pickle.loads(pickle.dumps(br, protocol))
+            self.assertEqual(loaded.to_dict(), br.to_dict())
+
+class TestIntervalCounts(TestCase):
+
+    def test_add(self):
+        counts = reports.IntervalCounts(5)
+        counts.add(1, 3)
+        counts.add(2, 10, count=2)
+        counts.add(-1, 1)
+        counts.add(4, 4)
+        self.assertEqual(counts.get_counts(), [1, 1, 3, 2, 2])
+
+    def test_add_union(self):
+        counts = reports.IntervalCounts(10)
+        counts.add_union([(0, 2), (1, 3), (3, 4), (6, 5), (6, 8), (7, 7)])
+        self.assertEqual(counts.get_counts(), [1, 1, 1, 1, 0, 0, 1, 1, 0, 0])
+
+    def int_busy(self, report, slave):
+        """The intervals a slave was busy in, worked out one by one"""
+        disc_intervals = set()
+        intervals = sorted(slave.busy)
+        intervals.append((report.endtime, None, None))
+        for inter in xrange(len(intervals) - 1):
+            start, end, _ = intervals[inter]
+            end = min(end or (intervals[inter + 1][0] - 1),
+                report.endtime - 1)
+            disc_intervals.update(xrange(report.get_interval_index(start),
+                report.get_interval_index(end)))
+        return disc_intervals
+
+    def test_slaves(self):
+        slaves = create_status_tables()
+
+        rnd = random.Random(1)
+        starttime = 1286000000
+        report = slaves.SlavesReport(starttime, starttime + 86400,
+                int_size=300)
+        names = ['linux-ix-slave%02i', 'moz2-win32-slave%02i']
+        for i in range(2000):
+            stime = starttime + rnd.randint(-3600, 86400)
+            etime = rnd.choice([None, stime + rnd.randint(0, 7200)])
+            slave_id = rnd.randint(0, 40)
+            report.add(slaves.Build(slave_id=slave_id,
+                slave_name=names[slave_id % 2] % slave_id,
+                starttime=datetime.fromtimestamp(stime),
+                endtime=etime and datetime.fromtimestamp(etime)))
+
+        expected = [0] * report.int_no
+        for slave in report.slaves.values():
+            for idx in self.int_busy(report, slave):
+                expected[idx] += 1
+        self.assertEqual(report.get_int_busy(), expected)
+
+        int_busy, totals = report.get_int_busy_silos()
+        self.assertEqual(int_busy['Totals'], expected)
+        self.assertEqual(totals['Totals'], 41)
+        expected = [0] * report.int_no
+        for slave in report.slaves.values():
+            if slave.name.startswith('linux-ix'):
+                for idx in self.int_busy(report, slave):
+                    expected[idx] += 1
+        self.assertEqual(int_busy['linux-ix'], expected)
+
+    def test_idlejobs(self):
+        rnd = random.Random(1)
+        starttime = 1286000000
+        report = idlejobs.IdleJobsReport(starttime, starttime + 86400,
+                int_size=300)
+        expected = [0] * report.int_no
+        for i in range(500):
+            stime = starttime + rnd.randint(-3600, 86000)
+            etime = stime + rnd.randint(0, 7200)
+            report.add(rnd.choice(['a', 'b']),
+                dict(starttime=stime, endtime=min(etime, starttime + 86399)))
+            for idx in report.get_interval_indices(stime,
+                    min(etime, starttime + 86399)):
+                expected[idx] += 1
+        self.assertEqual(report.builder_intervals['Total'], expected)
+        self.assertEqual(map(sum, zip(report.builder_intervals['a'],
+            report.builder_intervals['b'])), expected)
+
+class TestQuantileSketch(TestCase):
+
+    def setUp(self):
+        rnd = random.Random(1)
+        self.values = [int(rnd.lognormvariate(7, 1.5)) for i in range(10000)]
+
+    def sketch(self, values):
+        sketch = reports.QuantileSketch()
+        for value in values:
+            sketch.add(value)
+        return sketch
+
+    def test_quantile(self):
+        sketch = self.sketch(self.values)
+        values = sorted(self.values)
+        for q in (0.01, 0.5, 0.9, 0.99):
+            exact = values[int(q * (len(values) - 1))]
+            self.assertTrue(abs(sketch.quantile(q) - exact) <= 0.01 * exact,
+                (q, sketch.quantile(q), exact))
+        self.assertEqual(sketch.quantile(0), values[0])
+        self.assertEqual(sketch.quantile(1), values[-1])
+        # the buckets of values up to a week in seconds
+        self.assertTrue(len(sketch._bins) < 700)
+
+        self.assertEqual(reports.QuantileSketch().quantile(0.5), None)
+        sketch = self.sketch([0, 0, 0, 10])
+        self.assertEqual(sketch.quantile(0.5), 0)
+        self.assertEqual(sketch.quantile(1), 10)
+
+    def test_merge(self):
+        expected = self.sketch(self.values).to_dict()
+        sketch = reports.QuantileSketch()
+        for start in range(0, len(self.values), 3000):
+            sketch.merge(self.sketch(self.values[start:start + 3000]))
+        self.assertEqual(sketch.to_dict(), expected)
+        self.assertEqual(reports.QuantileSketch.from_dict(
+            json.loads(json.dumps(expected))).to_dict(),
+            json.loads(json.dumps(expected)))
+        self.assertRaises(ValueError, sketch.merge,
+            reports.QuantileSketch(relative_accuracy=0.02))
+
+    def test_collapse(self):
+        sketch = reports.QuantileSketch(max_buckets=10)
+        for value in self.values:
+            sketch.add(value)
+        self.assertEqual(len(sketch._bins), 10)
+        self.assertEqual(sketch.count, len(self.values))
+        self.assertEqual(sketch.quantile(1), max(self.values))
+
+    def test_builder_rollup(self):
+        # rolled up without the sketch
+        report = builders.BuilderTypeReport(buildername='Linux build')
+        report.add_rollup(0, 5, 500, 20, 200)
+        self.assertEqual(report.get_run_time_percentile(0), 20)
+        self.assertAlmostEqual(report.get_run_time_percentile(50), 93.3,
+            delta=1)
+        self.assertEqual(report.get_run_time_percentile(100), 200)
+
+    def test_waittimes(self):
+        starttime = 1286000000
+        report = waittimes.WaitTimesReport('buildpool', starttime,
+            starttime + 86400, masters=['master1'])
+        for wait in range(100):
+            report.add(waittimes.WaitTime(starttime, starttime + wait * 60 + 30,
+                'linux', buildername='Linux mozilla-central build'))
+        platform = report.to_dict()['platforms']['linux']
+        self.assertAlmostEqual(platform['p50_wait_time'], 49, delta=0.5)
+        self.assertAlmostEqual(platform['p90_wait_time'], 89, delta=0.9)
+        self.assertEqual(platform['wait_time_sketch']['count'], 100)
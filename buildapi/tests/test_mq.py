@@ -299,6 +299,27 @@ class TestRequester(Base, TestCase):
             u'id': 1},
         ])
 
+    def test_done_invalidates_cache(self):
+        buildapi_cache = mock.Mock()
+        cons = mq.LoggingJobRequestDoneConsumer(self.engine, self.config,
+                buildapi_cache=buildapi_cache)
+        cons._clock = lambda: 123456
+        self.patch_consumer_to_stop(cons)
+        self.declare(cons.queue)
+
+        r = buildapidb.JobRequest(action='cancel_revision', who='me',
+                when=123456, what='{"branch": "branch1", "revision": "abcd"}')
+        s = sessionmaker(bind=self.engine)()
+        s.add(r)
+        s.commit()
+
+        msg = {'body': 'action result', 'request_id': r.id}
+        self.send_message('buildapi-test', 'finished', msg)
+        cons.run()
+
+        buildapi_cache.job_finished.assert_called_with('cancel_revision',
+                {'branch': 'branch1', 'revision': 'abcd'})
+
 
 class TestWorker(Base, TestCase):
 
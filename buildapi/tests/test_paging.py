@@ -0,0 +1,19 @@
+from unittest import TestCase
+
+from buildapi.lib.paging import encode_cursor, decode_cursor
+
+
+class TestCursor(TestCase):
+
+    def test_roundtrip(self):
+        for values in ([1], [1285844043, 2**40], [0, -1]):
+            cursor = encode_cursor(*values)
+            self.assertTrue('=' not in cursor and '/' not in cursor)
+            self.assertEqual(decode_cursor(cursor, len(values)), values)
+        self.assertEqual(decode_cursor(unicode(encode_cursor(5)), 1), [5])
+
+    def test_invalid(self):
+        for cursor, count in (('', 1), ('!!!', 1), ('x', 1),
+                (encode_cursor(1, 2), 1), (encode_cursor('a'), 1),
+                (encode_cursor(1.5), 1), (u'\u2603', 1)):
+            self.assertRaises(ValueError, decode_cursor, cursor, count)
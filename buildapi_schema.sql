@@ -8,3 +8,50 @@ CREATE TABLE jobrequests (
 	complete_data VARCHAR, 
 	PRIMARY KEY (id)
 );
+CREATE INDEX ix_jobrequests_when_id ON jobrequests ("when", id);
+CREATE TABLE revision_index (
+	sourcestampid INTEGER NOT NULL, 
+	revision VARCHAR(12) NOT NULL, 
+	PRIMARY KEY (sourcestampid)
+);
+CREATE INDEX ix_revision_index_revision ON revision_index (revision);
+CREATE TABLE rollups (
+	name VARCHAR(32) NOT NULL, 
+	starttime INTEGER NOT NULL, 
+	endtime INTEGER NOT NULL, 
+	PRIMARY KEY (name)
+);
+CREATE TABLE waittimes_rollup (
+	id INTEGER NOT NULL, 
+	pool VARCHAR(32) NOT NULL, 
+	hour INTEGER NOT NULL, 
+	buildername VARCHAR(256) NOT NULL, 
+	stime INTEGER NOT NULL, 
+	wait INTEGER, 
+	total INTEGER NOT NULL, 
+	no_changes INTEGER NOT NULL, 
+	PRIMARY KEY (id)
+);
+CREATE INDEX ix_waittimes_rollup_pool_hour ON waittimes_rollup (pool, hour);
+CREATE TABLE pushes_rollup (
+	id INTEGER NOT NULL, 
+	hour INTEGER NOT NULL, 
+	branch VARCHAR(256), 
+	total INTEGER NOT NULL, 
+	PRIMARY KEY (id)
+);
+CREATE INDEX ix_pushes_rollup_hour ON pushes_rollup (hour);
+CREATE TABLE builders_rollup (
+	id INTEGER NOT NULL, 
+	hour INTEGER NOT NULL, 
+	branch VARCHAR(256), 
+	buildername VARCHAR(256) NOT NULL, 
+	results INTEGER NOT NULL, 
+	total INTEGER NOT NULL, 
+	sum_run_time INTEGER NOT NULL, 
+	min_run_time INTEGER NOT NULL, 
+	max_run_time INTEGER NOT NULL, 
+	run_times TEXT, 
+	PRIMARY KEY (id)
+);
+CREATE INDEX ix_builders_rollup_hour ON builders_rollup (hour);
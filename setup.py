@@ -42,5 +42,6 @@ setup(
 
     [console_scripts]
     selfserve-agent = buildapi.scripts.selfserve_agent:main
+    buildapi-rollup = buildapi.scripts.rollup:main
     """,
 )